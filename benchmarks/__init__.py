@@ -0,0 +1,77 @@
+"""
+Benchmarks offline del bot.
+
+No necesitan Telegram, OpenAI ni BoardGameGeek reales: los escenarios levantan
+servidores locales que imitan a OpenAI y a la XML API2 de BGG (con latencia
+configurable) y generan chats sintéticos en bases de datos temporales.
+
+Uso:
+    python -m benchmarks --salida resultados.json
+    python -m benchmarks --escenarios ingesta,resumen --filas 10000,100000
+    python -m benchmarks --comparar base.json --salida actual.json
+    python -m benchmarks.replay --tasa 200 --duracion 30 --chats 20
+    python -m benchmarks.planes --filas 1000000
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+
+
+def percentiles(muestras: list) -> dict:
+    """Resume una lista de duraciones (segundos) en ms: p50/p95/p99/media/máx"""
+    if not muestras:
+        return {'n': 0}
+
+    ordenadas = sorted(muestras)
+
+    def percentil(p: float) -> float:
+        indice = min(len(ordenadas) - 1, int(round(p / 100 * (len(ordenadas) - 1))))
+        return round(ordenadas[indice] * 1000, 3)
+
+    return {
+        'n': len(ordenadas),
+        'p50_ms': percentil(50),
+        'p95_ms': percentil(95),
+        'p99_ms': percentil(99),
+        'media_ms': round(statistics.fmean(ordenadas) * 1000, 3),
+        'max_ms': round(ordenadas[-1] * 1000, 3),
+    }
+
+
+def commit_actual() -> str:
+    """Hash corto del commit actual, para fechar los resultados"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return 'desconocido'
+
+
+def preparar_entorno(directorio: str, latencia_openai: float, latencia_bgg: float,
+                     pausa_bgg: float):
+    """
+    Arranca los servidores falsos, apunta el bot a ellos e importa el módulo.
+    El bot lee su configuración al importarse, así que esto debe ejecutarse
+    antes de cualquier `import telegram_summary_bot2`.
+
+    Devuelve (módulo_bot, [servidores]) — hay que parar los servidores al terminar.
+    """
+    from benchmarks.servidores import servidor_bgg, servidor_openai
+
+    openai_falso = servidor_openai(latencia_openai)
+    bgg_falso = servidor_bgg(latencia_bgg)
+
+    os.environ['OPENAI_API_KEY'] = 'sk-benchmark'
+    os.environ['OPENAI_BASE_URL'] = f'{openai_falso.url}/v1'
+    os.environ['BGG_API_BASE'] = bgg_falso.url
+    os.environ['BGG_PAUSA_S'] = str(pausa_bgg)
+    os.environ.setdefault('DB_PATH', os.path.join(directorio, 'bot.db'))
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import telegram_summary_bot2 as bot
+
+    return bot, [openai_falso, bgg_falso]
@@ -0,0 +1,169 @@
+"""
+Ejecuta los escenarios de benchmark y guarda los resultados en JSON.
+
+    python -m benchmarks --salida resultados.json
+    python -m benchmarks --escenarios resumen,stats --filas 10000,100000,1000000
+    python -m benchmarks --comparar base.json --salida actual.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+from datetime import datetime
+
+from benchmarks import commit_actual, preparar_entorno
+
+ESCENARIOS = ('ingesta', 'resumen', 'stats', 'datos', 'preprocesado', 'relevancia', 'openai', 'arranque', 'copias', 'precarga',
+              'puesta_al_dia')
+
+
+def _lista_enteros(texto: str) -> list:
+    return [int(x) for x in texto.split(',') if x]
+
+
+def _hojas(datos: dict, prefijo: str = ''):
+    """Recorre un dict anidado devolviendo (ruta, valor) de las hojas numéricas"""
+    for clave, valor in datos.items():
+        ruta = f'{prefijo}.{clave}' if prefijo else clave
+        if isinstance(valor, dict):
+            yield from _hojas(valor, ruta)
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            yield ruta, valor
+
+
+def comparar(base: dict, actual: dict, umbral: float = 0.10) -> list:
+    """
+    Compara dos resultados y devuelve las métricas que empeoran más de `umbral`.
+    En *_ms más es peor; en *_por_s menos es peor.
+    """
+    valores_base = dict(_hojas(base.get('resultados', {})))
+    regresiones = []
+
+    for ruta, valor in _hojas(actual.get('resultados', {})):
+        anterior = valores_base.get(ruta)
+        if not anterior:
+            continue
+        cambio = (valor - anterior) / anterior
+        if ruta.endswith('_ms'):
+            peor = cambio > umbral
+        elif ruta.endswith('_por_s'):
+            peor = cambio < -umbral
+        else:
+            continue
+        marca = '🔴' if peor else '  '
+        print(f"{marca} {ruta}: {anterior} → {valor} ({cambio:+.1%})")
+        if peor:
+            regresiones.append(ruta)
+
+    return regresiones
+
+
+async def ejecutar(args) -> dict:
+    bot, servidores = preparar_entorno(
+        args.directorio, args.latencia_openai, args.latencia_bgg, args.pausa_bgg
+    )
+    from benchmarks import escenarios
+
+    resultados = {}
+    for nombre in args.escenarios:
+        print(f"⏱️ Escenario: {nombre}")
+        if nombre == 'ingesta':
+            resultados[nombre] = await escenarios.escenario_ingesta(
+                bot, args.directorio, mensajes=args.mensajes,
+                usuarios=args.usuarios, palabras_media=args.palabras
+            )
+        elif nombre == 'resumen':
+            resultados[nombre] = await escenarios.escenario_resumen(bot, args.directorio, args.filas)
+        elif nombre == 'stats':
+            resultados[nombre] = await escenarios.escenario_stats(bot, args.directorio, args.filas)
+        elif nombre == 'datos':
+            resultados[nombre] = await escenarios.escenario_datos(bot, args.directorio)
+        elif nombre == 'preprocesado':
+            resultados[nombre] = await escenarios.escenario_preprocesado(bot, args.directorio, args.filas)
+        elif nombre == 'relevancia':
+            resultados[nombre] = await escenarios.escenario_relevancia(bot, args.directorio, args.filas)
+        elif nombre == 'openai':
+            resultados[nombre] = await escenarios.escenario_openai(bot, servidores[0])
+        elif nombre == 'arranque':
+            resultados[nombre] = await escenarios.escenario_arranque(bot, args.directorio)
+        elif nombre == 'copias':
+            resultados[nombre] = await escenarios.escenario_copias(bot, args.directorio, args.filas)
+        elif nombre == 'precarga':
+            resultados[nombre] = await escenarios.escenario_precarga(bot, args.directorio)
+        elif nombre == 'puesta_al_dia':
+            resultados[nombre] = await escenarios.escenario_puesta_al_dia(bot, args.directorio)
+
+    for servidor in servidores:
+        servidor.parar()
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--escenarios', default=','.join(ESCENARIOS),
+                        help=f"Lista separada por comas ({', '.join(ESCENARIOS)})")
+    parser.add_argument('--filas', type=_lista_enteros, default=[10_000, 100_000, 1_000_000],
+                        help='Tamaños de la tabla mensajes para resumen/stats (y de la conversación en preprocesado)')
+    parser.add_argument('--mensajes', type=int, default=5000, help='Mensajes del escenario de ingesta')
+    parser.add_argument('--usuarios', type=int, default=50, help='Usuarios del chat sintético')
+    parser.add_argument('--palabras', type=int, default=12, help='Longitud media de mensaje (palabras)')
+    parser.add_argument('--latencia-openai', type=float, default=0.05, help='Latencia del OpenAI falso (s)')
+    parser.add_argument('--latencia-bgg', type=float, default=0.05, help='Latencia del BGG falso (s)')
+    parser.add_argument('--pausa-bgg', type=float, default=0.0,
+                        help='Pausa de rate limit entre peticiones a BGG (el bot usa 5s en producción)')
+    parser.add_argument('--directorio', default=os.path.join(tempfile.gettempdir(), 'bot_benchmarks'),
+                        help='Dónde guardar las bases de datos sintéticas (se reutilizan)')
+    parser.add_argument('--salida', help='Fichero JSON de resultados')
+    parser.add_argument('--comparar', help='JSON de una ejecución anterior para detectar regresiones')
+    args = parser.parse_args()
+
+    args.escenarios = [e.strip() for e in args.escenarios.split(',') if e.strip()]
+    desconocidos = set(args.escenarios) - set(ESCENARIOS)
+    if desconocidos:
+        parser.error(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+    os.makedirs(args.directorio, exist_ok=True)
+
+    informe = {
+        'meta': {
+            'commit': commit_actual(),
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'config': {k: v for k, v in vars(args).items() if k not in ('salida', 'comparar')},
+        },
+        'resultados': asyncio.run(ejecutar(args)),
+    }
+
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+        print(f"💾 Resultados guardados en {args.salida}")
+    else:
+        print(texto)
+
+    fallidos = [
+        f"{escenario}/{caso}"
+        for escenario, casos in informe['resultados'].items() if isinstance(casos, dict)
+        for caso, datos in casos.items() if isinstance(datos, dict) and datos.get('cumple_objetivo') is False
+    ]
+    if fallidos:
+        print(f"🔴 No cumplen su objetivo: {', '.join(fallidos)}")
+        sys.exit(1)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)
+        regresiones = comparar(base, informe)
+        if regresiones:
+            print(f"🔴 {len(regresiones)} regresión(es) respecto a {base['meta'].get('commit')}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,568 @@
+"""
+Escenarios de benchmark.
+
+Cada escenario recibe el módulo del bot ya importado (con OPENAI_BASE_URL y
+BGG_API_BASE apuntando a los servidores falsos) y devuelve un dict con sus
+mediciones, listo para serializar a JSON.
+"""
+
+import asyncio
+import os
+import sqlite3
+import statistics
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from benchmarks import percentiles
+from benchmarks.generador import GeneradorChat, poblar_db
+from benchmarks.telegram_falso import BotFalso, crear_update
+
+# Las filas sintéticas cubren una semana, el máximo que admite /resumen
+HORAS_HISTORICO = 168
+
+
+def chat_benchmark(bot) -> int:
+    """Un chat_id que pase verificar_acceso()"""
+    return bot.GRUPOS_PERMITIDOS[0] if bot.GRUPOS_PERMITIDOS else -1000000000001
+
+
+def preparar_db(bot, directorio: str, filas: int) -> str:
+    """
+    Devuelve la ruta de una base de datos con `filas` mensajes sintéticos.
+    Se reutiliza entre ejecuciones si ya existe con el tamaño correcto
+    (poblar 1M de filas lleva su tiempo y no es lo que se mide).
+    """
+    ruta = os.path.join(directorio, f'chat_{filas}.db')
+    chat_id = chat_benchmark(bot)
+
+    if os.path.exists(ruta):
+        conn = sqlite3.connect(ruta)
+        existentes = conn.execute(
+            'SELECT COUNT(*) FROM mensajes WHERE chat_id = ?', (chat_id,)
+        ).fetchone()[0]
+        conn.close()
+        if existentes == filas:
+            bot.DB_NAME = ruta
+            bot.inicializar_db()
+            return ruta
+        os.remove(ruta)
+
+    bot.DB_NAME = ruta
+    bot.inicializar_db()
+    generador = GeneradorChat(mensajes_por_hora=filas / HORAS_HISTORICO)
+    poblar_db(ruta, chat_id, generador, filas)
+    return ruta
+
+
+def _cronometrar(funcion, repeticiones: int) -> list:
+    muestras = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        muestras.append(time.perf_counter() - inicio)
+    return muestras
+
+
+async def _cronometrar_async(corrutina, repeticiones: int) -> list:
+    muestras = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        await corrutina()
+        muestras.append(time.perf_counter() - inicio)
+    return muestras
+
+
+async def escenario_ingesta(bot, directorio: str, mensajes: int = 5000,
+                            usuarios: int = 50, palabras_media: int = 12) -> dict:
+    """Throughput de guardar_mensaje_handler con updates reales de PTB"""
+    ruta = os.path.join(directorio, 'ingesta.db')
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    bot.DB_NAME = ruta
+    bot.inicializar_db()
+
+    tg = BotFalso()
+    chat_id = chat_benchmark(bot)
+    generador = GeneradorChat(usuarios=usuarios, palabras_media=palabras_media)
+    updates = [
+        crear_update(tg, chat_id, m['user_id'], m['texto'], m['message_id'])
+        for m in generador.mensajes(mensajes)
+    ]
+
+    muestras = []
+    inicio_total = time.perf_counter()
+    for update in updates:
+        inicio = time.perf_counter()
+        await bot.guardar_mensaje_handler(update, None)
+        muestras.append(time.perf_counter() - inicio)
+    total = time.perf_counter() - inicio_total
+
+    return {
+        'mensajes': mensajes,
+        'mensajes_por_s': round(mensajes / total, 1),
+        'latencia': percentiles(muestras),
+    }
+
+
+async def escenario_resumen(bot, directorio: str, filas: list, horas: int = 24,
+                            repeticiones: int = 5) -> dict:
+    """
+    obtener_mensajes_db + generar_resumen sobre ventanas de distintos tamaños,
+    y el resumen rápido sin IA (consulta incluida) sobre la ventana máxima de 168 h
+    """
+    resultados = {}
+    chat_id = chat_benchmark(bot)
+
+    for n in filas:
+        preparar_db(bot, directorio, n)
+        fecha_limite = datetime.now() - timedelta(hours=horas)
+
+        mensajes = bot.obtener_mensajes_db(chat_id, fecha_limite)
+        consulta = _cronometrar(
+            lambda: bot.obtener_mensajes_db(chat_id, fecha_limite), repeticiones
+        )
+        resumen = await _cronometrar_async(
+            lambda: bot.generar_resumen(mensajes, horas), repeticiones
+        )
+        semana = datetime.now() - timedelta(hours=168)
+        rapido = _cronometrar(
+            lambda: bot.trabajo_resumen(chat_id, semana, 168, True), repeticiones
+        )
+
+        resultados[str(n)] = {
+            'filas_totales': n,
+            'mensajes_en_ventana': len(mensajes),
+            'obtener_mensajes_db': percentiles(consulta),
+            'generar_resumen': percentiles(resumen),
+            'mensajes_en_168h': bot.trabajo_resumen(chat_id, semana, 168, True)[0],
+            'resumen_rapido_168h': percentiles(rapido),
+        }
+
+    return resultados
+
+
+async def escenario_stats(bot, directorio: str, filas: list, repeticiones: int = 5) -> dict:
+    """Coste completo del handler /stats (tres consultas + respuesta)"""
+    resultados = {}
+    chat_id = chat_benchmark(bot)
+    tg = BotFalso()
+
+    for n in filas:
+        preparar_db(bot, directorio, n)
+        contexto = SimpleNamespace(args=[], bot=tg)
+
+        async def ejecutar():
+            update = crear_update(tg, chat_id, 1, '/stats', 1)
+            await bot.stats(update, contexto)
+
+        resultados[str(n)] = percentiles(await _cronometrar_async(ejecutar, repeticiones))
+
+    return resultados
+
+
+async def escenario_datos(bot, directorio: str, fallos: int = 3, aciertos: int = 20) -> dict:
+    """buscar_juego_bgg con caché fría (BGG + OpenAI falsos) y caliente"""
+    ruta = os.path.join(directorio, 'datos.db')
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    bot.DB_NAME = ruta
+    bot.inicializar_db()
+
+    nombres = [f'Juego benchmark {i}' for i in range(fallos)]
+    muestras_fallo = []
+    for nombre in nombres:
+        inicio = time.perf_counter()
+        juego = await bot.buscar_juego_bgg(nombre)
+        muestras_fallo.append(time.perf_counter() - inicio)
+        if not juego or juego.get('from_cache'):
+            raise RuntimeError(f"Se esperaba un fallo de caché para '{nombre}'")
+
+    muestras_acierto = []
+    for i in range(aciertos):
+        nombre = nombres[i % len(nombres)]
+        inicio = time.perf_counter()
+        juego = await bot.buscar_juego_bgg(nombre)
+        muestras_acierto.append(time.perf_counter() - inicio)
+        if not juego or not juego.get('from_cache'):
+            raise RuntimeError(f"Se esperaba un acierto de caché para '{nombre}'")
+
+    return {
+        'pausa_rate_limit_s': bot.BGG_PAUSA_S,
+        'fallo_cache': percentiles(muestras_fallo),
+        'acierto_cache': percentiles(muestras_acierto),
+    }
+
+
+def mensajes_para_resumen(n: int, usuarios: int = 50, semilla: int = 42) -> list:
+    """Mensajes sintéticos con la forma que devuelve obtener_mensajes_db"""
+    generador = GeneradorChat(usuarios=usuarios, semilla=semilla)
+    return [
+        {
+            'usuario': f"@{m['username']}" if m['username'] != 'sin_usuario' else m['first_name'],
+            'mensaje': m['texto'],
+            'timestamp': m['timestamp'],
+            'message_id': m['message_id'],
+            'respuesta_a': m['respuesta_a'],
+        }
+        for m in generador.mensajes(n)
+    ]
+
+
+async def escenario_preprocesado(bot, directorio: str, filas: list, repeticiones: int = 5) -> dict:
+    """Throughput de preprocesar_mensajes y tokens ahorrados frente a la conversación original"""
+    resultados = {}
+
+    for n in filas:
+        mensajes = mensajes_para_resumen(n)
+        muestras = _cronometrar(lambda: bot.preprocesar_mensajes(mensajes), repeticiones)
+        lineas = bot.preprocesar_mensajes(mensajes)
+
+        tokens_originales = bot.estimar_tokens(bot.formatear_conversacion(mensajes))
+        tokens_preprocesados = bot.estimar_tokens(bot.formatear_conversacion(lineas))
+        resultados[str(n)] = {
+            'mensajes': n,
+            'lineas': len(lineas),
+            'mensajes_por_s': round(n / statistics.median(muestras), 1),
+            'preprocesar': percentiles(muestras),
+            'tokens_originales': tokens_originales,
+            'tokens_preprocesados': tokens_preprocesados,
+            'reduccion': round(1 - tokens_preprocesados / max(1, tokens_originales), 4),
+        }
+
+    return resultados
+
+
+# p50 máximo de puntuar_relevancia con 10.000 mensajes (un día de un grupo muy activo)
+OBJETIVO_RELEVANCIA_MS = 100
+OBJETIVO_RELEVANCIA_MENSAJES = 10_000
+
+
+async def escenario_relevancia(bot, directorio: str, filas: list, repeticiones: int = 5) -> dict:
+    """
+    Coste de puntuar la ventana y elegir qué líneas caben en el prompt de /resumen.
+    Con OBJETIVO_RELEVANCIA_MENSAJES filas marca si puntuar cumple OBJETIVO_RELEVANCIA_MS.
+    """
+    resultados = {}
+
+    for n in filas:
+        mensajes = mensajes_para_resumen(n)
+        lineas = bot.preprocesar_mensajes(mensajes)
+        puntuar = _cronometrar(lambda: bot.puntuar_relevancia(mensajes), repeticiones)
+        seleccionar = _cronometrar(lambda: bot.seleccionar_relevantes(mensajes, lineas), repeticiones)
+        seleccion = bot.seleccionar_relevantes(mensajes, lineas)
+
+        resultados[str(n)] = {
+            'mensajes': n,
+            'lineas': len(lineas),
+            'elegidas': len(seleccion),
+            'tokens_elegidos': bot.estimar_tokens(bot.formatear_conversacion(seleccion)),
+            'puntuar': percentiles(puntuar),
+            'seleccionar': percentiles(seleccionar),
+        }
+        if n == OBJETIVO_RELEVANCIA_MENSAJES:
+            resultados[str(n)]['objetivo_ms'] = OBJETIVO_RELEVANCIA_MS
+            resultados[str(n)]['cumple_objetivo'] = resultados[str(n)]['puntuar']['p50_ms'] < OBJETIVO_RELEVANCIA_MS
+
+    return resultados
+
+
+# Condiciones del OpenAI falso: (fallos, lentas, latencia de las lentas, cobertura_s)
+CONDICIONES_OPENAI = {
+    'normal': (0.0, 0.0, 0.0, 0.0),
+    'errores_20': (0.2, 0.0, 0.0, 0.0),
+    'cola_lenta': (0.0, 0.1, 3.0, 0.0),
+    'cola_lenta_cobertura': (0.0, 0.1, 3.0, 0.3),
+    'caida': (1.0, 0.0, 0.0, 0.0),
+}
+
+
+async def escenario_openai(bot, servidor, llamadas: int = 40, latencia_s: float = 0.05) -> dict:
+    """
+    Latencia de generar_resumen con el OpenAI falso fallando o con cola lenta:
+    plazos, reintentos, cortocircuito y peticiones de cobertura.
+    Cuenta cuántas respuestas fueron el resumen rápido de respaldo.
+    """
+    mensajes = mensajes_para_resumen(200)
+    original = bot.LLAMADAS_OPENAI
+    latencia_original = servidor.latencia_s
+    servidor.latencia_s = latencia_s
+    resultados = {}
+
+    try:
+        for nombre, (fallos, lentas, latencia_lenta, cobertura) in CONDICIONES_OPENAI.items():
+            servidor.fallos, servidor.lentas, servidor.latencia_lenta_s = fallos, lentas, latencia_lenta
+            bot.LLAMADAS_OPENAI = bot.LlamadasOpenAI(
+                plazo_s=1.0, plazo_total_s=4.0, reintentos=2, cobertura_s=cobertura,
+                circuito=bot.Cortocircuito(5, 60)
+            )
+            peticiones = servidor.peticiones
+            respaldos = 0
+            muestras = []
+            for _ in range(llamadas):
+                inicio = time.perf_counter()
+                texto = await bot.generar_resumen(mensajes, 24)
+                muestras.append(time.perf_counter() - inicio)
+                respaldos += texto.startswith('⚠️')
+            resultados[nombre] = {
+                'latencia': percentiles(muestras),
+                'respaldos': respaldos,
+                'peticiones_openai': servidor.peticiones - peticiones,
+            }
+    finally:
+        bot.LLAMADAS_OPENAI = original
+        servidor.latencia_s = latencia_original
+        servidor.fallos = servidor.lentas = 0.0
+
+    return resultados
+
+
+# Proceso hijo del escenario de arranque: repite los pasos de main() hasta tener
+# el health check respondiendo, y luego mide lo que se difiere al primer uso
+SCRIPT_ARRANQUE = r'''
+import json, os, sys, threading, time, urllib.request
+inicio = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import telegram_summary_bot2 as bot
+importado = time.perf_counter()
+
+threading.Thread(target=bot.run_health_server, daemon=True).start()
+url = f"http://127.0.0.1:{os.environ['PORT']}/"
+while True:
+    try:
+        urllib.request.urlopen(url, timeout=1).read()
+        break
+    except OSError:
+        time.sleep(0.001)
+health = time.perf_counter()
+
+bot.inicializar_db()
+db = time.perf_counter()
+
+bot.cliente_openai()
+import requests, xml.etree.ElementTree
+diferido = time.perf_counter()
+
+print('ARRANQUE ' + json.dumps({
+    'importar_bot': importado - inicio,
+    'health': health - inicio,
+    'inicializar_db': db - health,
+    'listo': db - inicio,
+    'dependencias_diferidas': diferido - db,
+}))
+'''
+
+
+def _puerto_libre() -> int:
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _arrancar_proceso(ruta_db: str) -> dict:
+    import json
+    import subprocess
+    import sys
+
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    entorno = dict(os.environ, DB_PATH=ruta_db, PORT=str(_puerto_libre()))
+    inicio = time.perf_counter()
+    salida = subprocess.run(
+        [sys.executable, '-c', SCRIPT_ARRANQUE, raiz],
+        env=entorno, capture_output=True, text=True, check=True
+    ).stdout
+    total = time.perf_counter() - inicio
+
+    for linea in salida.splitlines():
+        if linea.startswith('ARRANQUE '):
+            medidas = json.loads(linea[len('ARRANQUE '):])
+            medidas['proceso'] = total
+            return medidas
+    raise RuntimeError(f"El proceso de arranque no informó de sus tiempos:\n{salida}")
+
+
+async def escenario_arranque(bot, directorio: str, repeticiones: int = 5) -> dict:
+    """
+    Arranque en frío en procesos nuevos (como al despertar en Render):
+    importar el bot, health check respondiendo, inicializar_db con la base
+    nueva y con el esquema ya al día, y lo que se difiere al primer uso.
+    """
+    ruta = os.path.join(directorio, 'arranque.db')
+    if os.path.exists(ruta):
+        os.remove(ruta)
+
+    primera = _arrancar_proceso(ruta)  # Base nueva: aplica el DDL
+    muestras = [_arrancar_proceso(ruta) for _ in range(repeticiones)]
+
+    def serie(clave):
+        return percentiles([m[clave] for m in muestras])
+
+    return {
+        'importar_bot': serie('importar_bot'),
+        'hasta_health': serie('health'),
+        'inicializar_db': serie('inicializar_db'),
+        'inicializar_db_base_nueva_ms': round(primera['inicializar_db'] * 1000, 3),
+        'hasta_listo': serie('listo'),
+        'dependencias_diferidas': serie('dependencias_diferidas'),
+        'proceso_completo': serie('proceso'),
+    }
+
+
+async def escenario_copias(bot, directorio: str, filas: list, duracion_s: float = 5.0,
+                           tasa: float = 200.0) -> dict:
+    """
+    Latencia de guardar_mensaje_handler a `tasa` mensajes/s sin copia de
+    seguridad y mientras hacer_copia_seguridad() copia en un hilo la base más
+    grande; también duración y tamaño de la copia y de verificar_copia().
+    """
+    origen = preparar_db(bot, directorio, max(filas))
+    ruta = os.path.join(directorio, 'copias.db')
+    bot.copiar_base(origen, ruta, paginas=-1, pausa_s=0)  # La de preparar_db no se toca
+    bot.DB_NAME = ruta
+    bot.inicializar_db()
+    bot.BACKUP_DIR = os.path.join(directorio, 'copias')
+
+    tg = BotFalso()
+    chat_id = chat_benchmark(bot)
+    generador = GeneradorChat(semilla=7)
+    siguiente_id = [10 ** 9]
+
+    async def ingerir(hasta) -> list:
+        muestras = []
+        inicio = time.perf_counter()
+        while not hasta(time.perf_counter() - inicio):
+            objetivo = inicio + len(muestras) / tasa
+            if objetivo > time.perf_counter():
+                await asyncio.sleep(objetivo - time.perf_counter())
+            siguiente_id[0] += 1
+            update = crear_update(tg, chat_id, 1, generador.texto(), siguiente_id[0])
+            antes = time.perf_counter()
+            await bot.guardar_mensaje_handler(update, None)
+            muestras.append(time.perf_counter() - antes)
+        return muestras
+
+    sin_copia = await ingerir(lambda transcurrido: transcurrido >= duracion_s)
+
+    inicio = time.perf_counter()
+    copia = asyncio.create_task(asyncio.to_thread(bot.hacer_copia_seguridad))
+    con_copia = await ingerir(lambda transcurrido: copia.done())
+    ruta_copia = await copia
+    duracion_copia = time.perf_counter() - inicio
+
+    base_copia = bot.bases_de_copia(ruta_copia)[0][0]
+    inicio = time.perf_counter()
+    verificacion = bot.verificar_copia(base_copia)
+
+    return {
+        'filas': max(filas),
+        'mb': round(os.path.getsize(base_copia) / 1e6, 1),
+        'copia_s': round(duracion_copia, 3),
+        'verificar_s': round(time.perf_counter() - inicio, 3),
+        'verificada': not verificacion['problemas'],
+        'ingesta_sin_copia': percentiles(sin_copia),
+        'ingesta_con_copia': percentiles(con_copia),
+    }
+
+
+async def escenario_precarga(bot, directorio: str, catalogo: int = 20_000, mensajes: int = 5000,
+                             menciones: int = 3) -> dict:
+    """
+    Precarga de BGG: construcción del autómata con un catálogo de `catalogo`
+    nombres, textos/s que recorre, y latencia de buscar_juego_bgg para juegos
+    mencionados en el chat después de una ronda de precarga (deben salir de caché).
+    """
+    ruta = os.path.join(directorio, 'precarga.db')
+    if os.path.exists(ruta):
+        os.remove(ruta)
+    bot.DB_NAME = ruta
+    bot.inicializar_db()
+
+    juegos = [f'Juego mencionado {i}' for i in range(menciones)]
+    bot.BGG_CATALOGO = os.path.join(directorio, 'catalogo.txt')
+    with open(bot.BGG_CATALOGO, 'w', encoding='utf-8') as f:
+        f.writelines(f'Juego de catalogo {i}\n' for i in range(catalogo))
+        f.writelines(f'{juego}\n' for juego in juegos)
+
+    inicio = time.perf_counter()
+    automata = bot.cargar_automata_juegos()
+    construccion = time.perf_counter() - inicio
+
+    generador = GeneradorChat(semilla=11)
+    textos = [(-1, generador.texto()) for _ in range(mensajes)]
+    inicio = time.perf_counter()
+    automata.menciones(textos)
+    recorrido = time.perf_counter() - inicio
+
+    bot.BGG_PRECARGA_PAUSA_S = 0
+    precarga = bot.PrecargaBGG(bot.BGG_PRECARGA_PENDIENTES)
+    chat_id = chat_benchmark(bot)
+    for juego in juegos:
+        precarga.observar(chat_id, f'¿alguien trae el {juego.lower()} el sábado?')
+    inicio = time.perf_counter()
+    await precarga.ronda()
+    duracion_ronda = time.perf_counter() - inicio
+
+    muestras = []
+    aciertos = 0
+    for juego in juegos:
+        inicio = time.perf_counter()
+        resultado = await bot.buscar_juego_bgg(juego)
+        muestras.append(time.perf_counter() - inicio)
+        aciertos += bool(resultado and resultado.get('from_cache'))
+
+    return {
+        'nombres': len(automata.nombres),
+        'construccion_s': round(construccion, 3),
+        'textos_por_s': round(mensajes / recorrido),
+        'ronda_precarga_s': round(duracion_ronda, 3),
+        'datos_tras_precarga': percentiles(muestras),
+        'aciertos_cache': f'{aciertos}/{len(juegos)}',
+    }
+
+
+async def escenario_puesta_al_dia(bot, directorio: str, pendientes: int = 5000, comandos: int = 20) -> dict:
+    """
+    Backlog tras un reinicio: `pendientes` updates (mensajes y algún comando)
+    esperando en Telegram. Compara guardarlos uno a uno con guardar_mensaje_handler
+    con vaciarlos con ponerse_al_dia() (getUpdates por lotes y una escritura).
+    """
+    chat_id = chat_benchmark(bot)
+    generador = GeneradorChat(semilla=5)
+    hace_una_hora = datetime.now().astimezone() - timedelta(hours=1)
+    tg = BotFalso()
+    updates = []
+    for i, m in enumerate(generador.mensajes(pendientes)):
+        texto = '/stats' if i % max(1, pendientes // comandos) == 0 else m['texto']
+        updates.append(crear_update(tg, chat_id, m['user_id'], texto, m['message_id'], fecha=hace_una_hora))
+
+    resultados = {'pendientes': pendientes}
+    for modo in ('uno_a_uno', 'en_lote'):
+        ruta = os.path.join(directorio, f'puesta_al_dia_{modo}.db')
+        if os.path.exists(ruta):
+            os.remove(ruta)
+        bot.DB_NAME = ruta
+        bot.inicializar_db()
+
+        inicio = time.perf_counter()
+        if modo == 'uno_a_uno':
+            for update in updates:
+                await bot.guardar_mensaje_handler(update, None)
+            en_cola = sum(1 for u in updates if u.message.text.startswith('/'))
+        else:
+            tg.pendientes.extend(updates)
+            aplicacion = SimpleNamespace(bot=tg, update_queue=asyncio.Queue())
+            await bot.ponerse_al_dia(aplicacion)
+            en_cola = aplicacion.update_queue.qsize()
+        segundos = time.perf_counter() - inicio
+
+        conn = sqlite3.connect(ruta)
+        guardados = conn.execute('SELECT COUNT(*) FROM mensajes').fetchone()[0]
+        conn.close()
+        resultados[modo] = {
+            'segundos': round(segundos, 3),
+            'updates_por_s': round(pendientes / segundos, 1),
+            'mensajes_guardados': guardados,
+            'comandos_a_la_cola': en_cola,
+        }
+    return resultados
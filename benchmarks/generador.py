@@ -0,0 +1,140 @@
+"""
+Generador de chats sintéticos.
+
+Produce mensajes con la misma forma que guarda guardar_mensaje_handler,
+con usuarios de actividad desigual (unos pocos hablan mucho), longitudes
+variables y un ritmo de mensajes por hora configurable.
+"""
+
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+VOCABULARIO = (
+    "partida juego mesa catan azul wingspan terraforming mars ark nova spirit island "
+    "gloomhaven brass everdell dados cartas tablero expansión reglas turno puntos ganar "
+    "perder jugar jugamos quedamos sábado domingo tarde noche casa local tienda feria "
+    "essen kickstarter reimpresión oferta precio euros comprar vender cambio colección "
+    "cooperativo competitivo eurogame ameritrash solitario campaña escenario mecánica "
+    "colocación trabajadores construcción mazos draft subasta faroleo deducción "
+    "me gusta mucho poco bastante genial horrible largo corto fácil difícil explicar "
+    "alguien viene quién trae lleva pizza cerveza mañana hoy ayer semana próxima"
+).split()
+
+EMOJIS = ("🎲", "😂", "👍", "🔥", "🤔", "🃏", "🏆", "❤️")
+
+URLS = (
+    "https://boardgamegeek.com/boardgame/174430/gloomhaven",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://www.kickstarter.com/projects/ejemplo/juego-nuevo",
+)
+
+
+class GeneradorChat:
+    """
+    Genera mensajes sintéticos de un grupo.
+
+    Args:
+        usuarios: número de participantes distintos
+        palabras_media: longitud media de los mensajes en palabras
+        mensajes_por_hora: ritmo medio del chat (define el espaciado temporal)
+        semilla: semilla para que los datos sean reproducibles entre commits
+        temas: temas de foro (0 = grupo normal); los mensajes se reparten entre
+            el tema General (thread_id NULL) y los temas 2..temas+1
+    """
+
+    def __init__(self, usuarios: int = 50, palabras_media: int = 12,
+                 mensajes_por_hora: float = 600, semilla: int = 42, temas: int = 0):
+        self.usuarios = usuarios
+        self.palabras_media = palabras_media
+        self.mensajes_por_hora = mensajes_por_hora
+        self.rng = random.Random(semilla)
+        # Aparte para que añadir respuestas no cambie los textos de commits anteriores
+        self.rng_respuestas = random.Random(semilla + 1)
+        self.temas = temas
+        self.rng_temas = random.Random(semilla + 2)
+        # Actividad tipo Zipf: el usuario i habla ~1/(i+1) veces lo que el primero
+        self.pesos = [1 / (i + 1) for i in range(usuarios)]
+
+    def texto(self) -> str:
+        """Un mensaje con longitud aleatoria y algún emoji o enlace ocasional"""
+        rng = self.rng
+        tirada = rng.random()
+        if tirada < 0.05:
+            return rng.choice(EMOJIS)
+        if tirada < 0.08:
+            return rng.choice(URLS)
+
+        longitud = max(1, int(rng.expovariate(1 / self.palabras_media)))
+        palabras = rng.choices(VOCABULARIO, k=longitud)
+        if rng.random() < 0.2:
+            palabras.append(rng.choice(EMOJIS))
+        return ' '.join(palabras)
+
+    def mensajes(self, n: int, fin: datetime = None, primer_id: int = 1):
+        """
+        Genera `n` mensajes en orden cronológico que terminan en `fin`.
+        Cada mensaje es un dict con las columnas de la tabla mensajes.
+        """
+        fin = fin or datetime.now()
+        espaciado = timedelta(hours=1) / self.mensajes_por_hora
+        inicio = fin - espaciado * n
+        usuarios = range(1, self.usuarios + 1)
+
+        for i in range(n):
+            user_id = self.rng.choices(usuarios, weights=self.pesos)[0]
+            # ~15% de respuestas a alguno de los 20 mensajes anteriores
+            respuesta_a = None
+            if i and self.rng_respuestas.random() < 0.15:
+                respuesta_a = primer_id + i - self.rng_respuestas.randint(1, min(i, 20))
+            thread_id = None
+            if self.temas:
+                thread_id = self.rng_temas.randint(1, self.temas + 1)
+                thread_id = None if thread_id == 1 else thread_id
+            yield {
+                'message_id': primer_id + i,
+                'user_id': user_id,
+                'username': f'usuario_{user_id}' if user_id % 7 else 'sin_usuario',
+                'first_name': f'Usuario {user_id}',
+                'texto': self.texto(),
+                'timestamp': inicio + espaciado * i,
+                'respuesta_a': respuesta_a,
+                'thread_id': thread_id,
+            }
+
+
+def poblar_db(ruta: str, chat_id: int, generador: GeneradorChat, n: int,
+              fin: datetime = None, lote: int = 50_000) -> int:
+    """
+    Inserta `n` mensajes sintéticos de `chat_id` en la base de datos `ruta`
+    (que ya debe tener el esquema del bot). Devuelve las filas insertadas.
+    """
+    conn = sqlite3.connect(ruta)
+    cursor = conn.cursor()
+    filas = []
+    insertadas = 0
+
+    for m in generador.mensajes(n, fin=fin):
+        filas.append((
+            chat_id, m['message_id'], m['user_id'], m['username'],
+            m['first_name'], m['texto'], m['timestamp'].isoformat(' '), m['respuesta_a'],
+            m['thread_id']
+        ))
+        if len(filas) >= lote:
+            insertadas += _insertar(cursor, filas)
+            filas = []
+    if filas:
+        insertadas += _insertar(cursor, filas)
+
+    conn.commit()
+    conn.close()
+    return insertadas
+
+
+def _insertar(cursor: sqlite3.Cursor, filas: list) -> int:
+    cursor.executemany('''
+        INSERT OR IGNORE INTO mensajes
+        (chat_id, message_id, user_id, username, first_name, texto, timestamp, respuesta_a, thread_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', filas)
+    return cursor.rowcount
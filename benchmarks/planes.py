@@ -0,0 +1,348 @@
+"""
+Regresiones de planes de consulta.
+
+Recoge todas las sentencias SQL del bot y de herramientas.py (leyendo el
+código con ast, sin ejecutarlo), pide EXPLAIN QUERY PLAN de cada una sobre una
+base poblada y falla si alguna recorre entera una tabla grande (SCAN) o monta
+un B-tree temporal (ORDER BY / GROUP BY / DISTINCT sin índice) sin una
+excepción justificada en EXCEPCIONES. Después cronometra cada sentencia sobre
+esa misma base (por defecto 1M de mensajes); las escrituras se deshacen.
+
+    python -m benchmarks.planes
+    python -m benchmarks.planes --filas 100000 --salida planes.json
+    python -m benchmarks.planes --sin-tiempos
+
+Sale con código 1 si hay algún plan nuevo sin justificar o alguna sentencia
+dinámica (f-string) que no esté en VARIANTES: así, una consulta nueva que no
+use índice no pasa desapercibida. La misma revisión de planes, sin tiempos y
+con 20.000 mensajes, está en tests/test_planes.py y corre con pytest.
+"""
+
+import argparse
+import ast
+import json
+import os
+import platform
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import commit_actual, percentiles
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FICHEROS = ('telegram_summary_bot2.py', 'herramientas.py')
+
+# Tablas que pueden crecer sin límite: en ellas un SCAN es una regresión
+TABLAS_GRANDES = {'mensajes', 'bgg_cache_v2', 'bgg_cache', 'preguntas_historial'}
+
+# Planes aceptados a sabiendas: (regex de la sentencia, fragmento del plan) -> motivo
+EXCEPCIONES = {
+    (r'GROUP BY user_id ORDER BY count DESC', 'USE TEMP B-TREE FOR ORDER BY'):
+        'ordena el resultado ya agrupado (un registro por usuario), no los mensajes',
+    (r'GROUP BY \+thread_id', 'USE TEMP B-TREE FOR GROUP BY'):
+        'agrupa solo los mensajes de la ventana (unos pocos temas); es más barato que recorrer el historial en orden de tema',
+    (r'^SELECT game_name FROM bgg_cache_v2$', 'SCAN bgg_cache_v2 USING COVERING INDEX'):
+        'cargar_automata_juegos() lee todos los nombres para la precarga de BGG, una vez por hora',
+    (r'^SELECT COUNT\(\*\) FROM mensajes$', 'SCAN mensajes'):
+        'verificar_copia() cuenta los mensajes de una copia de seguridad: la recorre entera a propósito',
+}
+
+# Expresiones de las sentencias dinámicas -> texto con el que se analizan (el caso más amplio)
+VARIANTES = {
+    "' AND '.join(condiciones)": 'chat_id = ? AND timestamp >= ? AND timestamp < ?',
+}
+
+SENTENCIAS_ANALIZADAS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+
+# ============================
+# RECOGIDA DE SENTENCIAS
+# ============================
+
+def _normalizar(sql: str) -> str:
+    return ' '.join(sql.split())
+
+
+def _texto_sql(nodo, sin_variante: list):
+    """Texto de una sentencia literal o f-string (con VARIANTES); None si no es SQL fijo"""
+    if isinstance(nodo, ast.Constant) and isinstance(nodo.value, str):
+        return nodo.value
+    if isinstance(nodo, ast.JoinedStr):
+        if isinstance(nodo.values[0], ast.Constant) and nodo.values[0].value.strip().upper().startswith('PRAGMA'):
+            return None  # PRAGMA user_version = {ESQUEMA_VERSION}
+        partes = []
+        for valor in nodo.values:
+            if isinstance(valor, ast.Constant):
+                partes.append(valor.value)
+                continue
+            expresion = ast.unparse(valor.value)
+            if expresion not in VARIANTES:
+                sin_variante.append(expresion)
+                return None
+            partes.append(VARIANTES[expresion])
+        return ''.join(partes)
+    return None
+
+
+def recoger_sentencias(ficheros=FICHEROS) -> tuple:
+    """
+    Recorre las llamadas .execute()/.executemany() del código.
+    Devuelve (sentencias, ddl, pendientes): sentencias es una lista de dicts
+    {sql, origen}; ddl las CREATE; pendientes las f-strings sin variante.
+    """
+    sentencias = {}
+    ddl = []
+    pendientes = []
+    for nombre in ficheros:
+        with open(os.path.join(RAIZ, nombre), encoding='utf-8') as f:
+            arbol = ast.parse(f.read(), filename=nombre)
+        for nodo in ast.walk(arbol):
+            if not (isinstance(nodo, ast.Call) and isinstance(nodo.func, ast.Attribute)
+                    and nodo.func.attr in ('execute', 'executemany') and nodo.args):
+                continue
+            sin_variante = []
+            sql = _texto_sql(nodo.args[0], sin_variante)
+            origen = f'{nombre}:{nodo.lineno}'
+            if sql is None:
+                if sin_variante:
+                    pendientes.append({'origen': origen, 'expresiones': sin_variante})
+                continue
+            sql = _normalizar(sql)
+            verbo = sql.split(' ', 1)[0].upper()
+            if verbo == 'CREATE':
+                ddl.append(sql)
+            elif verbo in SENTENCIAS_ANALIZADAS:
+                sentencias.setdefault(sql, []).append(origen)
+    return [{'sql': sql, 'origen': origenes} for sql, origenes in sentencias.items()], ddl, pendientes
+
+
+# ============================
+# PARÁMETROS DE EJEMPLO
+# ============================
+
+def _columna_de(previo: str) -> str:
+    """Columna a la que se compara un `?` a partir del texto que lo precede"""
+    previo = previo.rstrip()
+    if re.search(r'LIMIT$', previo, re.I):
+        return 'LIMIT'
+    entre = re.search(r'(\w+)\s+BETWEEN\s+\?\s+AND$', previo, re.I)
+    if entre:
+        return entre.group(1) + '<='
+    comparacion = re.search(r'(\w+)\s*(>=|<=|=|>|<|BETWEEN|IS)$', previo, re.I)
+    if comparacion:
+        operador = comparacion.group(2).upper()
+        return comparacion.group(1) + {'BETWEEN': '>=', 'IS': '='}.get(operador, operador)
+    return ''
+
+
+def parametros_ejemplo(sql: str, chat_id: int, ahora: datetime) -> tuple:
+    """
+    Valores plausibles para cada `?`: el chat del fixture, ventanas de 24 h,
+    lotes de 5000, un juego que está en la caché... Para INSERT se sacan de la
+    lista de columnas (con un message_id nuevo para no chocar con UNIQUE).
+    """
+    hace_un_dia = ahora - timedelta(hours=24)
+    por_columna = {
+        'chat_id': chat_id,
+        'game_name': 'catan',
+        'clave': 'pregunta',
+        'pregunta_id': 1,
+        'message_id': 10 ** 9,
+        'user_id': 1,
+        'bgg_id': 13,
+        'thread_id': 2,
+        'mensajes': 1,
+        'ultimo_id': 0,
+        'LIMIT': 5000,
+    }
+
+    insercion = re.match(r'INSERT.*?\((.*?)\)\s*VALUES\s*\((.*?)\)', sql, re.I)
+    if insercion:
+        columnas = [c.strip() for c in insercion.group(1).split(',')]
+        valores = [v.strip() for v in insercion.group(2).split(',')]
+        parametros = []
+        for columna, valor in zip(columnas, valores):
+            if valor != '?':
+                continue
+            if columna in por_columna:
+                parametros.append(por_columna[columna])
+            elif columna in ('timestamp', 'desde', 'hasta', 'proxima', 'dia'):
+                parametros.append(ahora.isoformat(' '))
+            else:
+                parametros.append('x')
+        return tuple(parametros)
+
+    parametros = []
+    for posicion in (i for i, c in enumerate(sql) if c == '?'):
+        columna = _columna_de(sql[:posicion])
+        nombre = columna.rstrip('<>=')
+        if nombre in por_columna:
+            parametros.append(por_columna[nombre])
+        elif nombre == 'id':
+            parametros.append(5000 if '<' in columna else 0)
+        elif nombre in ('timestamp', 'desde', 'hasta', 'proxima', 'dia'):
+            parametros.append((ahora if '<' in columna else hace_un_dia).isoformat(' '))
+        else:
+            raise ValueError(f"No sé qué valor dar al parámetro tras {sql[:posicion][-40:]!r}")
+    return tuple(parametros)
+
+
+# ============================
+# FIXTURE
+# ============================
+
+def preparar_fixture(bot, directorio: str, filas: int, ddl: list) -> tuple:
+    """
+    Base con `filas` mensajes (la de los escenarios) más las tablas auxiliares
+    pobladas: caché de BGG, historial de preguntas y resúmenes diarios.
+    Devuelve (ruta, chat_id).
+    """
+    from benchmarks.escenarios import chat_benchmark, preparar_db
+
+    ruta = preparar_db(bot, directorio, filas)
+    chat_id = chat_benchmark(bot)
+    ahora = datetime.now()
+
+    conn = sqlite3.connect(ruta)
+    for sentencia in ddl:
+        if 'IF NOT EXISTS' in sentencia.upper():
+            conn.execute(sentencia)  # Tablas que se crean fuera de inicializar_db
+    conn.executemany('''
+        INSERT OR IGNORE INTO bgg_cache_v2 (game_name, bgg_id, timestamp) VALUES (?, ?, ?)
+    ''', ((f'juego {i}', i, ahora - timedelta(days=i % 60)) for i in range(20_000)))
+    conn.execute("INSERT OR IGNORE INTO bgg_cache_v2 (game_name, bgg_id, timestamp) VALUES ('Catan', 13, ?)",
+                 (ahora,))
+    conn.executemany('''
+        INSERT OR IGNORE INTO preguntas_historial (chat_id, pregunta_id, timestamp) VALUES (?, ?, ?)
+    ''', ((-1000000000000 - i % 50, i % 40, ahora - timedelta(hours=8 * i)) for i in range(20_000)))
+    conn.executemany('''
+        INSERT OR IGNORE INTO resumenes_diarios (chat_id, desde, hasta, mensajes, texto) VALUES (?, ?, ?, ?, ?)
+    ''', ((-1000000000000 - i % 50, (ahora - timedelta(days=i // 50 + 1)).isoformat(' '),
+           (ahora - timedelta(days=i // 50)).isoformat(' '), 100, 'resumen') for i in range(350)))
+    conn.commit()
+    conn.close()
+    return ruta, chat_id
+
+
+# ============================
+# ANÁLISIS
+# ============================
+
+def _justificacion(sql: str, detalle: str):
+    for (patron_sql, fragmento_plan), motivo in EXCEPCIONES.items():
+        if re.search(patron_sql, sql) and fragmento_plan in detalle:
+            return motivo
+    return None
+
+
+def revisar_plan(conn: sqlite3.Connection, sql: str, parametros: tuple) -> dict:
+    """EXPLAIN QUERY PLAN de una sentencia y los pasos que son regresión"""
+    plan = [fila[3] for fila in conn.execute(f'EXPLAIN QUERY PLAN {sql}', parametros)]
+    problemas = []
+    justificados = []
+    for detalle in plan:
+        escaneo = re.match(r'SCAN (\w+)', detalle)
+        malo = (escaneo and escaneo.group(1) in TABLAS_GRANDES) or 'USE TEMP B-TREE' in detalle
+        if not malo:
+            continue
+        motivo = _justificacion(sql, detalle)
+        if motivo:
+            justificados.append({'paso': detalle, 'motivo': motivo})
+        else:
+            problemas.append(detalle)
+    return {'plan': plan, 'problemas': problemas, 'justificados': justificados}
+
+
+def cronometrar(conn: sqlite3.Connection, sql: str, parametros: tuple, repeticiones: int) -> dict:
+    """Tiempo de cada sentencia; las escrituras van en un SAVEPOINT que se deshace"""
+    lectura = sql.upper().startswith('SELECT')
+    muestras = []
+    for _ in range(repeticiones if lectura else 1):
+        if not lectura:
+            conn.execute('SAVEPOINT medicion')
+        inicio = time.perf_counter()
+        conn.execute(sql, parametros).fetchall()
+        muestras.append(time.perf_counter() - inicio)
+        if not lectura:
+            conn.execute('ROLLBACK TO medicion')
+            conn.execute('RELEASE medicion')
+    return percentiles(muestras)
+
+
+def ejecutar(args) -> dict:
+    sentencias, ddl, pendientes = recoger_sentencias()
+
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-benchmark')
+    os.environ.setdefault('DB_PATH', os.path.join(args.directorio, 'bot.db'))
+    sys.path.insert(0, RAIZ)
+    import telegram_summary_bot2 as bot
+
+    ruta, chat_id = preparar_fixture(bot, args.directorio, args.filas, ddl)
+    conn = sqlite3.connect(ruta, isolation_level=None)
+    ahora = datetime.now()
+
+    resultados = []
+    for sentencia in sentencias:
+        parametros = parametros_ejemplo(sentencia['sql'], chat_id, ahora)
+        resultado = {**sentencia, **revisar_plan(conn, sentencia['sql'], parametros)}
+        if not args.sin_tiempos:
+            resultado['tiempo'] = cronometrar(conn, sentencia['sql'], parametros, args.repeticiones)
+        resultados.append(resultado)
+        marca = '🔴' if resultado['problemas'] else '🟢'
+        tiempo = f" {resultado['tiempo']['p50_ms']:>9.3f} ms" if 'tiempo' in resultado else ''
+        print(f"{marca}{tiempo}  {sentencia['sql'][:90]}")
+        for paso in resultado['problemas']:
+            print(f"      ↳ {paso}")
+    conn.close()
+
+    return {
+        'fixture': {'ruta': ruta, 'filas': args.filas, 'esquema': bot.ESQUEMA_VERSION},
+        'sentencias': resultados,
+        'sin_variante': pendientes,
+        'regresiones': sum(1 for r in resultados if r['problemas']) + len(pendientes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.planes', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=1_000_000, help='Mensajes del fixture')
+    parser.add_argument('--repeticiones', type=int, default=5, help='Ejecuciones de cada lectura')
+    parser.add_argument('--sin-tiempos', action='store_true', help='Solo revisar los planes')
+    parser.add_argument('--directorio', default=os.path.join(tempfile.gettempdir(), 'bot_benchmarks'))
+    parser.add_argument('--salida', help='Fichero JSON de resultados')
+    args = parser.parse_args()
+    os.makedirs(args.directorio, exist_ok=True)
+
+    informe = {
+        'meta': {
+            'commit': commit_actual(),
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'plataforma': platform.platform(),
+            'config': {k: v for k, v in vars(args).items() if k != 'salida'},
+        },
+        'resultados': {'planes': ejecutar(args)},
+    }
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(informe, indent=2, ensure_ascii=False, default=str) + '\n')
+        print(f"💾 Resultados guardados en {args.salida}")
+
+    planes = informe['resultados']['planes']
+    for pendiente in planes['sin_variante']:
+        print(f"🔴 {pendiente['origen']}: SQL dinámico sin entrada en VARIANTES "
+              f"({', '.join(pendiente['expresiones'])})")
+    if planes['regresiones']:
+        print(f"🔴 {planes['regresiones']} sentencia(s) con planes sin índice")
+        sys.exit(1)
+    print(f"✅ {len(planes['sentencias'])} sentencias con planes correctos")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+Arnés de carga end-to-end.
+
+Alimenta la Application real (la de construir_aplicacion(), con todos los
+handlers de main) con un flujo de Updates sintético o grabado, a un ritmo
+controlado, usando un BotFalso que registra las llamadas salientes.
+Mide updates/s sostenidos, latencia p50/p95/p99 desde que el update entra
+en la cola hasta que termina su último handler, y el lag del event loop.
+
+    python -m benchmarks.replay --tasa 200 --duracion 30 --chats 20
+    python -m benchmarks.replay --mezcla resumen=0.01,stats=0.005,datos=0.002
+    python -m benchmarks.replay --fichero updates.jsonl --tasa 0 --salida replay.json
+    python -m benchmarks.replay --tasa 0 --chats 50 --verificar-orden
+    python -m benchmarks.replay --simular-flood --mezcla stats=0.1 [--sin-limitador]
+
+Tras la ejecución se comprueba que, en cada chat, los mensajes se guardaron en
+el mismo orden en que llegaron (ids de la tabla crecientes con message_id),
+que es la garantía del procesamiento concurrente por chat.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+from benchmarks import commit_actual, percentiles, preparar_entorno
+
+# Grupo muy alto: el TypeHandler de medición se ejecuta después de todos los del bot
+GRUPO_MEDICION = 1_000_000
+
+JUEGOS = ('Catan', 'Ark Nova', 'Spirit Island', 'Azul', 'Wingspan', 'Brass Birmingham')
+
+
+def _mezcla(texto: str) -> dict:
+    """'resumen=0.01,stats=0.005' -> {'resumen': 0.01, 'stats': 0.005}"""
+    mezcla = {}
+    for parte in texto.split(','):
+        if parte.strip():
+            comando, proporcion = parte.split('=')
+            mezcla[comando.strip()] = float(proporcion)
+    return mezcla
+
+
+def tipo_update(update) -> str:
+    """'mensaje' o el nombre del comando, para agrupar latencias"""
+    mensaje = getattr(update, 'message', None)
+    texto = (mensaje.text or '') if mensaje else ''
+    if texto.startswith('/'):
+        return texto.split()[0][1:].split('@')[0]
+    return 'mensaje' if mensaje else 'otro'
+
+
+def updates_sinteticos(tg, args):
+    """Genera updates sin fin repartidos entre `args.chats` grupos"""
+    from benchmarks.generador import GeneradorChat
+    from benchmarks.telegram_falso import crear_update
+
+    rng = random.Random(args.semilla)
+    generador = GeneradorChat(usuarios=args.usuarios, semilla=args.semilla)
+    chats = [-1009000000000 - i for i in range(args.chats)]
+    siguiente_id = {chat_id: args.filas_previas + 1 for chat_id in chats}
+    comandos = list(args.mezcla.items())
+
+    while True:
+        chat_id = rng.choice(chats)
+        user_id = rng.randint(1, args.usuarios)
+        texto = None
+        tirada = rng.random()
+        acumulado = 0.0
+        for comando, proporcion in comandos:
+            acumulado += proporcion
+            if tirada < acumulado:
+                texto = f'/{comando}'
+                if comando == 'datos':
+                    texto += f' {rng.choice(JUEGOS)}'
+                elif comando == 'resumen':
+                    texto += f' {rng.choice((1, 3, 24))}'
+                break
+        if texto is None:
+            texto = generador.texto()
+
+        message_id = siguiente_id[chat_id]
+        siguiente_id[chat_id] += 1
+        yield crear_update(tg, chat_id, user_id, texto, message_id)
+
+
+def verificar_orden(bot, chats) -> dict:
+    """
+    Cuenta, por chat, los mensajes guardados fuera de orden: recorriendo la
+    tabla por id (orden de inserción), message_id debe ser siempre creciente.
+    """
+    violaciones = 0
+    filas = 0
+    for chat_id in chats:
+        conn = bot.conectar_chat(chat_id)
+        anterior = None
+        for (message_id,) in conn.execute(
+            'SELECT message_id FROM mensajes WHERE chat_id = ? ORDER BY id', (chat_id,)
+        ):
+            if anterior is not None and message_id < anterior:
+                violaciones += 1
+            anterior = message_id
+            filas += 1
+        conn.close()
+    return {'chats': len(chats), 'mensajes': filas, 'violaciones': violaciones}
+
+
+def updates_grabados(tg, ruta: str):
+    """Lee updates en JSONL (formato de getUpdates / Update.to_dict())"""
+    from telegram import Update
+
+    with open(ruta, encoding='utf-8') as f:
+        for linea in f:
+            if linea.strip():
+                yield Update.de_json(json.loads(linea), tg)
+
+
+async def ejecutar(args) -> dict:
+    bot, servidores = preparar_entorno(
+        args.directorio, args.latencia_openai, args.latencia_bgg, args.pausa_bgg
+    )
+    from telegram import Update
+    from telegram.ext import Application, TypeHandler
+
+    from benchmarks.generador import GeneradorChat, poblar_db
+    from benchmarks.telegram_falso import BotFalso
+
+    # Los chats sintéticos no están en la lista de grupos permitidos
+    bot.GRUPOS_PERMITIDOS = []
+    ruta_db = os.path.join(args.directorio, 'replay.db')
+    if os.path.exists(ruta_db):
+        os.remove(ruta_db)
+    bot.DB_NAME = ruta_db
+    bot.inicializar_db()
+
+    if args.filas_previas and not args.fichero:
+        for i in range(args.chats):
+            generador = GeneradorChat(usuarios=args.usuarios, semilla=args.semilla + i,
+                                      mensajes_por_hora=max(1, args.filas_previas / 48))
+            poblar_db(ruta_db, -1009000000000 - i, generador, args.filas_previas)
+
+    tg = BotFalso(
+        latencia_s=args.latencia_telegram,
+        simular_flood=args.simular_flood,
+        rate_limiter=None if args.sin_limitador else bot.crear_limitador_envios(),
+    )
+    application = bot.construir_aplicacion(Application.builder().bot(tg).updater(None))
+
+    entradas = {}  # update_id -> (perf_counter al encolar, tipo)
+    chats = set()
+    latencias = {}  # tipo -> [segundos]
+    completados = 0
+    ultimo_fin = time.perf_counter()
+
+    async def marcar_fin(update, context):
+        nonlocal completados, ultimo_fin
+        entrada = entradas.pop(update.update_id, None)
+        if entrada:
+            ahora = time.perf_counter()
+            latencias.setdefault(entrada[1], []).append(ahora - entrada[0])
+            completados += 1
+            ultimo_fin = ahora
+
+    application.add_handler(TypeHandler(Update, marcar_fin), group=GRUPO_MEDICION)
+
+    lag = []
+    parar_lag = asyncio.Event()
+
+    async def medir_lag():
+        intervalo = 0.01
+        while not parar_lag.is_set():
+            esperado = time.perf_counter() + intervalo
+            await asyncio.sleep(intervalo)
+            lag.append(max(0.0, time.perf_counter() - esperado))
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    tarea_lag = asyncio.create_task(medir_lag())
+
+    fuente = updates_grabados(tg, args.fichero) if args.fichero else updates_sinteticos(tg, args)
+    enviados = 0
+    inicio = time.perf_counter()
+    limite = inicio + args.duracion
+
+    for update in fuente:
+        ahora = time.perf_counter()
+        if ahora >= limite:
+            break
+        if args.tasa > 0:
+            # Ritmo absoluto: si vamos tarde no se duerme (se mide la cola creciendo)
+            objetivo = inicio + enviados / args.tasa
+            if objetivo > ahora:
+                await asyncio.sleep(objetivo - ahora)
+        elif enviados % 100 == 0:
+            await asyncio.sleep(0)
+        entradas[update.update_id] = (time.perf_counter(), tipo_update(update))
+        if update.effective_chat:
+            chats.add(update.effective_chat.id)
+        await application.update_queue.put(update)
+        enviados += 1
+
+    fin_envio = time.perf_counter()
+    espera_max = fin_envio + args.espera
+    while entradas and time.perf_counter() < espera_max:
+        await asyncio.sleep(0.05)
+
+    parar_lag.set()
+    await tarea_lag
+    orden = verificar_orden(bot, sorted(chats))
+    await application.stop()
+    await application.shutdown()
+    for servidor in servidores:
+        servidor.parar()
+
+    duracion = max(ultimo_fin - inicio, 1e-9)
+    todas = [x for muestras in latencias.values() for x in muestras]
+    return {
+        'updates_enviados': enviados,
+        'updates_completados': completados,
+        'updates_pendientes': len(entradas),
+        'duracion_s': round(duracion, 3),
+        'tasa_objetivo_por_s': args.tasa,
+        'updates_por_s': round(completados / duracion, 1),
+        'latencia': percentiles(todas),
+        'latencia_por_tipo': {tipo: percentiles(m) for tipo, m in sorted(latencias.items())},
+        'lag_bucle': percentiles(lag),
+        'orden': orden,
+        'llamadas_bot': dict(Counter(endpoint for _, endpoint, _ in tg.llamadas)),
+        'retry_after': len(tg.floods),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.replay', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fichero', help='Updates grabados en JSONL (si no, se generan)')
+    parser.add_argument('--tasa', type=float, default=100, help='Updates por segundo (0 = sin límite)')
+    parser.add_argument('--duracion', type=float, default=10, help='Segundos enviando updates')
+    parser.add_argument('--espera', type=float, default=60, help='Segundos máximos esperando a vaciar la cola')
+    parser.add_argument('--chats', type=int, default=10, help='Grupos sintéticos')
+    parser.add_argument('--usuarios', type=int, default=30, help='Usuarios por grupo')
+    parser.add_argument('--mezcla', type=_mezcla, default=_mezcla('resumen=0.005,stats=0.005,datos=0.002'),
+                        help='Proporción de cada comando; el resto son mensajes normales')
+    parser.add_argument('--filas-previas', type=int, default=0,
+                        help='Mensajes históricos por grupo antes de empezar')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--latencia-telegram', type=float, default=0.02, help='Latencia de la Bot API falsa (s)')
+    parser.add_argument('--latencia-openai', type=float, default=1.0, help='Latencia del OpenAI falso (s)')
+    parser.add_argument('--latencia-bgg', type=float, default=0.3, help='Latencia del BGG falso (s)')
+    parser.add_argument('--pausa-bgg', type=float, default=5.0,
+                        help='Pausa de rate limit entre peticiones a BGG (5s como en producción)')
+    parser.add_argument('--simular-flood', action='store_true',
+                        help='La Bot API falsa responde RetryAfter al pasarse de los límites de Telegram')
+    parser.add_argument('--sin-limitador', action='store_true',
+                        help='Enviar sin la cola de envíos del bot (para comparar)')
+    parser.add_argument('--directorio', default=os.path.join(tempfile.gettempdir(), 'bot_benchmarks'))
+    parser.add_argument('--salida', help='Fichero JSON de resultados')
+    parser.add_argument('--verificar-orden', action='store_true',
+                        help='Salir con código 1 si algún chat guardó mensajes fuera de orden')
+    args = parser.parse_args()
+    os.makedirs(args.directorio, exist_ok=True)
+
+    informe = {
+        'meta': {
+            'commit': commit_actual(),
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'config': {k: v for k, v in vars(args).items() if k != 'salida'},
+        },
+        'resultados': {'replay': asyncio.run(ejecutar(args))},
+    }
+
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+        print(f"💾 Resultados guardados en {args.salida}")
+    else:
+        print(texto)
+
+    orden = informe['resultados']['replay']['orden']
+    if args.verificar_orden and orden['violaciones']:
+        print(f"🔴 {orden['violaciones']} mensaje(s) guardados fuera de orden")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Servidores HTTP locales que sustituyen a OpenAI y a la XML API2 de BGG.
+
+Ambos responden con una latencia configurable para que los escenarios
+midan el coste propio del bot separado del de la red. El de OpenAI puede
+además fallar (500) o tardar mucho en una fracción de las peticiones.
+"""
+
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import quoteattr
+
+
+class _ServidorFalso(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, latencia_s: float):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.latencia_s = latencia_s
+        self.peticiones = 0
+        # Inyección de fallos (solo OpenAI): proporción de 500 y de respuestas lentas
+        self.fallos = 0.0
+        self.lentas = 0.0
+        self.latencia_lenta_s = 0.0
+        self.rng = random.Random(42)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def handle_error(self, request, client_address):
+        pass  # Clientes que cortan la conexión al vencer su plazo
+
+    def arrancar(self) -> '_ServidorFalso':
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def parar(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _HandlerBase(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def responder(self, estado: int, cuerpo: bytes, tipo: str):
+        self.server.peticiones += 1
+        if self.server.latencia_s:
+            time.sleep(self.server.latencia_s)
+        self.send_response(estado)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _HandlerOpenAI(_HandlerBase):
+    """Imita POST /v1/chat/completions con una respuesta fija y usage estimado"""
+
+    def do_POST(self):
+        longitud = int(self.headers.get('Content-Length', 0))
+        peticion = json.loads(self.rfile.read(longitud) or b'{}')
+
+        tirada = self.server.rng.random()
+        if tirada < self.server.fallos:
+            error = {'error': {'message': 'Servidor sobrecargado', 'type': 'server_error'}}
+            self.responder(500, json.dumps(error).encode('utf-8'), 'application/json')
+            return
+        if tirada < self.server.fallos + self.server.lentas:
+            time.sleep(self.server.latencia_lenta_s)
+
+        prompt = ''.join(m.get('content', '') for m in peticion.get('messages', []))
+        prompt_tokens = max(1, len(prompt) // 4)
+        contenido = (
+            "1. **Temas principales**: juegos de mesa y quedadas\n"
+            "2. **Participantes activos**: @usuario_1, @usuario_2\n"
+            "3. **Puntos clave**: partida el sábado\n"
+            "4. **Tono**: distendido"
+        )
+        completion_tokens = len(contenido) // 4
+        cuerpo = json.dumps({
+            'id': 'chatcmpl-benchmark',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': peticion.get('model', 'gpt-4o-mini'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': contenido},
+                'finish_reason': 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+            },
+        }).encode('utf-8')
+        self.responder(200, cuerpo, 'application/json')
+
+
+class _HandlerBGG(_HandlerBase):
+    """Imita GET /search y GET /thing de la XML API2 de BoardGameGeek"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        if url.path.endswith('/search'):
+            nombre = params.get('query', ['Juego'])[0]
+            bgg_id = 100000 + sum(map(ord, nombre)) % 100000
+            xml = (
+                '<items total="1">'
+                f'<item type="boardgame" id="{bgg_id}">'
+                f'<name type="primary" value={quoteattr(nombre)}/>'
+                '</item></items>'
+            )
+        elif url.path.endswith('/thing'):
+            bgg_id = params.get('id', ['1'])[0]
+            descripcion = "Un juego de mesa de ejemplo con gestión de recursos. " * 12
+            xml = (
+                '<items>'
+                f'<item type="boardgame" id="{bgg_id}">'
+                '<image>https://example.invalid/imagen.jpg</image>'
+                '<name type="primary" value="Juego de ejemplo"/>'
+                f'<description>{descripcion}</description>'
+                '<yearpublished value="2019"/>'
+                '<minplayers value="1"/><maxplayers value="4"/>'
+                '<playingtime value="90"/>'
+                '<poll name="suggested_numplayers">'
+                '<results numplayers="2"><result value="Best" numvotes="40"/></results>'
+                '<results numplayers="3"><result value="Best" numvotes="55"/></results>'
+                '</poll>'
+                '<link type="boardgamemechanic" id="1" value="Worker Placement"/>'
+                '<link type="boardgamemechanic" id="2" value="Hand Management"/>'
+                '<statistics><ratings>'
+                '<ranks><rank type="subtype" name="boardgame" value="42"/></ranks>'
+                '<averageweight value="2.85"/>'
+                '</ratings></statistics>'
+                '</item></items>'
+            )
+        else:
+            self.responder(404, b'', 'text/plain')
+            return
+
+        self.responder(200, xml.encode('utf-8'), 'application/xml')
+
+
+def servidor_openai(latencia_s: float = 0.0) -> _ServidorFalso:
+    """Arranca un OpenAI falso. Usar `<url>/v1` como OPENAI_BASE_URL"""
+    return _ServidorFalso(_HandlerOpenAI, latencia_s).arrancar()
+
+
+def servidor_bgg(latencia_s: float = 0.0) -> _ServidorFalso:
+    """Arranca una XML API2 de BGG falsa. Usar su url como BGG_API_BASE"""
+    return _ServidorFalso(_HandlerBGG, latencia_s).arrancar()
@@ -0,0 +1,171 @@
+"""
+Bot de Telegram falso y constructores de Update.
+
+BotFalso es un ExtBot real de python-telegram-bot al que solo se le sustituye
+el transporte HTTP: cada llamada a la Bot API se registra en memoria y se
+responde con un resultado mínimo válido, así los handlers del bot se ejecutan
+sin cambios y sin red.
+"""
+
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timezone
+from itertools import count, islice
+
+from telegram import Chat, ForumTopicCreated, Message, MessageEntity, Update, User
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+USUARIO_BOT = {'id': 1, 'is_bot': True, 'first_name': 'Bot', 'username': 'resumen_bot'}
+
+
+class BotFalso(ExtBot):
+    """
+    ExtBot que no sale a la red.
+
+    Args:
+        latencia_s: retardo simulado de cada llamada a la Bot API
+        admins: ids de usuario que get_chat_member devuelve como administradores
+        simular_flood: responder RetryAfter como Telegram al pasar de 30 envíos/s
+            en total o de 20/min en un grupo
+        rate_limiter: se respeta igual que en un ExtBot normal
+    """
+
+    def __init__(self, latencia_s: float = 0.0, admins: set = frozenset(),
+                 simular_flood: bool = False, **kwargs):
+        super().__init__(token='123456:BENCHMARK', **kwargs)
+        with self._unfrozen():
+            self._latencia_s = latencia_s
+            self._admins = set(admins)
+            self._ids_mensaje = count(10_000_000)
+            self._simular_flood = simular_flood
+            self._envios_global = deque()
+            self._envios_chat = {}
+            self.llamadas = []  # (monotonic, endpoint, data)
+            self.floods = []  # instantes en que se respondió RetryAfter
+            self.pendientes = deque()  # Updates que entrega getUpdates (como el backlog tras un reinicio)
+
+    async def _do_post(self, endpoint: str, data: dict, **kwargs):
+        if self.rate_limiter and endpoint != 'getUpdates':
+            return await self.rate_limiter.process_request(
+                callback=self._transporte, args=(endpoint, data), kwargs={},
+                endpoint=endpoint, data=data, rate_limit_args=None,
+            )
+        return await self._transporte(endpoint, data)
+
+    async def _transporte(self, endpoint: str, data: dict):
+        if self._simular_flood and (endpoint.startswith('send') or endpoint.startswith('edit')):
+            self._comprobar_flood(int(data.get('chat_id', 0)))
+        self.llamadas.append((time.monotonic(), endpoint, data))
+        if self._latencia_s:
+            await asyncio.sleep(self._latencia_s)
+        return self._resultado(endpoint, data)
+
+    def _comprobar_flood(self, chat_id: int):
+        ahora = time.monotonic()
+        recientes = self._envios_chat.setdefault(chat_id, deque())
+        for envios, ventana in ((self._envios_global, 1.0), (recientes, 60.0)):
+            while envios and envios[0] <= ahora - ventana:
+                envios.popleft()
+        limite_chat = 20 if chat_id < 0 else 60
+        if len(self._envios_global) >= 30 or len(recientes) >= limite_chat:
+            self.floods.append(ahora)
+            raise RetryAfter(1 if len(recientes) < limite_chat else int(recientes[0] + 60 - ahora) + 1)
+        self._envios_global.append(ahora)
+        recientes.append(ahora)
+
+    def _resultado(self, endpoint: str, data: dict):
+        if endpoint == 'getMe':
+            return USUARIO_BOT
+        if endpoint == 'getUpdates':
+            # Como Telegram: pedir desde `offset` da por recibidos los anteriores
+            desde = int(data.get('offset') or 0)
+            while self.pendientes and self.pendientes[0].update_id < desde:
+                self.pendientes.popleft()
+            return [u.to_dict() for u in islice(self.pendientes, int(data.get('limit') or 100))]
+        if endpoint == 'getChatMember':
+            return self._miembro(int(data.get('user_id', 0)))
+        if endpoint == 'getChatAdministrators':
+            return [self._miembro(user_id) for user_id in sorted(self._admins)]
+        if endpoint.startswith('send') or endpoint.startswith('edit'):
+            mensaje = {
+                'message_id': next(self._ids_mensaje),
+                'date': int(time.time()),
+                'chat': {'id': int(data.get('chat_id', 0)), 'type': 'supergroup'},
+                'from': USUARIO_BOT,
+            }
+            if 'text' in data:
+                mensaje['text'] = str(data['text'])
+            if 'message_thread_id' in data:
+                mensaje['message_thread_id'] = int(data['message_thread_id'])
+            return mensaje
+        return True
+
+    def _miembro(self, user_id: int) -> dict:
+        estado = 'administrator' if user_id in self._admins else 'member'
+        miembro = {
+            'status': estado,
+            'user': {'id': user_id, 'is_bot': False, 'first_name': f'Usuario {user_id}'},
+        }
+        if estado == 'administrator':
+            miembro.update({
+                'can_be_edited': False, 'is_anonymous': False,
+                'can_manage_chat': True, 'can_delete_messages': True,
+                'can_manage_video_chats': True, 'can_restrict_members': True,
+                'can_promote_members': False, 'can_change_info': True,
+                'can_invite_users': True, 'can_post_stories': False,
+                'can_edit_stories': False, 'can_delete_stories': False,
+            })
+        return miembro
+
+    def enviados(self) -> list:
+        """Llamadas que producen mensajes visibles en el chat"""
+        return [(t, e, d) for t, e, d in self.llamadas if e.startswith('send')]
+
+
+_ids_update = count(1)
+
+
+def crear_update(bot: ExtBot, chat_id: int, user_id: int, texto: str,
+                 message_id: int, fecha: datetime = None,
+                 tipo_chat: str = Chat.SUPERGROUP, thread_id: int = None) -> Update:
+    """
+    Construye un Update de mensaje de texto como los que entrega Telegram.
+    Si el texto empieza por "/" se marca como comando (entidad bot_command)
+    para que CommandHandler lo reconozca. Con `thread_id` el chat es un foro y
+    el mensaje, como en Telegram, responde al que creó el tema.
+    """
+    fecha = fecha or datetime.now(timezone.utc)
+    entidades = []
+    if texto.startswith('/'):
+        comando = texto.split()[0]
+        entidades.append(MessageEntity(MessageEntity.BOT_COMMAND, 0, len(comando)))
+
+    chat = Chat(id=chat_id, type=tipo_chat, title='Grupo benchmark', is_forum=True if thread_id else None)
+    creacion_tema = None
+    if thread_id:
+        creacion_tema = Message(
+            message_id=thread_id, date=fecha, chat=chat,
+            forum_topic_created=ForumTopicCreated(name=f'Tema {thread_id}', icon_color=0x6FB9F0),
+            message_thread_id=thread_id, is_topic_message=True,
+        )
+
+    mensaje = Message(
+        message_id=message_id,
+        date=fecha,
+        chat=chat,
+        from_user=User(
+            id=user_id, is_bot=False, first_name=f'Usuario {user_id}',
+            username=f'usuario_{user_id}'
+        ),
+        text=texto,
+        entities=entidades or None,
+        message_thread_id=thread_id,
+        is_topic_message=True if thread_id else None,
+        reply_to_message=creacion_tema,
+    )
+    mensaje.set_bot(bot)
+    update = Update(update_id=next(_ids_update), message=mensaje)
+    update.set_bot(bot)
+    return update
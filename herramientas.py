@@ -0,0 +1,354 @@
+"""
+Herramientas de mantenimiento del bot (se ejecutan aparte del proceso del bot).
+
+    python herramientas.py migrar-shards [--lote 5000] [--purgar]
+    python herramientas.py importar result.json [--chat-id -1001234567890]
+    python herramientas.py importar mensajes.jsonl
+    python herramientas.py exportar -1001234567890 mensajes.jsonl [--desde 2024-01-01]
+    python herramientas.py copia
+    python herramientas.py verificar [copias/20240101-050000]
+    python herramientas.py restaurar copias/20240101-050000
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+import telegram_summary_bot2 as bot
+
+# Trozos leídos del fichero de export en cada vuelta del parser
+TAMANO_TROZO = 1 << 20
+
+
+def cmd_migrar_shards(args):
+    """Reparte la base única en un fichero SQLite por chat (ver DB_MODO)"""
+    print(f"🗂️ Migrando {bot.DB_NAME} → {bot.DB_SHARDS_DIR}/chat_<id>.db")
+    bot.inicializar_db()
+    resultado = bot.migrar_a_shards(lote=args.lote, purgar=args.purgar, pausa_s=args.pausa)
+
+    print(f"✅ {resultado['copiadas']:,} mensajes copiados (último id {resultado['ultimo_id']})")
+    for chat_id, n in sorted(resultado['por_chat'].items()):
+        print(f"   • {chat_id}: {n:,}")
+    if bot.DB_MODO != 'por_chat':
+        print("💡 Arranca el bot con DB_MODO=por_chat y vuelve a lanzar la migración "
+              "para copiar los mensajes que lleguen entre medias.")
+
+
+# ============================
+# IMPORTACIÓN / EXPORTACIÓN
+# ============================
+
+def leer_export_telegram(ruta: str):
+    """
+    Lee un result.json de Telegram Desktop ("Exportar historial del chat", JSON)
+    sin cargarlo entero: decodifica uno a uno los objetos del array "messages"
+    con JSONDecoder.raw_decode sobre un buffer que se va rellenando por trozos.
+
+    Devuelve (cabecera, generador_de_mensajes); la cabecera trae name/type/id del chat.
+    """
+    decodificador = json.JSONDecoder()
+    f = open(ruta, encoding='utf-8')
+    buffer = ''
+
+    # Cabecera: todo lo que hay antes de "messages": [
+    patron_inicio = re.compile(r'"messages"\s*:\s*\[')
+    while True:
+        trozo = f.read(TAMANO_TROZO)
+        buffer += trozo
+        inicio = patron_inicio.search(buffer)
+        if inicio:
+            break
+        if not trozo:
+            f.close()
+            raise ValueError(f"{ruta} no parece un export de chat de Telegram (no hay \"messages\")")
+
+    cabecera = {}
+    for clave in ('name', 'type', 'id'):
+        valor = re.search(rf'"{clave}"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+)', buffer[:inicio.start()])
+        if valor:
+            cabecera[clave] = json.loads(valor.group(1))
+
+    def mensajes():
+        nonlocal buffer
+        posicion = inicio.end()
+        fin_fichero = False
+        try:
+            while True:
+                # Saltar separadores hasta el siguiente objeto o el final del array
+                while True:
+                    while posicion < len(buffer) and buffer[posicion] in ' \t\r\n,':
+                        posicion += 1
+                    if posicion < len(buffer) or fin_fichero:
+                        break
+                    trozo = f.read(TAMANO_TROZO)
+                    fin_fichero = not trozo
+                    buffer, posicion = buffer[posicion:] + trozo, 0
+
+                if posicion >= len(buffer) or buffer[posicion] == ']':
+                    return
+
+                try:
+                    mensaje, posicion = decodificador.raw_decode(buffer, posicion)
+                except json.JSONDecodeError:
+                    # Objeto partido entre dos trozos: leer más y reintentar
+                    if fin_fichero:
+                        raise
+                    trozo = f.read(TAMANO_TROZO)
+                    fin_fichero = not trozo
+                    buffer, posicion = buffer[posicion:] + trozo, 0
+                    continue
+                yield mensaje
+
+                # Descartar lo ya leído para que el buffer no crezca con el fichero
+                if posicion > TAMANO_TROZO:
+                    buffer, posicion = buffer[posicion:], 0
+        finally:
+            f.close()
+
+    return cabecera, mensajes()
+
+
+def chat_id_de_export(cabecera: dict) -> int:
+    """El export guarda el id sin el prefijo de la Bot API (-100 en supergrupos, - en grupos)"""
+    ident = int(cabecera['id'])
+    tipo = cabecera.get('type', '')
+    if 'supergroup' in tipo or 'channel' in tipo:
+        return int(f'-100{ident}')
+    if 'group' in tipo:
+        return -ident
+    return ident
+
+
+def texto_export(texto) -> str:
+    """En el export "text" es un string o una lista de trozos (strings y entidades con "text")"""
+    if isinstance(texto, str):
+        return texto
+    return ''.join(t if isinstance(t, str) else t.get('text', '') for t in texto)
+
+
+def filas_export_telegram(mensajes, chat_id: int):
+    """Convierte los mensajes del export en filas de la tabla mensajes (como guardar_mensaje_handler)"""
+    for m in mensajes:
+        if m.get('type') != 'message':
+            continue  # Mensajes de servicio (entradas, fijados...)
+        texto = texto_export(m.get('text', ''))
+        if not texto or texto.startswith('/'):
+            continue  # El bot tampoco guarda mensajes sin texto ni comandos
+
+        from_id = str(m.get('from_id', ''))
+        digitos = ''.join(c for c in from_id if c.isdigit())
+        user_id = int(digitos) if digitos else 0
+        if from_id.startswith('channel'):
+            user_id = int(f'-100{user_id}')
+
+        yield (
+            chat_id,
+            int(m['id']),
+            user_id,
+            'sin_usuario',  # El export no trae el @username, solo el nombre visible
+            m.get('from') or 'Usuario',
+            texto,
+            datetime.fromisoformat(m['date']).isoformat(' '),
+            m.get('reply_to_message_id'),
+            None,  # El export no distingue temas de foro
+        )
+
+
+def filas_jsonl(ruta: str):
+    """Filas de un fichero generado con `exportar` (una fila de mensajes por línea)"""
+    with open(ruta, encoding='utf-8') as f:
+        for linea in f:
+            if linea.strip():
+                m = json.loads(linea)
+                yield (
+                    m['chat_id'], m['message_id'], m['user_id'], m['username'],
+                    m['first_name'], m['texto'], m['timestamp'], m.get('respuesta_a'),
+                    m.get('thread_id'),
+                )
+
+
+def insertar_filas(filas, lote: int) -> tuple:
+    """
+    Inserta en lotes de `lote` filas con executemany, una transacción por lote.
+    Los duplicados los descarta UNIQUE(chat_id, message_id): reimportar es seguro.
+    Devuelve (leídas, insertadas).
+    """
+    conexiones = {}
+    pendientes = {}  # chat_id -> filas del lote en curso
+    leidas = insertadas = 0
+    inicio = time.perf_counter()
+
+    def volcar(chat_id):
+        nonlocal insertadas
+        conn = conexiones.get(chat_id)
+        if conn is None:
+            conn = conexiones[chat_id] = bot.conectar_chat(chat_id)
+        cursor = conn.executemany('''
+            INSERT OR IGNORE INTO mensajes
+            (chat_id, message_id, user_id, username, first_name, texto, timestamp, respuesta_a, thread_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', pendientes.pop(chat_id))
+        conn.commit()
+        insertadas += cursor.rowcount
+
+    try:
+        for fila in filas:
+            pendientes.setdefault(fila[0], []).append(fila)
+            leidas += 1
+            if len(pendientes[fila[0]]) >= lote:
+                volcar(fila[0])
+                print(f"   … {leidas:,} mensajes ({leidas / (time.perf_counter() - inicio):,.0f}/s)")
+        for chat_id in list(pendientes):
+            volcar(chat_id)
+    finally:
+        for conn in conexiones.values():
+            conn.close()
+
+    return leidas, insertadas
+
+
+def cmd_importar(args):
+    """Importa un result.json de Telegram Desktop o un JSONL generado con `exportar`"""
+    bot.inicializar_db()
+    inicio = time.perf_counter()
+
+    if args.fichero.endswith('.jsonl'):
+        print(f"📥 Importando {args.fichero} (JSONL)")
+        filas = filas_jsonl(args.fichero)
+    else:
+        cabecera, mensajes = leer_export_telegram(args.fichero)
+        chat_id = args.chat_id if args.chat_id is not None else chat_id_de_export(cabecera)
+        print(f"📥 Importando '{cabecera.get('name', '?')}' como chat {chat_id}")
+        filas = filas_export_telegram(mensajes, chat_id)
+
+    leidas, insertadas = insertar_filas(filas, args.lote)
+    duracion = time.perf_counter() - inicio
+    print(f"✅ {leidas:,} mensajes leídos, {insertadas:,} nuevos "
+          f"({leidas - insertadas:,} ya estaban) en {duracion:.1f}s "
+          f"({leidas / max(duracion, 1e-9):,.0f} mensajes/s)")
+
+
+def cmd_exportar(args):
+    """Exporta los mensajes de un chat a JSONL, en streaming (fetchmany)"""
+    condiciones = ['chat_id = ?']
+    parametros = [args.chat_id]
+    if args.desde:
+        condiciones.append('timestamp >= ?')
+        parametros.append(args.desde)
+    if args.hasta:
+        condiciones.append('timestamp < ?')
+        parametros.append(args.hasta)
+
+    conn = bot.conectar_chat(args.chat_id)
+    cursor = conn.execute(f'''
+        SELECT chat_id, message_id, user_id, username, first_name, texto, timestamp, respuesta_a, thread_id
+        FROM mensajes
+        WHERE {' AND '.join(condiciones)}
+        ORDER BY timestamp, id
+    ''', parametros)
+    columnas = [c[0] for c in cursor.description]
+
+    total = 0
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        while True:
+            filas = cursor.fetchmany(args.lote)
+            if not filas:
+                break
+            f.writelines(json.dumps(dict(zip(columnas, fila)), ensure_ascii=False) + '\n' for fila in filas)
+            total += len(filas)
+    conn.close()
+    print(f"📤 {total:,} mensajes de {args.chat_id} exportados a {args.salida}")
+
+
+# ============================
+# COPIAS DE SEGURIDAD
+# ============================
+
+def cmd_copia(args):
+    """Hace ahora una copia de seguridad (se puede lanzar con el bot en marcha)"""
+    bot.inicializar_db()
+    bot.hacer_copia_seguridad()
+
+
+def cmd_verificar(args):
+    """Verifica una copia, o todas las de BACKUP_DIR (integrity_check de cada base)"""
+    copias = [args.copia] if args.copia else bot.listar_copias()
+    if not copias:
+        print(f"⚠️ No hay copias en {bot.BACKUP_DIR}/")
+        return
+    fallidas = 0
+    for copia in copias:
+        for origen, _ in bot.bases_de_copia(copia):
+            if not os.path.exists(origen):
+                print(f"🔴 {origen}: no existe")
+                fallidas += 1
+                continue
+            resultado = bot.verificar_copia(origen)
+            if resultado['problemas']:
+                fallidas += 1
+                print(f"🔴 {origen}: {'; '.join(resultado['problemas'][:5])}")
+            else:
+                print(f"🟢 {origen}: esquema v{resultado['esquema']}, {resultado['mensajes']:,} mensajes")
+    if fallidas:
+        sys.exit(1)
+
+
+def cmd_restaurar(args):
+    """Restaura una copia sobre la base actual (con el bot parado)"""
+    restauradas = bot.restaurar_copia(args.copia)
+    print(f"✅ Restauradas {len(restauradas)} base(s) desde {args.copia} "
+          f"(la anterior queda en {bot.DB_NAME}.antes-de-restaurar)")
+    bot.inicializar_db()  # Por si la copia es de un esquema anterior
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    migrar = subparsers.add_parser('migrar-shards', help=cmd_migrar_shards.__doc__)
+    migrar.add_argument('--lote', type=int, default=5000, help='Filas copiadas por transacción')
+    migrar.add_argument('--pausa', type=float, default=0.05,
+                        help='Segundos de pausa entre lotes (deja escribir al bot)')
+    migrar.add_argument('--purgar', action='store_true',
+                        help='Borrar de la base única las filas ya copiadas')
+    migrar.set_defaults(funcion=cmd_migrar_shards)
+
+    importar = subparsers.add_parser('importar', help=cmd_importar.__doc__)
+    importar.add_argument('fichero', help='result.json de Telegram Desktop o .jsonl de `exportar`')
+    importar.add_argument('--chat-id', type=int,
+                          help='chat_id de la Bot API (por defecto se deduce del export)')
+    importar.add_argument('--lote', type=int, default=50_000, help='Filas por transacción')
+    importar.set_defaults(funcion=cmd_importar)
+
+    exportar = subparsers.add_parser('exportar', help=cmd_exportar.__doc__)
+    exportar.add_argument('chat_id', type=int)
+    exportar.add_argument('salida', help='Fichero .jsonl de salida')
+    exportar.add_argument('--desde', help='Fecha inicial (YYYY-MM-DD[ HH:MM])')
+    exportar.add_argument('--hasta', help='Fecha final, no incluida')
+    exportar.add_argument('--lote', type=int, default=10_000, help='Filas leídas por vuelta')
+    exportar.set_defaults(funcion=cmd_exportar)
+
+    copia = subparsers.add_parser('copia', help=cmd_copia.__doc__)
+    copia.set_defaults(funcion=cmd_copia)
+
+    verificar = subparsers.add_parser('verificar', help=cmd_verificar.__doc__)
+    verificar.add_argument('copia', nargs='?', help='Directorio de la copia (por defecto, todas)')
+    verificar.set_defaults(funcion=cmd_verificar)
+
+    restaurar = subparsers.add_parser('restaurar', help=cmd_restaurar.__doc__)
+    restaurar.add_argument('copia', help='Directorio de la copia (BACKUP_DIR/AAAAMMDD-HHMMSS)')
+    restaurar.set_defaults(funcion=cmd_restaurar)
+
+    args = parser.parse_args()
+    # Los mensajes del bot (copias, migración...) salen en orden con los de la herramienta
+    bot.configurar_logs(en_segundo_plano=False)
+    args.funcion(args)
+
+
+if __name__ == '__main__':
+    main()
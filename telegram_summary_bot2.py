@@ -1,22 +1,46 @@
 import os
+import sys
+import asyncio
+import atexit
+import contextvars
+import copy
+import cProfile
+import heapq
+import json
+import logging
+import logging.handlers
+import math
+import multiprocessing
+import pstats
+import queue
 import sqlite3
-import requests
-import xml.etree.ElementTree as ET
+import threading
+import traceback
 import random
+import re
+import shutil
 import time
-from datetime import datetime, timedelta, time as dt_time
+from bisect import bisect_left
+from collections import Counter, deque
+from itertools import chain, count
+from functools import partial, wraps
+from datetime import datetime, timedelta, timezone, time as dt_time
 from threading import Thread
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from telegram import Update
 from telegram.ext import (
     Application, 
+    BaseRateLimiter,
+    BaseUpdateProcessor,
+    ChatMemberHandler,
     CommandHandler, 
     MessageHandler, 
     ContextTypes,
     filters
 )
-from telegram.error import BadRequest
-from openai import OpenAI
+from telegram.error import BadRequest, RetryAfter, TelegramError
+# openai, requests y xml.etree se importan al primer uso (ver ARRANQUE RÁPIDO)
 
 # Configuración
 TELEGRAM_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
@@ -27,7 +51,42 @@ BGG_API_TOKEN = os.environ.get('BGG_API_TOKEN')
 # Desde 2025, la XML API2 de BoardGameGeek requiere:
 # - Token de aplicación en Authorization: Bearer <token>
 # - Dominio sin www: https://boardgamegeek.com (no www.boardgamegeek.com)
-BGG_API_BASE = "https://boardgamegeek.com/xmlapi2"
+BGG_API_BASE = os.environ.get('BGG_API_BASE', "https://boardgamegeek.com/xmlapi2")
+# Pausa mínima entre peticiones a BGG (rate limit de la API)
+BGG_PAUSA_S = float(os.environ.get('BGG_PAUSA_S', '5'))
+# Los datos de un juego en bgg_cache_v2 valen este tiempo
+BGG_CACHE_VIGENCIA = timedelta(days=30)
+
+# Instante (time.monotonic(), común a todos los procesos de la máquina) reservado
+# para la última petición a BGG. Es un multiprocessing.Value que crea el proceso
+# principal y que iniciar_pool_trabajo() pasa a cada trabajador: /datos en el pool
+# y la precarga en el proceso principal llevan una sola cuenta.
+_bgg_ritmo = None
+_bgg_ritmo_lock = threading.Lock()
+
+def ritmo_bgg():
+    """Valor compartido con el instante de la última petición a BGG (se crea al primer uso)"""
+    global _bgg_ritmo
+    with _bgg_ritmo_lock:
+        if _bgg_ritmo is None:
+            _bgg_ritmo = multiprocessing.get_context('spawn').Value('d', 0.0)
+        return _bgg_ritmo
+
+def turno_bgg() -> float:
+    """
+    Reserva el hueco de la siguiente petición a BGG, BGG_PAUSA_S después de la
+    anterior de cualquier proceso, y espera a que llegue. Devuelve el instante.
+    El cerrojo solo se tiene para reservar: nadie espera dentro de él.
+    """
+    ritmo = ritmo_bgg()
+    with ritmo.get_lock():
+        instante = max(time.monotonic(), ritmo.value + BGG_PAUSA_S)
+        ritmo.value = instante
+    espera = instante - time.monotonic()
+    if espera > 0:
+        log_bgg.debug("⏳ BGG: Esperando %.1fs (rate limit)...", espera)
+        time.sleep(espera)
+    return instante
 
 def bgg_headers() -> dict:
     """
@@ -42,6 +101,27 @@ def bgg_headers() -> dict:
         headers["Authorization"] = f"Bearer {BGG_API_TOKEN}"
     return headers
 
+def bgg_get(endpoint: str, url: str, params: dict):
+    """GET a la XML API2 de BGG registrando latencia y código de estado"""
+    import requests  # Diferido: solo se paga con el primer /datos
+    
+    # ⏳ RATE LIMITING: BGG_PAUSA_S entre dos peticiones cualesquiera, de cualquier proceso
+    turno_bgg()
+    
+    try:
+        with BGG_DURACION.medir(endpoint):
+            response = requests.get(
+                url,
+                params=params,
+                headers=bgg_headers(),
+                timeout=10,
+            )
+    except Exception as e:
+        BGG_PETICIONES.inc(endpoint, type(e).__name__)
+        raise
+    BGG_PETICIONES.inc(endpoint, str(response.status_code))
+    return response
+
 # 🔐 CONTROL DE ACCESO: Lista de IDs de grupos permitidos
 # Para obtener el ID de un grupo, agrega el bot y usa /chatid
 # Deja la lista vacía [] para permitir todos los grupos
@@ -49,15 +129,490 @@ GRUPOS_PERMITIDOS = [
     -1001660210142,  # BoardGames "La Sagra"
 ]
 
-# Cliente de OpenAI
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+# Cliente de OpenAI: se crea al primer uso con cliente_openai() (None sin API key,
+# para poder usar herramientas.py sin ella)
+openai_client = None
+_openai_lock = threading.Lock()
+
+def cliente_openai():
+    """Importa openai y crea el cliente la primera vez que se necesita"""
+    global openai_client
+    if openai_client is None and OPENAI_API_KEY:
+        with _openai_lock:
+            if openai_client is None:
+                from openai import OpenAI
+                # Sin reintentos propios: los plazos y reintentos los pone llamar_openai()
+                openai_client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    return openai_client
 
 # Base de datos
-DB_NAME = 'telegram_messages.db'
+DB_NAME = os.environ.get('DB_PATH', 'telegram_messages.db')
+
+# 🗂️ Modo de almacenamiento:
+# - 'unico': todos los grupos en DB_NAME (por defecto)
+# - 'por_chat': un fichero SQLite por chat en DB_SHARDS_DIR; DB_NAME queda
+#   como base global (caché BGG, historial de preguntas, configuración)
+DB_MODO = os.environ.get('DB_MODO', 'unico')
+DB_SHARDS_DIR = os.environ.get('DB_SHARDS_DIR', 'chats')
+
+# Versión del esquema (PRAGMA user_version). Súbela al cambiar el DDL de
+# inicializar_db() o crear_tabla_mensajes() para que se vuelva a aplicar.
+ESQUEMA_VERSION = 6
+
+# ============================
+# MÉTRICAS (formato Prometheus)
+# ============================
+
+# Buckets en segundos: desde inserts de SQLite (ms) hasta llamadas a OpenAI (decenas de s)
+BUCKETS_LATENCIA = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRICAS = []
+
+def _formatear_etiquetas(nombres: tuple, valores: tuple, extra: str = '') -> str:
+    """Genera el bloque {a="x",b="y"} de una serie"""
+    partes = []
+    for nombre, valor in zip(nombres, valores):
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{nombre}="{valor}"')
+    if extra:
+        partes.append(extra)
+    return '{' + ','.join(partes) + '}' if partes else ''
+
+class Contador:
+    """Contador monótono con etiquetas"""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.series = {}
+        METRICAS.append(self)
+
+    def inc(self, *valores, cantidad: float = 1):
+        self.series[valores] = self.series.get(valores, 0) + cantidad
+
+    def valor(self, *valores) -> float:
+        return self.series.get(valores, 0)
+
+    def exponer(self) -> list:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        for valores, total in list(self.series.items()):
+            lineas.append(f"{self.nombre}{_formatear_etiquetas(self.etiquetas, valores)} {total}")
+        return lineas
+
+class Indicador:
+    """Gauge cuyo valor se calcula al exponer (callback) o se fija a mano"""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = (), funcion=None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.funcion = funcion  # Devuelve {valores_etiquetas: valor}
+        self.series = {}
+        METRICAS.append(self)
+
+    def fijar(self, valor: float, *valores):
+        self.series[valores] = valor
+
+    def exponer(self) -> list:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} gauge"]
+        series = dict(self.series)
+        if self.funcion:
+            try:
+                series.update(self.funcion())
+            except Exception as e:
+                log.warning("⚠️ Error calculando métrica %s: %s", self.nombre, e)
+        for valores, valor in series.items():
+            lineas.append(f"{self.nombre}{_formatear_etiquetas(self.etiquetas, valores)} {valor}")
+        return lineas
+
+class Histograma:
+    """
+    Histograma con buckets fijos.
+    observar() solo hace un bisect y dos sumas: es seguro usarlo en la ruta de ingesta.
+    Los buckets se guardan sin acumular y se acumulan al exponer.
+    """
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple = (), buckets: tuple = BUCKETS_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = tuple(buckets)
+        self.series = {}  # valores_etiquetas -> [conteos_por_bucket..., +Inf, suma]
+        METRICAS.append(self)
+
+    def observar(self, valor: float, *valores):
+        serie = self.series.get(valores)
+        if serie is None:
+            serie = self.series[valores] = [0] * (len(self.buckets) + 2)
+        serie[bisect_left(self.buckets, valor)] += 1
+        serie[-1] += valor
+
+    def medir(self, *valores) -> 'Cronometro':
+        return Cronometro(self, valores)
+
+    def exponer(self) -> list:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for valores, serie in list(self.series.items()):
+            serie = list(serie)
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + ('+Inf',), serie[:-1]):
+                acumulado += conteo
+                etiquetas = _formatear_etiquetas(self.etiquetas, valores, f'le="{limite}"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            etiquetas = _formatear_etiquetas(self.etiquetas, valores)
+            lineas.append(f"{self.nombre}_sum{etiquetas} {serie[-1]}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {acumulado}")
+        return lineas
+
+class Cronometro:
+    """Context manager que observa la duración del bloque en un histograma"""
+    __slots__ = ('histograma', 'valores', 'inicio')
+
+    def __init__(self, histograma: Histograma, valores: tuple):
+        self.histograma = histograma
+        self.valores = valores
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histograma.observar(time.perf_counter() - self.inicio, *self.valores)
+        return False
+
+def exponer_metricas() -> str:
+    """Renderiza todas las métricas registradas en formato de texto Prometheus"""
+    lineas = []
+    for metrica in METRICAS:
+        lineas.extend(metrica.exponer())
+    return '\n'.join(lineas) + '\n'
+
+def _ratio_aciertos_cache() -> dict:
+    """Calcula el ratio de aciertos de cada caché a partir de los contadores"""
+    ratios = {}
+    caches = {valores[0] for valores in CACHE_CONSULTAS.series}
+    for cache in caches:
+        aciertos = CACHE_CONSULTAS.valor(cache, 'acierto')
+        total = aciertos + CACHE_CONSULTAS.valor(cache, 'fallo')
+        if total:
+            ratios[(cache,)] = round(aciertos / total, 4)
+    return ratios
+
+COMANDO_DURACION = Histograma(
+    'bot_comando_duracion_segundos',
+    'Latencia de cada handler del bot (incluye la ingesta de mensajes)',
+    ('comando',)
+)
+COMANDO_ERRORES = Contador(
+    'bot_comando_errores_total',
+    'Excepciones no capturadas por handler',
+    ('comando',)
+)
+DB_DURACION = Histograma(
+    'bot_db_consulta_duracion_segundos',
+    'Duración de las consultas a SQLite',
+    ('consulta',)
+)
+OPENAI_DURACION = Histograma(
+    'bot_openai_duracion_segundos',
+    'Latencia de las llamadas a OpenAI',
+    ('operacion',)
+)
+OPENAI_LLAMADAS = Contador(
+    'bot_openai_llamadas_total',
+    'Llamadas a OpenAI por resultado',
+    ('operacion', 'estado')
+)
+BGG_DURACION = Histograma(
+    'bot_bgg_duracion_segundos',
+    'Latencia de las peticiones HTTP a BoardGameGeek',
+    ('endpoint',)
+)
+BGG_PETICIONES = Contador(
+    'bot_bgg_peticiones_total',
+    'Peticiones a BoardGameGeek por código de estado',
+    ('endpoint', 'estado')
+)
+CACHE_CONSULTAS = Contador(
+    'bot_cache_consultas_total',
+    'Consultas a cachés por resultado (acierto/fallo)',
+    ('cache', 'resultado')
+)
+CACHE_RATIO = Indicador(
+    'bot_cache_ratio_aciertos',
+    'Ratio de aciertos de cada caché',
+    ('cache',),
+    funcion=_ratio_aciertos_cache
+)
+COLA_INGESTA = Indicador(
+    'bot_cola_ingesta_updates',
+    'Updates recibidos de Telegram pendientes de procesar'
+)
+
+BUCLE_BLOQUEOS = Contador(
+    'bot_bucle_bloqueos_total',
+    'Veces que el event loop estuvo bloqueado más que BLOQUEO_UMBRAL_MS'
+)
+
+# ============================
+# LOGS (estructurados, sin bloquear el event loop)
+# ============================
+
+# Los handlers solo meten el registro en una cola; un hilo aparte lo formatea y
+# lo escribe. Si la cola se llena se descartan registros (y se cuentan) antes
+# que frenar el event loop.
+LOG_NIVEL = os.environ.get('LOG_NIVEL', 'INFO').upper()
+# Nivel por logger, para subir o bajar el volumen de una parte: 'bot.bgg=DEBUG,httpx=WARNING'
+LOG_NIVELES = os.environ.get('LOG_NIVELES', 'httpx=WARNING')
+# 'texto' (legible) o 'json' (un objeto por línea, para agregadores de logs)
+LOG_FORMATO = os.environ.get('LOG_FORMATO', 'texto')
+LOG_COLA = int(os.environ.get('LOG_COLA', '10000'))
+LOG_PLANTILLA = '%(asctime)s %(levelname)s [%(id_peticion)s] %(name)s: %(message)s'
+
+log = logging.getLogger('bot')  # Comandos y tareas de fondo
+log_db = logging.getLogger('bot.db')
+log_openai = logging.getLogger('bot.openai')
+log_bgg = logging.getLogger('bot.bgg')
+log_telegram = logging.getLogger('bot.telegram')
+
+# Identificador de la petición en curso: el update que la originó ('resumen:8812')
+# o la tarea de fondo. Pasa a los hilos con el contexto y a los procesos de trabajo
+# con en_trabajador(), así todo lo que se registra de un comando lleva el mismo.
+ID_PETICION = contextvars.ContextVar('id_peticion', default='-')
+
+LOGS_DESCARTADOS = Contador(
+    'bot_logs_descartados_total',
+    'Registros de log descartados por tener la cola llena',
+    ('nivel',)
+)
+
+# Atributos propios de LogRecord: el resto son campos `extra` del registro
+_CAMPOS_REGISTRO = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'id_peticion'}
+
+def _anotar_peticion(registro: logging.LogRecord) -> bool:
+    registro.id_peticion = ID_PETICION.get()
+    return True
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro, con los campos `extra` al mismo nivel"""
+    
+    def format(self, registro: logging.LogRecord) -> str:
+        datos = {
+            'ts': datetime.fromtimestamp(registro.created).isoformat(timespec='milliseconds'),
+            'nivel': registro.levelname,
+            'logger': registro.name,
+            'id': getattr(registro, 'id_peticion', '-'),
+            'msg': registro.getMessage(),
+        }
+        datos.update((k, v) for k, v in vars(registro).items() if k not in _CAMPOS_REGISTRO)
+        if registro.exc_info and not registro.exc_text:
+            registro.exc_text = self.formatException(registro.exc_info)
+        if registro.exc_text:
+            datos['traza'] = registro.exc_text
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+class ColaLogs(logging.handlers.QueueHandler):
+    """QueueHandler que nunca espera: con la cola llena descarta el registro"""
+    
+    def prepare(self, registro: logging.LogRecord) -> logging.LogRecord:
+        # Aquí solo lo que no puede esperar (los args y la excepción pueden cambiar);
+        # el formato completo lo aplica el hilo escritor
+        preparado = copy.copy(registro)
+        preparado.msg = registro.getMessage()
+        preparado.args = None
+        if registro.exc_info:
+            preparado.exc_text = registro.exc_text or self.formatter.formatException(registro.exc_info)
+            preparado.exc_info = None
+        return preparado
+    
+    def enqueue(self, registro: logging.LogRecord):
+        try:
+            self.queue.put_nowait(registro)
+        except queue.Full:
+            LOGS_DESCARTADOS.inc(registro.levelname)
+
+_ESCRITOR_LOGS = None
+_logs_configurados = False
+
+def configurar_logs(en_segundo_plano: bool = True):
+    """
+    Configura el logging del proceso (una sola vez). En segundo plano, para
+    el bot; directo a stdout para herramientas.py y los procesos de trabajo,
+    que no tienen event loop que proteger.
+    """
+    global _ESCRITOR_LOGS, _logs_configurados
+    if _logs_configurados:
+        return
+    _logs_configurados = True
+    
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(FormatoJSON() if LOG_FORMATO == 'json' else logging.Formatter(LOG_PLANTILLA))
+    if en_segundo_plano:
+        manejador = ColaLogs(queue.Queue(LOG_COLA))
+        manejador.setFormatter(logging.Formatter())
+        _ESCRITOR_LOGS = logging.handlers.QueueListener(manejador.queue, salida)
+        _ESCRITOR_LOGS.start()
+        atexit.register(detener_logs)
+    else:
+        manejador = salida
+    manejador.addFilter(_anotar_peticion)
+    
+    raiz = logging.getLogger()
+    raiz.handlers[:] = [manejador]
+    raiz.setLevel(LOG_NIVEL)
+    for parte in LOG_NIVELES.split(','):
+        if '=' in parte:
+            nombre, nivel = parte.split('=', 1)
+            logging.getLogger(nombre.strip()).setLevel(nivel.strip().upper())
+
+def detener_logs():
+    """Escribe lo que quede en la cola y para el hilo escritor"""
+    global _ESCRITOR_LOGS
+    if _ESCRITOR_LOGS is not None:
+        _ESCRITOR_LOGS.stop()
+        _ESCRITOR_LOGS = None
+
+# ============================
+# PERFILADO (opt-in)
+# ============================
+
+# Fracción de llamadas a handlers que se perfilan con cProfile (0 = desactivado)
+PERFILADO_FRACCION = float(os.environ.get('PERFILADO_FRACCION', '0'))
+PERFILADO_DIR = os.environ.get('PERFILADO_DIR', 'perfiles')
+# Cada cuántos segundos se vuelcan a disco los perfiles acumulados
+PERFILADO_INTERVALO_S = int(os.environ.get('PERFILADO_INTERVALO_S', '60'))
+# Bloqueos del event loop más largos que esto se registran con su stack (0 = desactivado)
+BLOQUEO_UMBRAL_MS = int(os.environ.get('BLOQUEO_UMBRAL_MS', '0'))
+
+class Perfilador:
+    """
+    Perfila con cProfile una fracción de las llamadas a handlers y acumula
+    los resultados por handler en pstats, que se vuelcan a PERFILADO_DIR/<handler>.prof
+    para analizarlos offline (snakeviz, pstats...).
+
+    Solo hay un perfil activo a la vez: mientras un handler está perfilado
+    el perfil también incluye lo que el event loop ejecute durante sus awaits.
+    """
+
+    def __init__(self, fraccion: float, directorio: str, intervalo_s: int):
+        self.fraccion = fraccion
+        self.directorio = directorio
+        self.intervalo_s = intervalo_s
+        self.estadisticas = {}  # handler -> pstats.Stats acumulado
+        self.muestras = {}  # handler -> nº de llamadas perfiladas
+        self.en_curso = False
+        self.ultimo_volcado = time.monotonic()
+
+    def debe_perfilar(self) -> bool:
+        return self.fraccion > 0 and not self.en_curso and random.random() < self.fraccion
+
+    async def ejecutar(self, nombre: str, handler, update, context):
+        perfil = cProfile.Profile()
+        self.en_curso = True
+        perfil.enable()
+        try:
+            return await handler(update, context)
+        finally:
+            perfil.disable()
+            self.en_curso = False
+            self._acumular(nombre, perfil)
+
+    def _acumular(self, nombre: str, perfil: cProfile.Profile):
+        if nombre in self.estadisticas:
+            self.estadisticas[nombre].add(perfil)
+        else:
+            self.estadisticas[nombre] = pstats.Stats(perfil)
+        self.muestras[nombre] = self.muestras.get(nombre, 0) + 1
+
+        if time.monotonic() - self.ultimo_volcado >= self.intervalo_s:
+            self.volcar()
+
+    def volcar(self) -> list:
+        """Escribe los perfiles acumulados a disco y devuelve las rutas escritas"""
+        self.ultimo_volcado = time.monotonic()
+        if not self.estadisticas:
+            return []
+
+        rutas = []
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            for nombre, estadisticas in self.estadisticas.items():
+                ruta = os.path.join(self.directorio, f"{nombre}.prof")
+                estadisticas.dump_stats(ruta)
+                rutas.append(ruta)
+            log.info("🔬 Perfiles volcados: %s", ', '.join(rutas))
+        except Exception as e:
+            log.warning("⚠️ Error volcando perfiles: %s", e)
+        return rutas
+
+PERFILADOR = Perfilador(PERFILADO_FRACCION, PERFILADO_DIR, PERFILADO_INTERVALO_S)
+
+class VigilanteBucle:
+    """
+    Detecta bloqueos del event loop.
+    Una tarea del loop actualiza un latido; un hilo aparte comprueba que el latido
+    avanza y, si lleva más de `umbral_s` parado, imprime el stack del hilo del loop
+    (es decir, el del handler que lo está bloqueando).
+    """
+
+    def __init__(self, umbral_s: float):
+        self.umbral_s = umbral_s
+        self.latido = time.monotonic()
+        self.hilo_bucle = None
+
+    async def latir(self):
+        self.hilo_bucle = threading.get_ident()
+        Thread(target=self._vigilar, daemon=True, name='vigilante-bucle').start()
+        while True:
+            self.latido = time.monotonic()
+            await asyncio.sleep(self.umbral_s / 4)
+
+    def _vigilar(self):
+        latido_reportado = None
+        while True:
+            time.sleep(self.umbral_s / 4)
+            latido = self.latido
+            retraso = time.monotonic() - latido
+            if retraso <= self.umbral_s or latido == latido_reportado:
+                continue
+
+            latido_reportado = latido
+            BUCLE_BLOQUEOS.inc()
+            frame = sys._current_frames().get(self.hilo_bucle)
+            stack = ''.join(traceback.format_stack(frame)) if frame else '(stack no disponible)'
+            log.warning("🐢 Event loop bloqueado %.0f ms. Stack del handler:\n%s", retraso * 1000, stack)
+
+def instrumentar(nombre: str, handler):
+    """Envuelve un handler para medir su latencia, contar sus errores y perfilarlo si toca"""
+    @wraps(handler)
+    async def envoltorio(update, context):
+        inicio = time.perf_counter()
+        testigo = ID_PETICION.set(f"{nombre}:{update.update_id}" if isinstance(update, Update) else nombre)
+        try:
+            if PERFILADOR.debe_perfilar():
+                return await PERFILADOR.ejecutar(nombre, handler, update, context)
+            return await handler(update, context)
+        except Exception:
+            COMANDO_ERRORES.inc(nombre)
+            raise
+        finally:
+            COMANDO_DURACION.observar(time.perf_counter() - inicio, nombre)
+            ID_PETICION.reset(testigo)
+    return envoltorio
 
 # Servidor web para Render (mantiene el bot activo)
 class HealthHandler(BaseHTTPRequestHandler):
     def do_GET(self):
+        if self.path.split('?')[0] == '/metrics':
+            cuerpo = exponer_metricas().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+            return
+        
         self.send_response(200)
         self.send_header('Content-type', 'text/html')
         self.end_headers()
@@ -70,15 +625,11 @@ def run_health_server():
     """Servidor HTTP para que Render mantenga el bot activo"""
     port = int(os.environ.get('PORT', 10000))
     server = HTTPServer(('0.0.0.0', port), HealthHandler)
-    print(f"🌐 Servidor web iniciado en puerto {port}")
+    log.info("🌐 Servidor web iniciado en puerto %s", port)
     server.serve_forever()
 
-def inicializar_db():
-    """Crea la base de datos y tablas necesarias"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    # Tabla de mensajes
+def crear_tabla_mensajes(cursor: sqlite3.Cursor):
+    """Tabla de mensajes e índices (en la base única o en cada shard por chat)"""
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS mensajes (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -89,15 +640,56 @@ def inicializar_db():
             first_name TEXT,
             texto TEXT,
             timestamp DATETIME,
+            respuesta_a INTEGER,
+            thread_id INTEGER,
             UNIQUE(chat_id, message_id)
         )
     ''')
     
+    # Columnas añadidas después de crear la tabla (bases de versiones anteriores)
+    columnas = {fila[1] for fila in cursor.execute('PRAGMA table_info(mensajes)')}
+    if 'respuesta_a' not in columnas:
+        # message_id del mensaje al que responde (NULL si no es una respuesta)
+        cursor.execute('ALTER TABLE mensajes ADD COLUMN respuesta_a INTEGER')
+    if 'thread_id' not in columnas:
+        # Tema del foro (message_thread_id); NULL fuera de foros y en el tema General
+        cursor.execute('ALTER TABLE mensajes ADD COLUMN thread_id INTEGER')
+    
     cursor.execute('''
         CREATE INDEX IF NOT EXISTS idx_chat_timestamp 
         ON mensajes(chat_id, timestamp)
     ''')
     
+    # /stats agrupa por usuario dentro del chat (GROUP BY sin ordenar en temporal)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chat_usuario
+        ON mensajes(chat_id, user_id)
+    ''')
+    
+    # /resumen dentro de un tema de foro
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_chat_tema_timestamp
+        ON mensajes(chat_id, thread_id, timestamp)
+    ''')
+
+def inicializar_db():
+    """Crea la base de datos y tablas necesarias"""
+    conn = sqlite3.connect(DB_NAME)
+    # WAL: las lecturas (y las copias de seguridad en caliente) no bloquean la ingesta.
+    # Se fija en cada arranque: una base restaurada o copiada a mano puede venir sin él
+    conn.execute('PRAGMA journal_mode=WAL')
+    
+    # ⚡ Esquema ya al día (PRAGMA user_version): arranque sin DDL
+    if conn.execute('PRAGMA user_version').fetchone()[0] == ESQUEMA_VERSION:
+        conn.close()
+        log_db.info("✅ Base de datos lista (esquema v%s, modo %s)", ESQUEMA_VERSION, DB_MODO)
+        return
+    
+    cursor = conn.cursor()
+    
+    # Tabla de mensajes (en modo 'por_chat' solo guarda lo pendiente de migrar)
+    crear_tabla_mensajes(cursor)
+    
     # Tabla de preguntas automáticas
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS preguntas_historial (
@@ -109,6 +701,57 @@ def inicializar_db():
         )
     ''')
     
+    # cargar_cooldowns() lee solo las preguntas recientes al arrancar
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_preguntas_timestamp
+        ON preguntas_historial(timestamp, chat_id, pregunta_id)
+    ''')
+    
+    # Próxima ejecución de cada tarea diaria: preguntas y resúmenes (sobrevive a reinicios)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS preguntas_programacion (
+            clave TEXT PRIMARY KEY,
+            proxima TEXT
+        )
+    ''')
+    
+    # Resúmenes diarios precalculados (se sirven a /resumen de la misma ventana)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS resumenes_diarios (
+            chat_id INTEGER,
+            desde TEXT,
+            hasta TEXT,
+            mensajes INTEGER,
+            texto TEXT,
+            PRIMARY KEY (chat_id, hasta)
+        )
+    ''')
+    
+    # Nombres de los temas de foro (se conocen por el mensaje que creó cada tema)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS temas (
+            chat_id INTEGER,
+            thread_id INTEGER,
+            nombre TEXT,
+            PRIMARY KEY (chat_id, thread_id)
+        )
+    ''')
+    
+    # Tokens gastados en OpenAI por chat, día, comando y modelo (una fila acumulada por clave)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS uso_tokens (
+            chat_id INTEGER NOT NULL,
+            dia TEXT NOT NULL,
+            comando TEXT NOT NULL,
+            modelo TEXT NOT NULL,
+            llamadas INTEGER,
+            tokens_entrada INTEGER,
+            tokens_salida INTEGER,
+            segundos REAL,
+            PRIMARY KEY (chat_id, dia, comando, modelo)
+        ) WITHOUT ROWID
+    ''')
+    
     # Tabla de caché de juegos BGG
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS bgg_cache (
@@ -129,9 +772,416 @@ def inicializar_db():
         )
     ''')
     
+    # Caché BGG actual (con descripción y mecánicas)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bgg_cache_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            game_name TEXT,
+            bgg_id INTEGER,
+            image_url TEXT,
+            min_players INTEGER,
+            max_players INTEGER,
+            best_players TEXT,
+            playtime INTEGER,
+            weight REAL,
+            year_published INTEGER,
+            rank INTEGER,
+            bgg_link TEXT,
+            description TEXT,
+            mechanics TEXT,
+            timestamp DATETIME,
+            UNIQUE(game_name)
+        )
+    ''')
+    
+    # Búsqueda sin distinguir mayúsculas (buscar_juego_bgg usa COLLATE NOCASE)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bgg_v2_nombre
+        ON bgg_cache_v2(game_name COLLATE NOCASE)
+    ''')
+    
+    cursor.execute(f'PRAGMA user_version = {ESQUEMA_VERSION}')
     conn.commit()
     conn.close()
-    print("✅ Base de datos inicializada")
+    log_db.info("✅ Base de datos inicializada (modo %s)", DB_MODO)
+
+# ============================
+# CONEXIONES Y SHARDS POR CHAT
+# ============================
+
+_SHARDS_INICIALIZADOS = set()
+
+def conectar_global() -> sqlite3.Connection:
+    """Conexión a la base global (caché BGG, preguntas, configuración)"""
+    return sqlite3.connect(DB_NAME)
+
+def ruta_shard(chat_id: int) -> str:
+    """Fichero SQLite de un chat en modo 'por_chat'"""
+    return os.path.join(DB_SHARDS_DIR, f"chat_{chat_id}.db")
+
+def _conectar_shard(chat_id: int) -> sqlite3.Connection:
+    """Abre el shard de un chat, creando fichero y esquema la primera vez"""
+    if chat_id not in _SHARDS_INICIALIZADOS:
+        os.makedirs(DB_SHARDS_DIR, exist_ok=True)
+    conn = sqlite3.connect(ruta_shard(chat_id), timeout=30)
+    if chat_id not in _SHARDS_INICIALIZADOS:
+        if conn.execute('PRAGMA user_version').fetchone()[0] != ESQUEMA_VERSION:
+            # WAL: las lecturas de /resumen no bloquean la ingesta del mismo chat
+            conn.execute('PRAGMA journal_mode=WAL')
+            crear_tabla_mensajes(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {ESQUEMA_VERSION}')
+            conn.commit()
+        _SHARDS_INICIALIZADOS.add(chat_id)
+    return conn
+
+def conectar_chat(chat_id: int) -> sqlite3.Connection:
+    """Conexión donde viven los mensajes de `chat_id` según DB_MODO"""
+    if DB_MODO == 'por_chat':
+        return _conectar_shard(chat_id)
+    return sqlite3.connect(DB_NAME)
+
+def borrar_shard(chat_id: int):
+    """Purga a nivel de fichero: elimina el shard del chat (y su WAL)"""
+    _SHARDS_INICIALIZADOS.discard(chat_id)
+    for sufijo in ('', '-wal', '-shm'):
+        ruta = ruta_shard(chat_id) + sufijo
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+def borrar_de_base_global(chat_id: int, desde: datetime = None, hasta: datetime = None) -> int:
+    """
+    En modo 'por_chat', borra los mensajes del chat que sigan en la base global
+    (los de antes de migrar, si se migró sin purgar): si no, las copias de
+    seguridad los conservan y un nuevo migrar-shards los devolvería al shard.
+    Sin fechas borra todos. Devuelve cuántos borró.
+
+    Se llama siempre, aunque el shard no tenga nada en el rango: los restos de
+    la global no dependen de lo que haya en el shard. Solo escribe (y toma el
+    lock de la base global) si de verdad hay algo que borrar.
+    """
+    if DB_MODO != 'por_chat':
+        return 0
+    conn = conectar_global()
+    try:
+        if desde is None:
+            if not conn.execute('SELECT EXISTS(SELECT 1 FROM mensajes WHERE chat_id = ?)',
+                                (chat_id,)).fetchone()[0]:
+                return 0
+            cursor = conn.execute('DELETE FROM mensajes WHERE chat_id = ?', (chat_id,))
+        else:
+            if not conn.execute('''
+                SELECT EXISTS(SELECT 1 FROM mensajes 
+                              WHERE chat_id = ? 
+                              AND timestamp >= ? 
+                              AND timestamp <= ?)
+            ''', (chat_id, desde, hasta)).fetchone()[0]:
+                return 0
+            cursor = conn.execute('''
+                DELETE FROM mensajes 
+                WHERE chat_id = ? 
+                AND timestamp >= ? 
+                AND timestamp <= ?
+            ''', (chat_id, desde, hasta))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+def migrar_a_shards(lote: int = 5000, purgar: bool = False, pausa_s: float = 0.05) -> dict:
+    """
+    Reparte los mensajes de la base única en un fichero por chat.
+
+    Es online y reanudable: copia por lotes en orden de id, guarda el último id
+    copiado en la tabla migracion_shards y cede el lock de escritura entre lotes,
+    así que el bot puede seguir ingiriendo mientras tanto. Se puede relanzar tras
+    cambiar a DB_MODO=por_chat para copiar lo que llegó entre medias
+    (UNIQUE(chat_id, message_id) evita duplicados).
+    Con `purgar` borra de la base única las filas ya copiadas.
+    """
+    origen = sqlite3.connect(DB_NAME, timeout=30)
+    origen.execute('''
+        CREATE TABLE IF NOT EXISTS migracion_shards (
+            clave TEXT PRIMARY KEY,
+            ultimo_id INTEGER
+        )
+    ''')
+    fila = origen.execute(
+        "SELECT ultimo_id FROM migracion_shards WHERE clave = 'mensajes'"
+    ).fetchone()
+    ultimo_id = fila[0] if fila else 0
+    
+    copiadas = 0
+    por_chat = {}
+    while True:
+        filas = origen.execute('''
+            SELECT id, chat_id, message_id, user_id, username, first_name, texto, timestamp, respuesta_a, thread_id
+            FROM mensajes
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (ultimo_id, lote)).fetchall()
+        if not filas:
+            break
+        
+        grupos = {}
+        for fila in filas:
+            grupos.setdefault(fila[1], []).append(fila[1:])
+        
+        for chat_id, filas_chat in grupos.items():
+            destino = _conectar_shard(chat_id)
+            destino.executemany('''
+                INSERT OR IGNORE INTO mensajes
+                (chat_id, message_id, user_id, username, first_name, texto, timestamp, respuesta_a, thread_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', filas_chat)
+            destino.commit()
+            destino.close()
+            por_chat[chat_id] = por_chat.get(chat_id, 0) + len(filas_chat)
+        
+        ultimo_id = filas[-1][0]
+        origen.execute(
+            "INSERT OR REPLACE INTO migracion_shards (clave, ultimo_id) VALUES ('mensajes', ?)",
+            (ultimo_id,)
+        )
+        if purgar:
+            origen.execute('DELETE FROM mensajes WHERE id <= ?', (ultimo_id,))
+        origen.commit()
+        
+        copiadas += len(filas)
+        log_db.info("🗂️ Migrados %s mensajes (último id %s)", f"{copiadas:,}", ultimo_id)
+        time.sleep(pausa_s)  # Cede el lock de escritura a la ingesta
+    
+    origen.close()
+    return {'copiadas': copiadas, 'ultimo_id': ultimo_id, 'por_chat': por_chat}
+
+# ============================
+# COPIAS DE SEGURIDAD
+# ============================
+
+# Copia en caliente de la base (y de los shards en modo 'por_chat') cada
+# BACKUP_INTERVALO_H horas en BACKUP_DIR/<AAAAMMDD-HHMMSS>/ (0 = desactivado, por
+# defecto: cada copia es completa y ocupa en disco lo mismo que las bases)
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'copias')
+BACKUP_INTERVALO_H = float(os.environ.get('BACKUP_INTERVALO_H', '0'))
+BACKUP_CONSERVAR = max(1, int(os.environ.get('BACKUP_CONSERVAR', '4')))  # Al menos la última
+# Páginas copiadas por paso y pausa entre pasos: la copia cede disco y CPU a la ingesta
+BACKUP_PAGINAS = int(os.environ.get('BACKUP_PAGINAS', '256'))
+BACKUP_PAUSA_S = float(os.environ.get('BACKUP_PAUSA_S', '0.005'))
+FORMATO_COPIA = '%Y%m%d-%H%M%S'
+
+COPIAS_SEGURIDAD = Contador(
+    'bot_copias_seguridad_total',
+    'Copias de seguridad por resultado (ok/fallida)',
+    ('resultado',)
+)
+COPIA_DURACION = Histograma(
+    'bot_copia_seguridad_duracion_segundos',
+    'Duración de cada copia de seguridad completa (todas las bases)',
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800)
+)
+COPIAS_BYTES = Indicador(
+    'bot_copias_seguridad_bytes',
+    'Espacio en disco que ocupan las copias de seguridad conservadas'
+)
+
+def copiar_base(ruta_origen: str, ruta_destino: str, paginas: int = None, pausa_s: float = None) -> dict:
+    """
+    Copia una base SQLite en uso con la API de backup, `paginas` páginas por
+    paso y una pausa entre pasos.
+
+    Todo se copia dentro de una transacción de lectura abierta en el origen:
+    en WAL es una foto fija que no bloquea a los escritores, y la API de backup
+    no vuelve a empezar cada vez que otra conexión escribe (sin ella, con
+    ingesta continua la copia podría no terminar nunca). Se escribe en un
+    .parcial y se renombra al acabar; la copia queda en un solo fichero (sin WAL).
+    """
+    paginas = paginas or BACKUP_PAGINAS
+    pausa_s = BACKUP_PAUSA_S if pausa_s is None else pausa_s
+    parcial = ruta_destino + '.parcial'
+    if os.path.exists(parcial):
+        os.remove(parcial)
+    
+    inicio = time.perf_counter()
+    total = 0
+    
+    def progreso(estado, restantes, paginas_totales):
+        nonlocal total
+        total = paginas_totales
+        if restantes:
+            time.sleep(pausa_s)
+    
+    origen = sqlite3.connect(ruta_origen, timeout=30, isolation_level=None)
+    destino = sqlite3.connect(parcial)
+    try:
+        origen.execute('BEGIN')
+        origen.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()  # Fija la foto
+        origen.backup(destino, pages=paginas, progress=progreso)
+        origen.execute('COMMIT')
+        destino.execute('PRAGMA journal_mode=DELETE')
+    except Exception:
+        destino.close()
+        os.remove(parcial)
+        raise
+    finally:
+        origen.close()
+        destino.close()
+    
+    os.replace(parcial, ruta_destino)
+    return {
+        'paginas': total,
+        'bytes': os.path.getsize(ruta_destino),
+        'duracion_s': round(time.perf_counter() - inicio, 3),
+    }
+
+def verificar_copia(ruta: str) -> dict:
+    """
+    Comprueba una copia: integrity_check completo, versión del esquema y que
+    la tabla de mensajes se pueda leer. Devuelve {'problemas': [...], 'esquema', 'mensajes'}.
+    """
+    problemas = []
+    mensajes = None
+    conn = sqlite3.connect(f'file:{ruta}?mode=ro', uri=True)
+    try:
+        resultado = [fila[0] for fila in conn.execute('PRAGMA integrity_check')]
+        if resultado != ['ok']:
+            problemas.extend(resultado)
+        esquema = conn.execute('PRAGMA user_version').fetchone()[0]
+        tablas = {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if 'mensajes' in tablas:
+            mensajes = conn.execute('SELECT COUNT(*) FROM mensajes').fetchone()[0]
+        else:
+            problemas.append('no hay tabla mensajes')
+    except sqlite3.DatabaseError as e:
+        problemas.append(str(e))
+        esquema = None
+    finally:
+        conn.close()
+    return {'problemas': problemas, 'esquema': esquema, 'mensajes': mensajes}
+
+def listar_copias() -> list:
+    """Copias completas de BACKUP_DIR, de la más antigua a la más reciente"""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    copias = []
+    for nombre in os.listdir(BACKUP_DIR):
+        try:
+            datetime.strptime(nombre, FORMATO_COPIA)
+        except ValueError:
+            continue  # .parcial de una copia a medias u otros ficheros
+        copias.append(os.path.join(BACKUP_DIR, nombre))
+    return sorted(copias)
+
+def bases_de_copia(copia: str) -> list:
+    """Pares (fichero en la copia, ruta donde se restaura)"""
+    pares = [(os.path.join(copia, os.path.basename(DB_NAME)), DB_NAME)]
+    chats = os.path.join(copia, 'chats')
+    if os.path.isdir(chats):
+        for nombre in sorted(os.listdir(chats)):
+            if nombre.endswith('.db'):
+                pares.append((os.path.join(chats, nombre), os.path.join(DB_SHARDS_DIR, nombre)))
+    return pares
+
+def bases_a_copiar() -> list:
+    """La base global y, en modo 'por_chat', todos los shards"""
+    bases = [DB_NAME]
+    if DB_MODO == 'por_chat' and os.path.isdir(DB_SHARDS_DIR):
+        bases += [os.path.join(DB_SHARDS_DIR, n) for n in sorted(os.listdir(DB_SHARDS_DIR)) if n.endswith('.db')]
+    return bases
+
+def hacer_copia_seguridad() -> str:
+    """
+    Copia (y verifica) la base global y, en modo 'por_chat', todos los shards.
+    Las copias incompletas no cuentan: se trabaja en <momento>.parcial y se
+    renombra al terminar. Después se borran las copias que sobran. Devuelve la ruta.
+    """
+    inicio = time.perf_counter()
+    copia = os.path.join(BACKUP_DIR, datetime.now().strftime(FORMATO_COPIA))
+    parcial = copia + '.parcial'
+    os.makedirs(os.path.join(parcial, 'chats'), exist_ok=True)
+    
+    bases = bases_a_copiar()
+    try:
+        total_bytes = 0
+        for ruta in bases:
+            destino = os.path.join(parcial, 'chats' if ruta != DB_NAME else '', os.path.basename(ruta))
+            total_bytes += copiar_base(ruta, destino)['bytes']
+            problemas = verificar_copia(destino)['problemas']
+            if problemas:
+                raise RuntimeError(f"copia de {ruta} no válida: {'; '.join(problemas[:3])}")
+        os.replace(parcial, copia)
+    except Exception:
+        COPIAS_SEGURIDAD.inc('fallida')
+        shutil.rmtree(parcial, ignore_errors=True)
+        raise
+    
+    duracion = time.perf_counter() - inicio
+    COPIAS_SEGURIDAD.inc('ok')
+    COPIA_DURACION.observar(duracion)
+    log_db.info("💾 Copia de seguridad en %s: %d base(s), %.1f MB en %.1fs",
+                copia, len(bases), total_bytes / 1e6, duracion)
+    
+    # Rotación: quedan las BACKUP_CONSERVAR más recientes, nunca menos de esta
+    # (y ningún .parcial huérfano)
+    for antigua in listar_copias()[:-max(1, BACKUP_CONSERVAR)]:
+        shutil.rmtree(antigua, ignore_errors=True)
+    for nombre in os.listdir(BACKUP_DIR):
+        if nombre.endswith('.parcial'):
+            shutil.rmtree(os.path.join(BACKUP_DIR, nombre), ignore_errors=True)
+    
+    conservadas = listar_copias()
+    ocupado = sum(
+        os.path.getsize(os.path.join(carpeta, nombre))
+        for copia_conservada in conservadas
+        for carpeta, _, nombres in os.walk(copia_conservada)
+        for nombre in nombres
+    )
+    COPIAS_BYTES.fijar(ocupado)
+    log_db.info("💾 %d copia(s) conservadas en %s: %.1f MB en disco", len(conservadas), BACKUP_DIR, ocupado / 1e6)
+    return copia
+
+def restaurar_copia(copia: str) -> list:
+    """
+    Restaura una copia sobre DB_NAME (y los shards que contenga) con el bot parado.
+    Verifica todas las bases antes de tocar nada y guarda la base actual como
+    <DB_NAME>.antes-de-restaurar. Devuelve las rutas restauradas.
+    """
+    pares = [(origen, destino) for origen, destino in bases_de_copia(copia) if os.path.exists(origen)]
+    if not pares or pares[0][1] != DB_NAME:
+        raise FileNotFoundError(f"{copia} no contiene {os.path.basename(DB_NAME)}")
+    for origen, _ in pares:
+        problemas = verificar_copia(origen)['problemas']
+        if problemas:
+            raise RuntimeError(f"{origen} no es válida: {'; '.join(problemas[:3])}")
+    
+    if os.path.exists(DB_NAME):
+        copiar_base(DB_NAME, DB_NAME + '.antes-de-restaurar', paginas=-1, pausa_s=0)
+    
+    for origen, destino in pares:
+        os.makedirs(os.path.dirname(destino) or '.', exist_ok=True)
+        # Con la API de backup (no copiando el fichero) para respetar el WAL del destino
+        fuente = sqlite3.connect(f'file:{origen}?mode=ro', uri=True)
+        conn = sqlite3.connect(destino)
+        fuente.backup(conn)
+        conn.close()
+        fuente.close()
+    return [destino for _, destino in pares]
+
+async def bucle_copias():
+    """Copia cada BACKUP_INTERVALO_H horas en un hilo; tras un reinicio retoma el ritmo de la última"""
+    intervalo = timedelta(hours=BACKUP_INTERVALO_H)
+    while True:
+        copias = listar_copias()
+        espera = 60  # Deja arrancar al bot antes de la primera
+        if copias:
+            ultima = datetime.strptime(os.path.basename(copias[-1]), FORMATO_COPIA)
+            espera = max(espera, (ultima + intervalo - datetime.now()).total_seconds())
+        await asyncio.sleep(espera)
+        ID_PETICION.set(f"copia:{datetime.now():%Y%m%d-%H%M%S}")
+        try:
+            await asyncio.to_thread(hacer_copia_seguridad)
+        except Exception as e:
+            log_db.exception("❌ Copia de seguridad fallida: %s", e)
+            await asyncio.sleep(intervalo.total_seconds() / 4)
 
 # ============================
 # ERROR HANDLER
@@ -140,20 +1190,39 @@ def inicializar_db():
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Maneja errores globales del bot"""
     error_message = str(context.error)
+    if isinstance(update, Update):
+        # PTB llama a este handler en otra tarea: se recupera el id que llevaba el handler
+        comando = ProcesadorPorChat.clasificar(update)[1]
+        ID_PETICION.set(f"{comando or 'mensaje'}:{update.update_id}")
     
     # Ignorar errores comunes cuando el bot se despierta
     if "Message to be replied not found" in error_message:
-        print("⚠️ Mensaje antiguo no encontrado (bot despertó de inactividad)")
+        log_telegram.info("⚠️ Mensaje antiguo no encontrado (bot despertó de inactividad)")
         return
     
     if "Message is not modified" in error_message:
-        print("⚠️ Mensaje no modificado (mismo contenido)")
+        log_telegram.info("⚠️ Mensaje no modificado (mismo contenido)")
         return
     
-    # Log otros errores para debugging
-    print(f"❌ Error capturado: {error_message}")
-    if update:
-        print(f"📍 Update: {update}")
+    # Con la traza y lo justo del update (no el objeto entero) para encontrarlo
+    log_telegram.error("❌ Error capturado: %s", error_message,
+                       exc_info=context.error, extra=describir_update(update))
+
+def describir_update(update: object) -> dict:
+    """Campos con los que identificar un update en los logs"""
+    if not isinstance(update, Update):
+        return {}
+    datos = {'update_id': update.update_id}
+    if update.effective_chat:
+        datos['chat_id'] = update.effective_chat.id
+    if update.effective_user:
+        datos['user_id'] = update.effective_user.id
+    mensaje = update.effective_message
+    if mensaje:
+        datos['message_id'] = mensaje.message_id
+        if mensaje.text and mensaje.text.startswith('/'):
+            datos['comando'] = mensaje.text.split()[0]
+    return datos
 
 # ============================
 # CONTROL DE ACCESO
@@ -184,6 +1253,215 @@ async def chatid(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(mensaje, parse_mode='HTML')
 
+# ============================
+# CONTROL DE ADMISIÓN
+# ============================
+
+# Cuotas de comandos caros (/resumen, /resumen_desde, /datos): ráfaga y ritmo por hora
+CUOTA_USUARIO_RAFAGA = int(os.environ.get('CUOTA_USUARIO_RAFAGA', '3'))
+CUOTA_USUARIO_POR_HORA = float(os.environ.get('CUOTA_USUARIO_POR_HORA', '20'))
+CUOTA_CHAT_RAFAGA = int(os.environ.get('CUOTA_CHAT_RAFAGA', '6'))
+CUOTA_CHAT_POR_HORA = float(os.environ.get('CUOTA_CHAT_POR_HORA', '60'))
+
+# Comandos caros ejecutándose a la vez y esperando turno (en total, entre todos los chats)
+ADMISION_CONCURRENTES = int(os.environ.get('ADMISION_CONCURRENTES', '4'))
+ADMISION_COLA = int(os.environ.get('ADMISION_COLA', '16'))
+
+# Familia de cuota de cada comando (resumen y resumen_desde comparten cubo)
+COMANDOS_CON_ADMISION = {'resumen': 'resumen', 'resumen_desde': 'resumen', 'datos': 'datos'}
+
+ADMISION_DECISIONES = Contador(
+    'bot_admision_total',
+    'Decisiones del control de admisión por comando',
+    ('comando', 'resultado')
+)
+ADMISION_EN_ESPERA = Indicador(
+    'bot_admision_en_espera',
+    'Comandos caros esperando turno en la cola global'
+)
+
+class CuboTokens:
+    """Token bucket: `capacidad` peticiones seguidas y luego `por_hora` repartidas en la hora"""
+    
+    __slots__ = ('capacidad', 'recarga', 'tokens', 'ultimo')
+    
+    def __init__(self, capacidad: int, por_hora: float):
+        self.capacidad = capacidad
+        self.recarga = por_hora / 3600  # tokens por segundo
+        self.tokens = float(capacidad)
+        self.ultimo = time.monotonic()
+    
+    def espera(self, ahora: float) -> float:
+        """Segundos hasta que haya un token (0 si ya lo hay). No consume."""
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.recarga)
+        self.ultimo = ahora
+        if self.tokens >= 1:
+            return 0.0
+        if self.recarga <= 0:
+            return float('inf')
+        return (1 - self.tokens) / self.recarga
+    
+    def consumir(self):
+        self.tokens -= 1
+    
+    def lleno(self, ahora: float) -> bool:
+        return self.tokens + (ahora - self.ultimo) * self.recarga >= self.capacidad
+
+class Turno:
+    """
+    Hueco en la cola global; se ocupa con `async with` justo alrededor del trabajo caro.
+    Desde que se admite hasta que empieza tiene reservado su sitio en la cola
+    (ControlAdmision.reservados): si el handler acaba sin entrar, liberar().
+    """
+    
+    def __init__(self, control, update: Update, familia: str):
+        self.control = control
+        self.update = update
+        self.familia = familia
+        self.reservado = True
+    
+    def liberar(self):
+        """Devuelve el sitio reservado en la cola (no hace nada si ya empezó o ya se liberó)"""
+        if self.reservado:
+            self.reservado = False
+            self.control.reservados -= 1
+    
+    async def __aenter__(self):
+        control = self.control
+        if control.en_curso >= control.max_concurrentes or control.en_espera:
+            delante = control.en_espera
+            control.en_espera += 1
+            ADMISION_DECISIONES.inc(self.familia, 'encolado')
+            try:
+                await self.update.message.reply_text(
+                    f"⏳ Hay {delante + control.en_curso} petición(es) por delante. "
+                    "Tu comando empezará en cuanto haya hueco.",
+                    message_thread_id=hilo_respuesta(self.update)
+                )
+                await control.semaforo().acquire()
+            finally:
+                control.en_espera -= 1
+        else:
+            await control.semaforo().acquire()
+        self.liberar()
+        control.en_curso += 1
+        self.inicio = time.monotonic()
+        return self
+    
+    async def __aexit__(self, *exc):
+        control = self.control
+        control.en_curso -= 1
+        control.registrar_duracion(time.monotonic() - self.inicio)
+        control.semaforo().release()
+        return False
+
+class ControlAdmision:
+    """
+    Decide si un comando caro entra, espera turno o se rechaza.
+    
+    - Cubos de tokens por usuario y por chat (por familia de comando): un usuario
+      insistente agota su cuota sin gastar la del resto del grupo.
+    - Cola global acotada: como mucho `max_concurrentes` trabajos caros a la vez y
+      `max_cola` esperando. Con la cola llena se rechaza en lugar de acumular
+      latencia, así los comandos admitidos tardan lo mismo haya o no abuso.
+      El sitio se reserva al admitir (no al empezar a esperar): entre medias el
+      handler aún contesta "Analizando...", y esa respuesta puede tardar.
+    - Los rechazos se contestan al momento, y solo una vez mientras dure la espera
+      (los reintentos dentro de ese plazo se ignoran en silencio).
+    """
+    
+    MAX_CUBOS = 10_000  # Al superarlo se descartan los cubos llenos (equivalen a uno nuevo)
+    
+    def __init__(self, max_concurrentes: int, max_cola: int):
+        self.max_concurrentes = max_concurrentes
+        self.max_cola = max_cola
+        self.en_curso = 0
+        self.en_espera = 0
+        self.reservados = 0  # Admitidos que aún no han empezado (incluye los en_espera)
+        self.duracion_media = 10.0  # Segundos, media móvil de los trabajos terminados
+        self.cubos = {}  # (familia, 'usuario'|'chat', id) -> CuboTokens
+        self.avisado_hasta = {}  # (familia, user_id) -> instante hasta el que no se repite el aviso
+        self._semaforo = None
+    
+    def semaforo(self) -> asyncio.Semaphore:
+        # Se crea al primer uso para quedar ligado al event loop de la aplicación
+        if self._semaforo is None:
+            self._semaforo = asyncio.Semaphore(self.max_concurrentes)
+        return self._semaforo
+    
+    def registrar_duracion(self, segundos: float):
+        self.duracion_media = 0.8 * self.duracion_media + 0.2 * segundos
+    
+    def _cubo(self, familia: str, ambito: str, ident: int, capacidad: int, por_hora: float) -> CuboTokens:
+        clave = (familia, ambito, ident)
+        cubo = self.cubos.get(clave)
+        if cubo is None:
+            if len(self.cubos) >= self.MAX_CUBOS:
+                ahora = time.monotonic()
+                self.cubos = {k: c for k, c in self.cubos.items() if not c.lleno(ahora)}
+                self.avisado_hasta = {k: t for k, t in self.avisado_hasta.items() if t > ahora}
+            cubo = self.cubos[clave] = CuboTokens(capacidad, por_hora)
+        return cubo
+    
+    def evaluar(self, familia: str, chat_id: int, user_id: int) -> tuple:
+        """
+        Devuelve (motivo, segundos): motivo None si se admite (consume cuota y
+        reserva sitio en la cola), o 'usuario' / 'chat' / 'cola' con la espera recomendada.
+        """
+        ahora = time.monotonic()
+        cubo_usuario = self._cubo(familia, 'usuario', user_id, CUOTA_USUARIO_RAFAGA, CUOTA_USUARIO_POR_HORA)
+        cubo_chat = self._cubo(familia, 'chat', chat_id, CUOTA_CHAT_RAFAGA, CUOTA_CHAT_POR_HORA)
+        
+        espera = cubo_usuario.espera(ahora)
+        if espera:
+            return 'usuario', espera
+        espera = cubo_chat.espera(ahora)
+        if espera:
+            return 'chat', espera
+        pendientes = self.reservados + self.en_curso
+        if pendientes >= self.max_concurrentes + self.max_cola:
+            # Lo que tardarían en vaciarse la cola y los trabajos en curso
+            return 'cola', self.duracion_media * pendientes / max(1, self.max_concurrentes)
+        
+        cubo_usuario.consumir()
+        cubo_chat.consumir()
+        self.reservados += 1
+        return None, 0.0
+    
+    async def solicitar(self, update: Update, comando: str):
+        """
+        Devuelve un Turno si el comando se admite, o None si se ha rechazado
+        (en ese caso ya se ha contestado al usuario, o se ha ignorado un reintento).
+        """
+        familia = COMANDOS_CON_ADMISION.get(comando, comando)
+        user_id = update.effective_user.id if update.effective_user else 0
+        motivo, espera = self.evaluar(familia, update.effective_chat.id, user_id)
+        
+        if motivo is None:
+            ADMISION_DECISIONES.inc(familia, 'admitido')
+            return Turno(self, update, familia)
+        
+        ADMISION_DECISIONES.inc(familia, f'rechazado_{motivo}')
+        segundos = max(1, int(espera + 0.999))
+        ahora = time.monotonic()
+        if self.avisado_hasta.get((familia, user_id), 0) > ahora:
+            return None
+        self.avisado_hasta[(familia, user_id)] = ahora + min(segundos, 300)
+        
+        if motivo == 'usuario':
+            texto = f"🚦 Has usado /{comando} demasiadas veces seguidas. Inténtalo de nuevo en {segundos} s."
+        elif motivo == 'chat':
+            texto = f"🚦 Este grupo ha usado /{comando} demasiadas veces seguidas. Inténtalo de nuevo en {segundos} s."
+        else:
+            texto = f"⏳ El bot está saturado ahora mismo. Inténtalo de nuevo en {segundos} s."
+        log.info("🚦 /%s rechazado (%s) para user %s en chat %s", comando, motivo, user_id, update.effective_chat.id,
+                 extra={'chat_id': update.effective_chat.id, 'motivo': motivo})
+        await update.message.reply_text(texto, message_thread_id=hilo_respuesta(update))
+        return None
+
+ADMISION = ControlAdmision(ADMISION_CONCURRENTES, ADMISION_COLA)
+ADMISION_EN_ESPERA.funcion = lambda: {(): ADMISION.en_espera}
+
 # ============================
 # SISTEMA DE PREGUNTAS AUTOMÁTICAS
 # ============================
@@ -211,125 +1489,462 @@ PREGUNTAS_JUEGOS = [
     {"dias": None, "pregunta": "¿Party games o juegos estratégicos? 🎉🧠"},
 ]
 
-async def puede_enviar_pregunta(chat_id: int, pregunta_id: int) -> bool:
-    """Verifica si ha pasado 1 semana desde la última vez que se hizo esta pregunta"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    
-    una_semana_atras = datetime.now() - timedelta(days=7)
-    
-    cursor.execute('''
-        SELECT timestamp FROM preguntas_historial
-        WHERE chat_id = ? AND pregunta_id = ?
-        ORDER BY timestamp DESC LIMIT 1
-    ''', (chat_id, pregunta_id))
-    
-    resultado = cursor.fetchone()
+# Horas a las que se lanza la pregunta (minuto al azar); vacío = desactivado
+PREGUNTAS_HORAS = [int(h) for h in os.environ.get('PREGUNTAS_HORAS', '11,15,19').split(',') if h.strip()]
+# Si el bot estuvo caído a la hora programada, se envía al arrancar solo si no ha pasado más de esto
+PREGUNTAS_GRACIA = timedelta(minutes=int(os.environ.get('PREGUNTAS_GRACIA_MIN', '60')))
+PREGUNTAS_COOLDOWN = timedelta(days=7)
+
+def cargar_cooldowns(desde: datetime) -> dict:
+    """Preguntas hechas desde `desde` en todos los chats, con una sola consulta: {chat_id: {pregunta_id}}"""
+    conn = conectar_global()
+    with DB_DURACION.medir('cooldown_pregunta'):
+        filas = conn.execute(
+            # Sin DISTINCT: los duplicados los absorbe el set y así se usa idx_preguntas_timestamp
+            'SELECT chat_id, pregunta_id FROM preguntas_historial WHERE timestamp > ?',
+            (desde,)
+        ).fetchall()
     conn.close()
     
-    if not resultado:
-        return True  # Primera vez que se hace esta pregunta
-    
-    ultima_vez = datetime.fromisoformat(resultado[0])
-    return datetime.now() > (ultima_vez + timedelta(days=7))
+    indice = {}
+    for chat_id, pregunta_id in filas:
+        indice.setdefault(chat_id, set()).add(pregunta_id)
+    return indice
+
+def elegir_pregunta(en_cooldown, dia_semana: int):
+    """Pregunta al azar entre las de hoy que no estén en cooldown, o None"""
+    preguntas_validas = [
+        (i, p) for i, p in enumerate(PREGUNTAS_JUEGOS)
+        if (p["dias"] is None or dia_semana in p["dias"]) and i not in en_cooldown
+    ]
+    return random.choice(preguntas_validas) if preguntas_validas else None
+
+async def _enviar_pregunta(bot, chat_id: int, pregunta: str) -> bool:
+    try:
+        await bot.send_message(
+            chat_id=chat_id,
+            text=f"💬 <b>Pregunta del día</b>\n\n{pregunta}",
+            parse_mode='HTML'
+        )
+        log.info("✅ Pregunta enviada a chat %s: %s", chat_id, pregunta, extra={'chat_id': chat_id})
+        return True
+    except Exception as e:
+        log.error("❌ Error enviando pregunta a %s: %s", chat_id, e, extra={'chat_id': chat_id})
+        return False
 
 async def enviar_pregunta_automatica(application: Application):
-    """Envía una pregunta automática al grupo"""
+    """
+    Envía una pregunta a cada grupo permitido.
+    El cooldown de todos los chats sale de una consulta; la elección es en memoria
+    y los envíos van en paralelo por la cola de envíos (que respeta los límites).
+    """
     if not GRUPOS_PERMITIDOS:
         return
     
+    ahora = datetime.now()
+    cooldowns = cargar_cooldowns(ahora - PREGUNTAS_COOLDOWN)
+    dia_semana = ahora.weekday()  # 0=Lunes, 6=Domingo
+    
+    elegidas = []
     for chat_id in GRUPOS_PERMITIDOS:
-        try:
-            dia_semana = datetime.now().weekday()  # 0=Lunes, 6=Domingo
-            
-            # Filtrar preguntas disponibles para hoy
-            preguntas_disponibles = [
-                (i, p) for i, p in enumerate(PREGUNTAS_JUEGOS)
-                if p["dias"] is None or dia_semana in p["dias"]
-            ]
-            
-            # Filtrar por cooldown de 1 semana
-            preguntas_validas = []
-            for idx, pregunta in preguntas_disponibles:
-                if await puede_enviar_pregunta(chat_id, idx):
-                    preguntas_validas.append((idx, pregunta))
-            
-            if not preguntas_validas:
-                print(f"⏳ No hay preguntas disponibles para chat {chat_id}")
+        eleccion = elegir_pregunta(cooldowns.get(chat_id, ()), dia_semana)
+        if eleccion is None:
+            log.info("⏳ No hay preguntas disponibles para chat %s", chat_id)
+            continue
+        elegidas.append((chat_id, eleccion[0], eleccion[1]['pregunta']))
+    
+    resultados = await asyncio.gather(*(
+        _enviar_pregunta(application.bot, chat_id, pregunta)
+        for chat_id, _, pregunta in elegidas
+    ))
+    
+    # Registrar en historial (solo las que llegaron)
+    enviadas = [(chat_id, pregunta_id, ahora) for (chat_id, pregunta_id, _), ok in zip(elegidas, resultados) if ok]
+    if enviadas:
+        conn = conectar_global()
+        conn.executemany(
+            'INSERT OR IGNORE INTO preguntas_historial (chat_id, pregunta_id, timestamp) VALUES (?, ?, ?)',
+            enviadas
+        )
+        conn.commit()
+        conn.close()
+
+class PlanificadorDiario:
+    """
+    Lanza `tarea(application)` a las `horas` indicadas (cada día, minuto al azar):
+    las preguntas automáticas y los resúmenes diarios.
+    Es un bucle asyncio propio: no necesita JobQueue/APScheduler.
+    La próxima ejecución de cada hora se guarda en preguntas_programacion, así un
+    reinicio no cambia el minuto elegido ni repite una ejecución ya hecha; si el
+    bot estaba caído a la hora prevista, la lanza al volver dentro de `gracia`.
+    """
+    
+    def __init__(self, horas: list, gracia: timedelta, tarea=None, prefijo: str = 'pregunta'):
+        self.horas = horas
+        self.gracia = gracia
+        self.tarea = tarea or enviar_pregunta_automatica
+        self.prefijo = prefijo
+    
+    @staticmethod
+    def siguiente(hora: int, desde: datetime) -> datetime:
+        candidato = desde.replace(hour=hora, minute=random.randint(0, 59), second=0, microsecond=0)
+        if candidato <= desde:
+            candidato += timedelta(days=1)
+        return candidato
+    
+    def _guardar(self, conn, clave: str, proxima: datetime):
+        conn.execute(
+            'INSERT OR REPLACE INTO preguntas_programacion (clave, proxima) VALUES (?, ?)',
+            (clave, proxima.isoformat())
+        )
+    
+    def cargar(self) -> dict:
+        """{clave: próxima ejecución}, recuperando lo guardado y programando lo que falte"""
+        ahora = datetime.now()
+        conn = conectar_global()
+        guardadas = dict(conn.execute('SELECT clave, proxima FROM preguntas_programacion').fetchall())
+        
+        proximas = {}
+        for hora in self.horas:
+            clave = f'{self.prefijo}_{hora}'
+            proxima = datetime.fromisoformat(guardadas[clave]) if clave in guardadas else None
+            if proxima is None or proxima < ahora - self.gracia:
+                proxima = self.siguiente(hora, ahora)
+                self._guardar(conn, clave, proxima)
+            proximas[clave] = proxima
+        conn.commit()
+        conn.close()
+        return proximas
+    
+    async def ejecutar(self, application: Application):
+        proximas = self.cargar()
+        for clave, proxima in sorted(proximas.items(), key=lambda x: x[1]):
+            log.info("⏰ %s: %s", clave, f"{proxima:%Y-%m-%d %H:%M}")
+        
+        while True:
+            clave, proxima = min(proximas.items(), key=lambda x: x[1])
+            espera = (proxima - datetime.now()).total_seconds()
+            if espera > 0:
+                # Como mucho 5 min seguidos: tolera suspensiones y cambios de hora del sistema
+                await asyncio.sleep(min(espera, 300))
                 continue
             
-            # Elegir pregunta aleatoria
-            pregunta_id, pregunta_data = random.choice(preguntas_validas)
-            
-            # Enviar pregunta
-            mensaje = f"💬 <b>Pregunta del día</b>\n\n{pregunta_data['pregunta']}"
-            await application.bot.send_message(
-                chat_id=chat_id,
-                text=mensaje,
-                parse_mode='HTML'
-            )
-            
-            # Registrar en historial
-            conn = sqlite3.connect(DB_NAME)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO preguntas_historial (chat_id, pregunta_id, timestamp)
-                VALUES (?, ?, ?)
-            ''', (chat_id, pregunta_id, datetime.now()))
+            # Se reprograma antes de ejecutar: si el bot cae a mitad, no se repite al volver
+            hora = int(clave.rsplit('_', 1)[1])
+            proximas[clave] = self.siguiente(hora, max(datetime.now(), proxima))
+            conn = conectar_global()
+            self._guardar(conn, clave, proximas[clave])
             conn.commit()
             conn.close()
             
-            print(f"✅ Pregunta enviada a chat {chat_id}: {pregunta_data['pregunta']}")
-            
+            ID_PETICION.set(f"{clave}:{proxima:%Y%m%d}")
+            try:
+                await self.tarea(application)
+            except Exception as e:
+                log.exception("❌ Error en la tarea programada %s: %s", clave, e)
+
+# ============================
+# TEMAS DE FORO
+# ============================
+
+# En los supergrupos con temas cada mensaje lleva su message_thread_id (columna
+# thread_id); el tema General no lo lleva y se guarda como NULL.
+# /resumen dentro de un tema resume solo ese tema; con 'todo' resume el grupo
+# entero tema a tema.
+TODOS_LOS_TEMAS = -1
+ARGUMENTOS_TODO = {'todo', 'todos', 'grupo'}
+# Temas resumidos a la vez en un resumen de todo el grupo
+RESUMEN_TEMAS_CONCURRENTES = int(os.environ.get('RESUMEN_TEMAS_CONCURRENTES', '3'))
+# Los temas con menos mensajes se resumen sin IA (no compensa una llamada)
+RESUMEN_TEMA_MIN_MENSAJES = int(os.environ.get('RESUMEN_TEMA_MIN_MENSAJES', '5'))
+
+# (chat_id, thread_id) ya guardados en la tabla temas
+_TEMAS_CONOCIDOS = set()
+
+def tema_de(update: Update):
+    """Tema al que se limita un comando: el thread_id (None = General) o TODOS_LOS_TEMAS fuera de foros"""
+    if not update.effective_chat.is_forum:
+        return TODOS_LOS_TEMAS
+    return update.message.message_thread_id if update.message.is_topic_message else None
+
+def hilo_respuesta(update: Update):
+    """message_thread_id para que la respuesta quede en el tema del comando y no en General"""
+    return update.message.message_thread_id if update.message.is_topic_message else None
+
+def registrar_tema(chat_id: int, thread_id: int, nombre: str):
+    """Guarda el nombre de un tema (una vez por tema y proceso)"""
+    if (chat_id, thread_id) in _TEMAS_CONOCIDOS:
+        return
+    conn = conectar_global()
+    conn.execute(
+        'INSERT OR REPLACE INTO temas (chat_id, thread_id, nombre) VALUES (?, ?, ?)',
+        (chat_id, thread_id, nombre)
+    )
+    conn.commit()
+    conn.close()
+    _TEMAS_CONOCIDOS.add((chat_id, thread_id))
+
+def nombres_temas(chat_id: int) -> dict:
+    """thread_id -> nombre de los temas conocidos del chat"""
+    conn = conectar_global()
+    filas = conn.execute('SELECT thread_id, nombre FROM temas WHERE chat_id = ?', (chat_id,)).fetchall()
+    conn.close()
+    return dict(filas)
+
+def contar_temas(chat_id: int, desde: datetime) -> list:
+    """[(thread_id, mensajes)] de los temas con actividad desde `desde`, los más activos primero"""
+    conn = conectar_chat(chat_id)
+    with DB_DURACION.medir('contar_temas'):
+        # +thread_id: sin él SQLite agrupa recorriendo idx_chat_tema_timestamp entero
+        # (todo el historial del chat) en vez de solo la ventana por idx_chat_timestamp
+        filas = conn.execute('''
+            SELECT thread_id, COUNT(*) FROM mensajes
+            WHERE chat_id = ? AND timestamp >= ?
+            GROUP BY +thread_id
+        ''', (chat_id, desde)).fetchall()
+    conn.close()
+    return sorted(filas, key=lambda fila: -fila[1])
+
+async def resumen_por_temas(chat_id: int, desde: datetime, horas: float,
+                            comando: str = 'resumen') -> tuple:
+    """
+    Resumen de todo el grupo compuesto tema a tema: cada tema se resume por
+    separado y en paralelo (hasta RESUMEN_TEMAS_CONCURRENTES a la vez).
+    En grupos sin temas es un /resumen normal. Devuelve (nº mensajes, texto).
+    """
+    temas = await en_trabajador(contar_temas, chat_id, desde)
+    if len(temas) <= 1:
+        return await en_trabajador(trabajo_resumen, chat_id, desde, horas, False, comando)
+    
+    nombres = nombres_temas(chat_id)
+    semaforo = asyncio.Semaphore(RESUMEN_TEMAS_CONCURRENTES)
+    
+    async def resumir(thread_id, total):
+        async with semaforo:
+            return await en_trabajador(
+                trabajo_resumen, chat_id, desde, horas,
+                total < RESUMEN_TEMA_MIN_MENSAJES, comando, thread_id
+            )
+    
+    resultados = await asyncio.gather(*(resumir(t, n) for t, n in temas))
+    
+    secciones = []
+    respaldo = False
+    total = 0
+    for (thread_id, _), (mensajes, texto) in zip(temas, resultados):
+        if not mensajes:
+            continue
+        total += mensajes
+        respaldo = respaldo or texto.startswith('⚠️')
+        nombre = 'General' if thread_id is None else nombres.get(thread_id, f'Tema {thread_id}')
+        secciones.append(f"🧵 **{escapar_markdown(nombre)}** _({mensajes} mensajes)_\n\n{texto}")
+    
+    texto = "\n\n".join(secciones)
+    if respaldo:
+        # Se marca igual que un resumen de respaldo para que no se guarde como resumen diario
+        texto = "⚠️ _Algún tema se ha resumido sin IA._\n\n" + texto
+    return total, texto
+
+# ============================
+# RESÚMENES DIARIOS (precalculados)
+# ============================
+
+# Hora (0-23) a la que se precalcula el resumen de las últimas 24 h de cada grupo
+# de GRUPOS_PERMITIDOS, fuera de las horas de uso (vacío = desactivado, por defecto:
+# cada resumen diario es una llamada a OpenAI por grupo aunque nadie lo pida)
+RESUMEN_DIARIO_HORA = os.environ.get('RESUMEN_DIARIO_HORA', '').strip()
+RESUMEN_DIARIO_HORAS = 24
+RESUMEN_DIARIO_PUBLICAR = os.environ.get('RESUMEN_DIARIO_PUBLICAR', '0') == '1'
+# Grupos resumidos a la vez: reparte las llamadas a OpenAI en lugar de lanzarlas juntas
+RESUMEN_DIARIO_CONCURRENTES = int(os.environ.get('RESUMEN_DIARIO_CONCURRENTES', '2'))
+# Un /resumen de 24 h pedido hasta estas horas después se contesta con el precalculado.
+# Corto a propósito: más tarde, la ventana del precalculado ya no es la que se pide
+RESUMEN_DIARIO_VIGENCIA = timedelta(hours=float(os.environ.get('RESUMEN_DIARIO_VIGENCIA_H', '1')))
+RESUMEN_DIARIO_CONSERVAR_DIAS = 7
+
+RESUMENES_DIARIOS = Contador(
+    'bot_resumen_diario_total',
+    'Resúmenes diarios: generado, vacio, fallido, publicado, servido',
+    ('resultado',)
+)
+
+def buscar_resumen_diario(chat_id: int, horas: float, ahora: datetime):
+    """El resumen precalculado que sirve para un /resumen de `horas` pedido `ahora`, o None"""
+    if horas != RESUMEN_DIARIO_HORAS or not RESUMEN_DIARIO_HORA:
+        return None
+    conn = conectar_global()
+    fila = conn.execute('''
+        SELECT desde, hasta, mensajes, texto FROM resumenes_diarios
+        WHERE chat_id = ? AND hasta BETWEEN ? AND ?
+        ORDER BY hasta DESC LIMIT 1
+    ''', (chat_id, (ahora - RESUMEN_DIARIO_VIGENCIA).isoformat(), ahora.isoformat())).fetchone()
+    conn.close()
+    if fila is None:
+        return None
+    return {
+        'desde': datetime.fromisoformat(fila[0]),
+        'hasta': datetime.fromisoformat(fila[1]),
+        'mensajes': fila[2],
+        'texto': fila[3],
+    }
+
+def contar_mensajes_desde(chat_id: int, desde: datetime) -> int:
+    conn = conectar_chat(chat_id)
+    with DB_DURACION.medir('contar_desde'):
+        total = conn.execute(
+            'SELECT COUNT(*) FROM mensajes WHERE chat_id = ? AND timestamp >= ?', (chat_id, desde)
+        ).fetchone()[0]
+    conn.close()
+    return total
+
+def texto_resumen_diario(diario: dict, nuevos: int = 0) -> str:
+    texto = (
+        f"📝 **Resumen del {diario['desde']:%d/%m %H:%M} al {diario['hasta']:%d/%m %H:%M}**\n"
+        f"_({diario['mensajes']} mensajes analizados)_\n\n"
+        f"{diario['texto']}"
+    )
+    if nuevos:
+        texto += (
+            f"\n\nℹ️ Desde las {diario['hasta']:%H:%M} hay {nuevos} mensaje(s) más: "
+            f"/resumen\\_desde {diario['hasta']:%H:%M}"
+        )
+    return texto
+
+def borrar_resumenes_diarios(chat_id: int, desde: datetime = None, hasta: datetime = None):
+    """Borra los resúmenes precalculados que incluyan mensajes borrados (todos, o los que solapen el rango)"""
+    conn = conectar_global()
+    if desde is None:
+        conn.execute('DELETE FROM resumenes_diarios WHERE chat_id = ?', (chat_id,))
+    else:
+        conn.execute(
+            'DELETE FROM resumenes_diarios WHERE chat_id = ? AND desde <= ? AND hasta >= ?',
+            (chat_id, hasta.isoformat(), desde.isoformat())
+        )
+    conn.commit()
+    conn.close()
+
+async def _resumen_diario_chat(application: Application, chat_id: int, semaforo: asyncio.Semaphore):
+    ID_PETICION.set(f"resumen_diario:{chat_id}")  # Cada chat va en su propia tarea (gather)
+    async with semaforo:
+        hasta = datetime.now()
+        desde = hasta - timedelta(hours=RESUMEN_DIARIO_HORAS)
+        try:
+            total, texto = await resumen_por_temas(chat_id, desde, RESUMEN_DIARIO_HORAS, 'resumen_diario')
+        except Exception as e:
+            RESUMENES_DIARIOS.inc('fallido')
+            log.exception("❌ Resumen diario de %s: %s", chat_id, e, extra={'chat_id': chat_id})
+            return
+    
+    if not total:
+        RESUMENES_DIARIOS.inc('vacio')
+        return
+    if texto.startswith('⚠️'):
+        # Resumen rápido de respaldo (OpenAI no respondió o no queda presupuesto): no se guarda
+        RESUMENES_DIARIOS.inc('fallido')
+        return
+    
+    conn = conectar_global()
+    conn.execute(
+        'INSERT OR REPLACE INTO resumenes_diarios (chat_id, desde, hasta, mensajes, texto) VALUES (?, ?, ?, ?, ?)',
+        (chat_id, desde.isoformat(), hasta.isoformat(), total, texto)
+    )
+    conn.commit()
+    conn.close()
+    RESUMENES_DIARIOS.inc('generado')
+    
+    if RESUMEN_DIARIO_PUBLICAR:
+        diario = {'desde': desde, 'hasta': hasta, 'mensajes': total, 'texto': texto}
+        try:
+            try:
+                await application.bot.send_message(chat_id, texto_resumen_diario(diario), parse_mode='Markdown')
+            except BadRequest:
+                # Markdown mal formado en el texto de OpenAI: se manda sin formato
+                await application.bot.send_message(chat_id, texto_resumen_diario(diario))
+            RESUMENES_DIARIOS.inc('publicado')
         except Exception as e:
-            print(f"❌ Error enviando pregunta a {chat_id}: {e}")
+            log.error("❌ No se pudo publicar el resumen diario en %s: %s", chat_id, e, extra={'chat_id': chat_id})
 
-async def guardar_mensaje_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Guarda todos los mensajes del grupo en la base de datos"""
+async def generar_resumenes_diarios(application: Application):
+    """Precalcula (y publica si RESUMEN_DIARIO_PUBLICAR) el resumen de 24 h de cada grupo"""
+    inicio = time.monotonic()
+    semaforo = asyncio.Semaphore(RESUMEN_DIARIO_CONCURRENTES)
+    await asyncio.gather(*(
+        _resumen_diario_chat(application, chat_id, semaforo) for chat_id in GRUPOS_PERMITIDOS
+    ))
+    
+    conn = conectar_global()
+    conn.execute(
+        'DELETE FROM resumenes_diarios WHERE hasta < ?',
+        ((datetime.now() - timedelta(days=RESUMEN_DIARIO_CONSERVAR_DIAS)).isoformat(),)
+    )
+    conn.commit()
+    conn.close()
+    log.info("📅 Resúmenes diarios de %d grupo(s) en %.0fs", len(GRUPOS_PERMITIDOS), time.monotonic() - inicio)
+
+def fila_mensaje(update: Update, fecha: datetime):
+    """Fila de la tabla mensajes para un update, o None si el mensaje no se guarda"""
     
     # Solo guardar mensajes de grupos
-    if update.effective_chat.type not in ['group', 'supergroup']:
-        return
+    if update.effective_chat is None or update.effective_chat.type not in ['group', 'supergroup']:
+        return None
     
     # 🔐 Verificar acceso del grupo
     if not verificar_acceso(update.effective_chat.id):
-        return
+        return None
     
     # Ignorar mensajes sin texto
     if not update.message or not update.message.text:
-        return
+        return None
     
     # Ignorar comandos del bot
     if update.message.text.startswith('/'):
-        return
+        return None
+    
+    user = update.effective_user
+    username = user.username or 'sin_usuario'
+    first_name = user.first_name or 'Usuario'
+    respuesta = update.message.reply_to_message
+    tema = update.message.message_thread_id if update.message.is_topic_message else None
+    if respuesta and respuesta.forum_topic_created:
+        # En los foros, todo mensaje de un tema "responde" al que creó el tema
+        registrar_tema(update.effective_chat.id, tema, respuesta.forum_topic_created.name)
+        respuesta = None
     
+    return (
+        update.effective_chat.id,
+        update.message.message_id,
+        user.id,
+        username,
+        first_name,
+        update.message.text,
+        fecha,
+        respuesta.message_id if respuesta else None,
+        tema
+    )
+
+async def guardar_mensaje_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Guarda todos los mensajes del grupo en la base de datos"""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
-        user = update.effective_user
-        username = user.username or 'sin_usuario'
-        first_name = user.first_name or 'Usuario'
-        
-        cursor.execute('''
-            INSERT OR IGNORE INTO mensajes 
-            (chat_id, message_id, user_id, username, first_name, texto, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            update.effective_chat.id,
-            update.message.message_id,
-            user.id,
-            username,
-            first_name,
-            update.message.text,
-            datetime.now()
-        ))
+        fila = fila_mensaje(update, datetime.now())
+        if fila is None:
+            return
         
-        conn.commit()
+        conn = conectar_chat(update.effective_chat.id)
+        with DB_DURACION.medir('insertar_mensaje'):
+            conn.execute('''
+                INSERT OR IGNORE INTO mensajes 
+                (chat_id, message_id, user_id, username, first_name, texto, timestamp, respuesta_a, thread_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', fila)
+            conn.commit()
         conn.close()
         
+        # 🔮 Los juegos mencionados se buscan en segundo plano (aquí solo se apunta el texto)
+        if BGG_PRECARGA:
+            PRECARGA_BGG.observar(update.effective_chat.id, update.message.text)
+        
     except Exception as e:
-        print(f"Error guardando mensaje: {e}")
+        log_db.error("Error guardando mensaje: %s", e, extra={'chat_id': update.effective_chat.id})
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /start - Bienvenida al bot"""
@@ -354,6 +1969,8 @@ Estoy guardando todos los mensajes de este grupo para poder hacer resúmenes.
 
 <b>Comandos disponibles:</b>
 /resumen [horas] - Resume las últimas N horas (por defecto: 24h)
+/resumen rapido [horas] - Resumen al instante, sin IA
+/resumen todo [horas] - En foros: todo el grupo, tema a tema
 /resumen_desde HH:MM - Resume desde una hora específica
 /stats - Muestra estadísticas de mensajes guardados
 /help - Muestra esta ayuda
@@ -361,6 +1978,7 @@ Estoy guardando todos los mensajes de este grupo para poder hacer resúmenes.
 <b>Ejemplos:</b>
 • /resumen - Resume últimas 24 horas
 • /resumen 3 - Resume últimas 3 horas
+• /resumen rapido 48 - Temas, mensajes clave y participantes de 48 horas
 • /resumen_desde 14:30 - Resume desde las 14:30"""
     
     if is_admin:
@@ -369,6 +1987,8 @@ Estoy guardando todos los mensajes de este grupo para poder hacer resúmenes.
 <b>Comandos de Admin:</b>
 🔐 /borrar_todo - Borra TODOS los mensajes guardados
 🔐 /borrar_rango YYYY-MM-DD YYYY-MM-DD - Borra mensajes entre dos fechas
+🔐 /perfilado [on [fracción] | off | volcar] - Perfilado de handlers
+🔐 /uso [días] - Tokens y coste de IA del grupo
 
 <b>Ejemplos:</b>
 • /borrar_todo - Borra todo
@@ -385,17 +2005,94 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await start(update, context)
 
+# ============================
+# ADMINISTRADORES (caché por chat)
+# ============================
+
+# Segundos que vale la lista de admins de un chat si no llega ningún update que la cambie
+ADMINS_TTL_S = float(os.environ.get('ADMINS_TTL_S', '3600'))
+
+ESTADOS_ADMIN = ('creator', 'administrator')
+
+class RosterAdmins:
+    """
+    Lista de administradores de cada chat en memoria.
+    
+    Se carga de una vez con get_chat_administrators (una llamada por chat y TTL,
+    en lugar de un get_chat_member por comando), se mantiene al día con los
+    updates chat_member (ascensos, degradaciones, salidas) y se descarta cuando
+    cambian los permisos del propio bot (my_chat_member) o vence el TTL.
+    """
+    
+    def __init__(self, ttl_s: float):
+        self.ttl_s = ttl_s
+        self._chats = {}  # chat_id -> (expira, set de user_id)
+        self._cargas = {}  # chat_id -> Task en curso (cargas simultáneas se comparten)
+    
+    async def es_admin(self, bot, chat_id: int, user_id: int) -> bool:
+        entrada = self._chats.get(chat_id)
+        if entrada and entrada[0] > time.monotonic():
+            CACHE_CONSULTAS.inc('admins', 'acierto')
+            return user_id in entrada[1]
+        
+        CACHE_CONSULTAS.inc('admins', 'fallo')
+        carga = self._cargas.get(chat_id)
+        if carga is None:
+            carga = self._cargas[chat_id] = asyncio.ensure_future(self._cargar(bot, chat_id))
+        try:
+            admins = await asyncio.shield(carga)
+        except Exception as e:
+            # Sin lista (chat privado, bot sin permisos...): consulta individual como antes
+            log_telegram.warning("⚠️ No se pudo cargar la lista de admins de %s: %s", chat_id, e)
+            member = await bot.get_chat_member(chat_id, user_id)
+            return member.status in ESTADOS_ADMIN
+        return user_id in admins
+    
+    async def _cargar(self, bot, chat_id: int) -> set:
+        try:
+            administradores = await bot.get_chat_administrators(chat_id)
+            admins = {miembro.user.id for miembro in administradores}
+            self._chats[chat_id] = (time.monotonic() + self.ttl_s, admins)
+            return admins
+        finally:
+            del self._cargas[chat_id]
+    
+    def actualizar(self, chat_id: int, user_id: int, estado: str):
+        """Aplica un cambio de miembro a la lista ya cargada (si no hay lista, nada)"""
+        entrada = self._chats.get(chat_id)
+        if entrada is None:
+            return
+        if estado in ESTADOS_ADMIN:
+            entrada[1].add(user_id)
+        else:
+            entrada[1].discard(user_id)
+    
+    def invalidar(self, chat_id: int):
+        self._chats.pop(chat_id, None)
+
+ADMINS = RosterAdmins(ADMINS_TTL_S)
+
 async def es_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """Verifica si el usuario es administrador del grupo"""
     try:
         user_id = update.effective_user.id
         chat_id = update.effective_chat.id
-        member = await context.bot.get_chat_member(chat_id, user_id)
-        return member.status in ['creator', 'administrator']
+        return await ADMINS.es_admin(context.bot, chat_id, user_id)
     except Exception as e:
-        print(f"Error verificando admin: {e}")
+        log_telegram.warning("Error verificando admin: %s", e)
         return False
 
+async def cambio_miembro_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Mantiene la caché de admins con los updates chat_member / my_chat_member"""
+    if update.my_chat_member:
+        # Han cambiado los permisos del bot (o lo han sacado): se recargará al usarla
+        ADMINS.invalidar(update.my_chat_member.chat.id)
+        return
+    
+    cambio = update.chat_member
+    if cambio:
+        ADMINS.actualizar(cambio.chat.id, cambio.new_chat_member.user.id, cambio.new_chat_member.status)
+
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Muestra estadísticas de mensajes guardados"""
     
@@ -414,37 +2111,39 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
         chat_id = update.effective_chat.id
+        conn = conectar_chat(chat_id)
+        cursor = conn.cursor()
         
         # Total de mensajes
-        cursor.execute(
-            'SELECT COUNT(*) FROM mensajes WHERE chat_id = ?',
-            (chat_id,)
-        )
-        total = cursor.fetchone()[0]
+        with DB_DURACION.medir('stats_total'):
+            cursor.execute(
+                'SELECT COUNT(*) FROM mensajes WHERE chat_id = ?',
+                (chat_id,)
+            )
+            total = cursor.fetchone()[0]
         
         # Mensaje más antiguo
-        cursor.execute(
-            'SELECT timestamp FROM mensajes WHERE chat_id = ? ORDER BY timestamp ASC LIMIT 1',
-            (chat_id,)
-        )
-        result = cursor.fetchone()
+        with DB_DURACION.medir('stats_primer_mensaje'):
+            cursor.execute(
+                'SELECT timestamp FROM mensajes WHERE chat_id = ? ORDER BY timestamp ASC LIMIT 1',
+                (chat_id,)
+            )
+            result = cursor.fetchone()
         primer_mensaje = result[0] if result else None
         
         # Usuarios más activos
-        cursor.execute('''
-            SELECT first_name, username, COUNT(*) as count 
-            FROM mensajes 
-            WHERE chat_id = ? 
-            GROUP BY user_id 
-            ORDER BY count DESC 
-            LIMIT 5
-        ''', (chat_id,))
-        
-        top_users = cursor.fetchall()
+        with DB_DURACION.medir('stats_top_usuarios'):
+            cursor.execute('''
+                SELECT first_name, username, COUNT(*) as count 
+                FROM mensajes 
+                WHERE chat_id = ? 
+                GROUP BY user_id 
+                ORDER BY count DESC 
+                LIMIT 5
+            ''', (chat_id,))
+            
+            top_users = cursor.fetchall()
         
         conn.close()
         
@@ -509,33 +2208,44 @@ async def borrar_todo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
         chat_id = update.effective_chat.id
+        conn = conectar_chat(chat_id)
+        cursor = conn.cursor()
         
         # Contar mensajes antes de borrar
         cursor.execute(
             'SELECT COUNT(*) FROM mensajes WHERE chat_id = ?',
             (chat_id,)
         )
-        total = cursor.fetchone()[0]
-        
-        if total == 0:
-            await update.message.reply_text(
-                "ℹ️ No hay mensajes guardados para borrar."
-            )
-            conn.close()
-            return
-        
-        # Borrar todos los mensajes del grupo
-        cursor.execute(
-            'DELETE FROM mensajes WHERE chat_id = ?',
-            (chat_id,)
-        )
+        total = cursor.fetchone()[0]
         
-        conn.commit()
-        conn.close()
+        # Borrar todos los mensajes del grupo
+        with DB_DURACION.medir('borrar_todo'):
+            if DB_MODO == 'por_chat':
+                # 🗂️ Un fichero por chat: la purga es borrar el fichero (y los restos en la global)
+                conn.close()
+                total += borrar_de_base_global(chat_id)
+                if total == 0:
+                    await update.message.reply_text(
+                        "ℹ️ No hay mensajes guardados para borrar."
+                    )
+                    return
+                borrar_shard(chat_id)
+            else:
+                if total == 0:
+                    await update.message.reply_text(
+                        "ℹ️ No hay mensajes guardados para borrar."
+                    )
+                    conn.close()
+                    return
+                cursor.execute(
+                    'DELETE FROM mensajes WHERE chat_id = ?',
+                    (chat_id,)
+                )
+                
+                conn.commit()
+                conn.close()
+            borrar_resumenes_diarios(chat_id)
         
         await update.message.reply_text(
             f"🗑️ **Mensajes borrados exitosamente**\n\n"
@@ -599,10 +2309,9 @@ async def borrar_rango(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        
         chat_id = update.effective_chat.id
+        conn = conectar_chat(chat_id)
+        cursor = conn.cursor()
         
         # Contar mensajes en ese rango
         cursor.execute('''
@@ -614,6 +2323,10 @@ async def borrar_rango(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         total = cursor.fetchone()[0]
         
+        # 🗂️ En modo 'por_chat' también los restos del chat en la base global: se mira
+        # siempre, aunque el shard no tenga nada en el rango (solo escribe si hay restos)
+        total += borrar_de_base_global(chat_id, fecha_desde, fecha_hasta)
+        
         if total == 0:
             await update.message.reply_text(
                 f"ℹ️ No hay mensajes entre {fecha_desde_str} y {fecha_hasta_str}."
@@ -622,14 +2335,16 @@ async def borrar_rango(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         # Borrar mensajes en el rango
-        cursor.execute('''
-            DELETE FROM mensajes 
-            WHERE chat_id = ? 
-            AND timestamp >= ? 
-            AND timestamp <= ?
-        ''', (chat_id, fecha_desde, fecha_hasta))
-        
-        conn.commit()
+        with DB_DURACION.medir('borrar_rango'):
+            cursor.execute('''
+                DELETE FROM mensajes 
+                WHERE chat_id = ? 
+                AND timestamp >= ? 
+                AND timestamp <= ?
+            ''', (chat_id, fecha_desde, fecha_hasta))
+            
+            conn.commit()
+            borrar_resumenes_diarios(chat_id, fecha_desde, fecha_hasta)
         conn.close()
         
         await update.message.reply_text(
@@ -648,14 +2363,221 @@ async def borrar_rango(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
+async def perfilado(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Activa/desactiva el perfilado de handlers en caliente (solo admin)"""
+    
+    if update.effective_chat.type not in ['group', 'supergroup']:
+        await update.message.reply_text(
+            "❌ Este comando solo funciona en grupos."
+        )
+        return
+    
+    # 🔐 Verificar acceso del grupo
+    if not verificar_acceso(update.effective_chat.id):
+        await update.message.reply_text(
+            "⛔ Este grupo no tiene acceso autorizado a este bot.",
+            parse_mode='HTML'
+        )
+        return
+    
+    if not await es_admin(update, context):
+        await update.message.reply_text(
+            "🚫 Solo los administradores pueden cambiar el perfilado."
+        )
+        return
+    
+    accion = context.args[0].lower() if context.args else 'estado'
+    
+    try:
+        if accion == 'on':
+            fraccion = float(context.args[1]) if len(context.args) > 1 else 0.1
+            if not 0 < fraccion <= 1:
+                raise ValueError("Fracción fuera de rango")
+            PERFILADOR.fraccion = fraccion
+            respuesta = f"🔬 Perfilado activado ({fraccion:.0%} de las llamadas)"
+        elif accion == 'off':
+            PERFILADOR.fraccion = 0
+            PERFILADOR.volcar()
+            respuesta = "🔬 Perfilado desactivado. Perfiles volcados a disco."
+        elif accion == 'volcar':
+            rutas = PERFILADOR.volcar()
+            respuesta = f"💾 {len(rutas)} perfil(es) escritos en <code>{PERFILADOR.directorio}</code>"
+        else:
+            muestras = "\n".join(
+                f"• {nombre}: {n}" for nombre, n in sorted(PERFILADOR.muestras.items())
+            ) or "• (ninguna)"
+            respuesta = (
+                f"🔬 <b>Perfilado:</b> {'activo' if PERFILADOR.fraccion else 'inactivo'} "
+                f"({PERFILADOR.fraccion:.0%})\n\n<b>Llamadas perfiladas:</b>\n{muestras}"
+            )
+    except ValueError:
+        respuesta = (
+            "⚠️ Uso: /perfilado [on [fracción] | off | volcar]\n"
+            "Ejemplo: /perfilado on 0.05"
+        )
+    
+    await update.message.reply_text(respuesta, parse_mode='HTML')
+
+async def uso(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Tokens y coste de OpenAI del grupo por comando, y estado del presupuesto (solo admin)"""
+    
+    if update.effective_chat.type not in ['group', 'supergroup']:
+        await update.message.reply_text(
+            "❌ Este comando solo funciona en grupos."
+        )
+        return
+    
+    # 🔐 Verificar acceso del grupo
+    if not verificar_acceso(update.effective_chat.id):
+        await update.message.reply_text(
+            "⛔ Este grupo no tiene acceso autorizado a este bot.",
+            parse_mode='HTML'
+        )
+        return
+    
+    if not await es_admin(update, context):
+        await update.message.reply_text(
+            "🚫 Solo los administradores pueden ver el uso de IA."
+        )
+        return
+    
+    chat_id = update.effective_chat.id
+    dias = 7
+    if context.args and context.args[0].isdigit():
+        dias = max(1, min(90, int(context.args[0])))
+    
+    por_comando = informe_uso(chat_id, dias)
+    hoy = tokens_hoy(chat_id)
+    presupuesto = presupuesto_chat(chat_id)
+    
+    respuesta = f"💸 <b>Uso de IA en los últimos {dias} día(s)</b>\n\n"
+    if por_comando:
+        for comando, fila in sorted(por_comando.items(), key=lambda x: -(x[1]['entrada'] + x[1]['salida'])):
+            respuesta += (
+                f"• <b>{comando}</b>: {fila['llamadas']} llamada(s), "
+                f"{fila['entrada']:,} + {fila['salida']:,} tokens, "
+                f"{fila['segundos'] / fila['llamadas']:.1f}s de media, ${fila['coste']:.4f}\n"
+            )
+        total = sum(fila['coste'] for fila in por_comando.values())
+        respuesta += f"\n<b>Coste total:</b> ${total:.4f}\n"
+    else:
+        respuesta += "• (sin llamadas)\n"
+    
+    if presupuesto > 0:
+        estados = {'normal': '🟢 normal', 'ahorro': '🟡 modo ahorro', 'agotado': '🔴 agotado (resumen rápido)'}
+        respuesta += (
+            f"\n<b>Hoy:</b> {hoy:,} de {presupuesto:,} tokens ({hoy / presupuesto:.0%}) — "
+            f"{estados[modo_presupuesto(chat_id)]}"
+        )
+    else:
+        respuesta += f"\n<b>Hoy:</b> {hoy:,} tokens (sin presupuesto diario)"
+    
+    await update.message.reply_text(respuesta, parse_mode='HTML')
+
+# ============================
+# ARRANQUE RÁPIDO
+# ============================
+
+# Con 1, tras arrancar se importan en un hilo aparte las dependencias pesadas
+# (openai, requests, xml.etree) para que el primer /resumen o /datos no las pague.
+# Con 0 se cargan solo al primer uso.
+PRECARGA_DIFERIDA = os.environ.get('PRECARGA_DIFERIDA', '1') == '1'
+
+def precargar_dependencias():
+    """Importa lo que el arranque deja para después y crea el cliente de OpenAI"""
+    inicio = time.perf_counter()
+    import requests  # noqa: F401
+    import xml.etree.ElementTree  # noqa: F401
+    cliente_openai()
+    log.info("📦 Dependencias precargadas en %.2fs", time.perf_counter() - inicio)
+
+_lanzador = None  # Tarea que espera a start() para crear las de fondo
+
+async def mientras_corra(application: Application, tarea):
+    """
+    Ejecuta una tarea de fondo (un bucle sin fin) hasta que la aplicación se
+    detiene: stop() espera a las tareas de application.create_task(), así que
+    sin esto no terminaría nunca.
+    """
+    interna = asyncio.create_task(tarea())
+    try:
+        while not interna.done() and application.running:
+            await asyncio.wait({interna}, timeout=0.5)
+    finally:
+        interna.cancel()
+    if not interna.cancelled():
+        return interna.result()  # Si falló, la excepción llega al error_handler
+
+async def lanzar_al_arrancar(application: Application, tareas: list):
+    """
+    Crea las tareas de fondo cuando la aplicación ya está en marcha: post_init
+    va antes de start(), y PTB no espera en stop() (y avisa) las tareas creadas
+    con application.create_task() antes de eso.
+    """
+    while not application.running:
+        await asyncio.sleep(0.05)
+    for tarea in tareas:
+        application.create_task(mientras_corra(application, tarea), name=getattr(tarea, '__qualname__', None))
+
+async def tareas_inicio(application: Application):
+    """Prepara las tareas de fondo una vez inicializada la aplicación"""
+    global _lanzador
+    tareas = []  # Funciones sin argumentos que devuelven la corrutina de cada tarea
+    
+    if PRECARGA_DIFERIDA:
+        Thread(target=precargar_dependencias, daemon=True, name='precarga').start()
+    
+    if BLOQUEO_UMBRAL_MS > 0:
+        vigilante = VigilanteBucle(BLOQUEO_UMBRAL_MS / 1000)
+        tareas.append(vigilante.latir)
+        log.info("🐢 Vigilante del event loop activo (umbral %s ms)", BLOQUEO_UMBRAL_MS)
+    
+    if PERFILADOR.fraccion > 0:
+        log.info("🔬 Perfilado activo para %.0f%% de las llamadas", PERFILADOR.fraccion * 100)
+    
+    iniciar_pool_trabajo()
+    
+    if BGG_PRECARGA:
+        tareas.append(PRECARGA_BGG.ejecutar)
+        log.info("🔮 Precarga de BGG activa (un juego cada %gs como mucho)", BGG_PRECARGA_PAUSA_S)
+    
+    if BACKUP_INTERVALO_H > 0:
+        tareas.append(bucle_copias)
+        # Cada copia es completa: el disco necesario es el de las bases por las que se conservan
+        tamano_bases = sum(os.path.getsize(ruta) for ruta in bases_a_copiar() if os.path.exists(ruta))
+        log.info("💾 Copias de seguridad cada %g h en %s/ (se conservan %d, ~%.1f MB en disco)",
+                 BACKUP_INTERVALO_H, BACKUP_DIR, BACKUP_CONSERVAR, BACKUP_CONSERVAR * tamano_bases / 1e6)
+    
+    if PREGUNTAS_HORAS and GRUPOS_PERMITIDOS:
+        planificador = PlanificadorDiario(PREGUNTAS_HORAS, PREGUNTAS_GRACIA)
+        tareas.append(partial(planificador.ejecutar, application))
+        log.info("⏰ Preguntas automáticas a las %s", ', '.join(f'{h}h' for h in PREGUNTAS_HORAS))
+    
+    if RESUMEN_DIARIO_HORA and GRUPOS_PERMITIDOS:
+        planificador = PlanificadorDiario(
+            [int(RESUMEN_DIARIO_HORA)], PREGUNTAS_GRACIA, generar_resumenes_diarios, 'resumen_diario'
+        )
+        tareas.append(partial(planificador.ejecutar, application))
+        log.info("📅 Resúmenes diarios a las %sh%s", RESUMEN_DIARIO_HORA,
+                 ' (se publican en el grupo)' if RESUMEN_DIARIO_PUBLICAR else '')
+    
+    if tareas:
+        # Se guarda la referencia: asyncio solo guarda una débil a sus tareas
+        _lanzador = asyncio.create_task(lanzar_al_arrancar(application, tareas))
+    
+    # Lo último: el polling empieza en cuanto vuelve post_init
+    if PUESTA_AL_DIA and application.updater is not None:
+        await ponerse_al_dia(application)
+
 async def resumen(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Genera un resumen de los mensajes del grupo"""
     user = update.effective_user
     chat_id = update.effective_chat.id
-    print(f"📝 /resumen ejecutado por @{user.username or user.first_name} en chat {chat_id}")
+    log.info("📝 /resumen ejecutado por @%s en chat %s", user.username or user.first_name, chat_id,
+             extra={'chat_id': chat_id, 'user_id': user.id})
     
     if update.effective_chat.type not in ['group', 'supergroup']:
-        print(f"❌ /resumen: No es un grupo (tipo: {update.effective_chat.type})")
+        log.debug("❌ /resumen: No es un grupo (tipo: %s)", update.effective_chat.type)
         await update.message.reply_text(
             "❌ Este comando solo funciona en grupos."
         )
@@ -663,58 +2585,111 @@ async def resumen(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # 🔐 Verificar acceso del grupo
     if not verificar_acceso(update.effective_chat.id):
-        print(f"🚫 /resumen: Acceso denegado para chat {chat_id}")
+        log.info("🚫 /resumen: Acceso denegado para chat %s", chat_id)
         await update.message.reply_text(
             "⛔ Este grupo no tiene acceso autorizado a este bot.",
             parse_mode='HTML'
         )
         return
     
-    # Obtener el número de horas (por defecto 24)
+    # Obtener el número de horas (por defecto 24), el modo rápido (sin IA) y el alcance
+    args = [a.lower() for a in (context.args or [])]
+    rapido = any(a in ARGUMENTOS_RAPIDO for a in args)
+    todo = any(a in ARGUMENTOS_TODO for a in args)
+    # 🧵 En un foro, solo el tema donde se pide (salvo /resumen todo)
+    tema = TODOS_LOS_TEMAS if todo else tema_de(update)
+    hilo = hilo_respuesta(update)
+    en_tema = " en este tema" if tema != TODOS_LOS_TEMAS else ""
     horas = 24
-    if context.args and context.args[0].isdigit():
-        horas = int(context.args[0])
+    numeros = [a for a in args if a.isdigit()]
+    if numeros:
+        horas = int(numeros[0])
         if horas > 168:  # Máximo 1 semana
             await update.message.reply_text(
-                "⚠️ Máximo 168 horas (1 semana). Usando 168 horas."
+                "⚠️ Máximo 168 horas (1 semana). Usando 168 horas.",
+                message_thread_id=hilo
             )
             horas = 168
     
-    await update.message.reply_text(
-        f"📊 Analizando mensajes de las últimas {horas} hora(s)..."
-    )
+    # 📅 Hay un resumen diario precalculado para esta ventana: respuesta inmediata
+    if not rapido and tema == TODOS_LOS_TEMAS:
+        diario = buscar_resumen_diario(chat_id, horas, datetime.now())
+        if diario:
+            nuevos = contar_mensajes_desde(chat_id, diario['hasta'])
+            await update.message.reply_text(
+                texto_resumen_diario(diario, nuevos), parse_mode='Markdown', message_thread_id=hilo
+            )
+            RESUMENES_DIARIOS.inc('servido')
+            return
+    
+    # 🚦 Cuotas por usuario/chat y cola global de comandos caros
+    turno = await ADMISION.solicitar(update, 'resumen')
+    if turno is None:
+        return
     
     # Calcular timestamp
     fecha_limite = datetime.now() - timedelta(hours=horas)
     
     try:
-        mensajes = obtener_mensajes_db(
-            update.effective_chat.id, 
-            fecha_limite
-        )
+        if rapido:
+            # ⚡ Sin OpenAI: cuenta para la cuota pero no ocupa hueco en la cola global
+            turno.liberar()
+            total_mensajes, resumen_texto = await en_trabajador(
+                trabajo_resumen,
+                update.effective_chat.id,
+                fecha_limite,
+                horas,
+                True,
+                'resumen',
+                tema
+            )
+        else:
+            await update.message.reply_text(
+                f"📊 Analizando mensajes de las últimas {horas} hora(s){en_tema}...",
+                message_thread_id=hilo
+            )
+            
+            # Consulta + prompt + OpenAI van al pool de trabajo (fuera del event loop)
+            async with turno:
+                if todo:
+                    total_mensajes, resumen_texto = await resumen_por_temas(
+                        update.effective_chat.id, fecha_limite, horas
+                    )
+                else:
+                    total_mensajes, resumen_texto = await en_trabajador(
+                        trabajo_resumen,
+                        update.effective_chat.id,
+                        fecha_limite,
+                        horas,
+                        False,
+                        'resumen',
+                        tema
+                    )
         
-        if not mensajes:
+        if not total_mensajes:
             await update.message.reply_text(
-                f"😕 No hay mensajes guardados de las últimas {horas} hora(s).\n\n"
-                "Recuerda: solo puedo resumir mensajes desde que entré al grupo."
+                f"😕 No hay mensajes guardados de las últimas {horas} hora(s){en_tema}.\n\n"
+                "Recuerda: solo puedo resumir mensajes desde que entré al grupo.",
+                message_thread_id=hilo
             )
             return
         
-        # Generar resumen con Claude
-        resumen_texto = await generar_resumen(mensajes, horas)
-        
         # Enviar resumen
         await update.message.reply_text(
-            f"📝 **Resumen de las últimas {horas} hora(s)**\n"
-            f"_({len(mensajes)} mensajes analizados)_\n\n"
+            f"📝 **Resumen de las últimas {horas} hora(s){en_tema}**\n"
+            f"_({total_mensajes} mensajes analizados)_\n\n"
             f"{resumen_texto}",
-            parse_mode='Markdown'
+            parse_mode='Markdown',
+            message_thread_id=hilo
         )
         
     except Exception as e:
         await update.message.reply_text(
-            f"❌ Error al generar resumen: {str(e)}"
+            f"❌ Error al generar resumen: {str(e)}",
+            message_thread_id=hilo
         )
+    finally:
+        turno.liberar()
 
 async def resumen_desde(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Genera resumen desde una hora específica"""
@@ -733,12 +2708,20 @@ async def resumen_desde(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
+    hilo = hilo_respuesta(update)
     if not context.args:
         await update.message.reply_text(
-            "⚠️ Uso: /resumen_desde HH:MM\nEjemplo: /resumen_desde 14:30"
+            "⚠️ Uso: /resumen_desde HH:MM\nEjemplo: /resumen_desde 14:30",
+            message_thread_id=hilo
         )
         return
     
+    # 🧵 En un foro, solo el tema donde se pide (salvo /resumen_desde HH:MM todo)
+    todo = any(a.lower() in ARGUMENTOS_TODO for a in context.args[1:])
+    tema = TODOS_LOS_TEMAS if todo else tema_de(update)
+    en_tema = " en este tema" if tema != TODOS_LOS_TEMAS else ""
+    
+    turno = None
     try:
         hora_str = context.args[0]
         hora, minuto = map(int, hora_str.split(':'))
@@ -757,80 +2740,806 @@ async def resumen_desde(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         horas_diff = (ahora - fecha_desde).total_seconds() / 3600
         
+        # 🚦 Cuotas por usuario/chat y cola global de comandos caros
+        turno = await ADMISION.solicitar(update, 'resumen_desde')
+        if turno is None:
+            return
+        
         await update.message.reply_text(
-            f"📊 Analizando mensajes desde las {hora_str}..."
+            f"📊 Analizando mensajes desde las {hora_str}{en_tema}...",
+            message_thread_id=hilo
         )
         
-        mensajes = obtener_mensajes_db(
-            update.effective_chat.id,
-            fecha_desde
-        )
+        async with turno:
+            if todo:
+                total_mensajes, resumen_texto = await resumen_por_temas(
+                    update.effective_chat.id, fecha_desde, horas_diff, 'resumen_desde'
+                )
+            else:
+                total_mensajes, resumen_texto = await en_trabajador(
+                    trabajo_resumen,
+                    update.effective_chat.id,
+                    fecha_desde,
+                    horas_diff,
+                    False,
+                    'resumen_desde',
+                    tema
+                )
         
-        if not mensajes:
+        if not total_mensajes:
             await update.message.reply_text(
-                f"😕 No hay mensajes guardados desde las {hora_str}."
+                f"😕 No hay mensajes guardados desde las {hora_str}{en_tema}.",
+                message_thread_id=hilo
             )
             return
         
-        resumen_texto = await generar_resumen(mensajes, horas_diff)
-        
         await update.message.reply_text(
-            f"📝 **Resumen desde las {hora_str}**\n"
-            f"_({len(mensajes)} mensajes analizados)_\n\n"
+            f"📝 **Resumen desde las {hora_str}{en_tema}**\n"
+            f"_({total_mensajes} mensajes analizados)_\n\n"
             f"{resumen_texto}",
-            parse_mode='Markdown'
+            parse_mode='Markdown',
+            message_thread_id=hilo
         )
         
     except ValueError:
         await update.message.reply_text(
             "⚠️ Formato incorrecto. Usa: /resumen_desde HH:MM\n"
-            "Ejemplo: /resumen_desde 14:30"
+            "Ejemplo: /resumen_desde 14:30",
+            message_thread_id=hilo
         )
     except Exception as e:
         await update.message.reply_text(
-            f"❌ Error: {str(e)}"
+            f"❌ Error: {str(e)}",
+            message_thread_id=hilo
         )
+    finally:
+        if turno is not None:
+            turno.liberar()
 
-def obtener_mensajes_db(chat_id: int, fecha_limite: datetime):
-    """Obtiene mensajes de la base de datos desde una fecha"""
+def obtener_mensajes_db(chat_id: int, fecha_limite: datetime, tema=TODOS_LOS_TEMAS):
+    """Obtiene mensajes de la base de datos desde una fecha (de un tema, o de todos)"""
     try:
-        conn = sqlite3.connect(DB_NAME)
+        conn = conectar_chat(chat_id)
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT username, first_name, texto, timestamp
-            FROM mensajes
-            WHERE chat_id = ? AND timestamp >= ?
-            ORDER BY timestamp ASC
-        ''', (chat_id, fecha_limite))
+        with DB_DURACION.medir('obtener_mensajes'):
+            if tema == TODOS_LOS_TEMAS:
+                cursor.execute('''
+                    SELECT username, first_name, texto, timestamp, message_id, respuesta_a
+                    FROM mensajes
+                    WHERE chat_id = ? AND timestamp >= ?
+                    ORDER BY timestamp ASC
+                ''', (chat_id, fecha_limite))
+            else:
+                # IS para que None (tema General) encuentre los thread_id NULL
+                cursor.execute('''
+                    SELECT username, first_name, texto, timestamp, message_id, respuesta_a
+                    FROM mensajes
+                    WHERE chat_id = ? AND thread_id IS ? AND timestamp >= ?
+                    ORDER BY timestamp ASC
+                ''', (chat_id, tema, fecha_limite))
+            filas = cursor.fetchall()
         
         mensajes = []
-        for username, first_name, texto, timestamp in cursor.fetchall():
+        for username, first_name, texto, timestamp, message_id, respuesta_a in filas:
             user_display = f"@{username}" if username != 'sin_usuario' else first_name
             mensajes.append({
                 'usuario': user_display,
                 'mensaje': texto,
-                'timestamp': datetime.fromisoformat(timestamp)
+                'timestamp': datetime.fromisoformat(timestamp),
+                'message_id': message_id,
+                'respuesta_a': respuesta_a
             })
         
         conn.close()
         return mensajes
         
     except Exception as e:
-        print(f"Error obteniendo mensajes: {e}")
+        log_db.exception("Error obteniendo mensajes: %s", e)
+        return []
+
+# ============================
+# LLAMADAS A OPENAI (plazos, reintentos y cortocircuito)
+# ============================
+
+OPENAI_PLAZO_S = float(os.environ.get('OPENAI_PLAZO_S', '30'))              # Por intento
+OPENAI_PLAZO_TOTAL_S = float(os.environ.get('OPENAI_PLAZO_TOTAL_S', '60'))  # Con reintentos
+OPENAI_REINTENTOS = int(os.environ.get('OPENAI_REINTENTOS', '2'))
+OPENAI_CORTE_FALLOS = int(os.environ.get('OPENAI_CORTE_FALLOS', '5'))
+OPENAI_CORTE_PAUSA_S = float(os.environ.get('OPENAI_CORTE_PAUSA_S', '60'))
+# Petición de cobertura: si un intento no ha respondido en estos segundos se lanza
+# otro igual y vale el primero que llegue (0 = desactivado; gasta tokens de más)
+OPENAI_COBERTURA_S = float(os.environ.get('OPENAI_COBERTURA_S', '0'))
+# Espera entre reintentos: aleatoria entre 0 y base·2^intento, con tope
+OPENAI_ESPERA_BASE_S = 0.5
+OPENAI_ESPERA_MAX_S = 8.0
+
+OPENAI_REINTENTOS_TOTAL = Contador(
+    'bot_openai_reintentos_total',
+    'Reintentos de llamadas a OpenAI por error',
+    ('operacion', 'error')
+)
+OPENAI_COBERTURAS = Contador(
+    'bot_openai_coberturas_total',
+    'Peticiones de cobertura lanzadas a OpenAI, por cuál respondió antes',
+    ('operacion', 'ganador')
+)
+OPENAI_CIRCUITO = Indicador(
+    'bot_openai_circuito',
+    'Cortocircuito de OpenAI: 0 cerrado, 1 abierto, 0.5 dejando pasar una prueba'
+)
+
+class OpenAINoDisponible(Exception):
+    """El cortocircuito está abierto: ni siquiera se intenta llamar a OpenAI"""
+
+class Cortocircuito:
+    """
+    Tras `fallos` llamadas fallidas seguidas (agotados sus reintentos) deja de
+    llamar a OpenAI durante `pausa_s`: las llamadas fallan al instante y el
+    resumen cae al resumen rápido sin esperar. Pasada la pausa deja pasar una
+    llamada de prueba; si sale bien se cierra, si falla vuelve a abrirse.
+    """
+    
+    def __init__(self, fallos: int, pausa_s: float):
+        self.fallos = fallos
+        self.pausa_s = pausa_s
+        self.seguidos = 0
+        self.abierto_hasta = 0.0
+        self.probando = False
+        self._hilo_prueba = None  # La llamada de prueba se hace entera en un hilo
+        self._lock = threading.Lock()  # Las llamadas llegan desde hilos de trabajo
+    
+    def permitir(self) -> bool:
+        with self._lock:
+            if self.seguidos < self.fallos:
+                return True
+            if self.probando or time.monotonic() < self.abierto_hasta:
+                return False
+            self.probando = True
+            self._hilo_prueba = threading.get_ident()
+            OPENAI_CIRCUITO.fijar(0.5)
+            return True
+    
+    def exito(self):
+        with self._lock:
+            if self.seguidos >= self.fallos:
+                log_openai.info("✅ OpenAI responde de nuevo: cortocircuito cerrado")
+            self.seguidos = 0
+            self.probando = False
+            OPENAI_CIRCUITO.fijar(0)
+    
+    def fallo(self):
+        with self._lock:
+            self.seguidos += 1
+            self.probando = False
+            if self.seguidos >= self.fallos:
+                self.abierto_hasta = time.monotonic() + self.pausa_s
+                OPENAI_CIRCUITO.fijar(1)
+                log_openai.warning("🔌 OpenAI ha fallado %d veces seguidas: sin llamadas durante %.0fs",
+                                   self.seguidos, self.pausa_s)
+    
+    def liberar(self):
+        """Suelta la llamada de prueba de este hilo si acabó sin exito() ni fallo(): la siguiente prueba de nuevo"""
+        with self._lock:
+            if self.probando and self._hilo_prueba == threading.get_ident():
+                self.probando = False
+
+def _espera_reintento(error: Exception, intento: int):
+    """Segundos a esperar antes de reintentar, o None si el error no se arregla reintentando"""
+    import openai
+    if isinstance(error, openai.APIConnectionError):  # Incluye APITimeoutError
+        pass
+    elif isinstance(error, openai.APIStatusError) and (
+            error.status_code in (408, 409, 429) or error.status_code >= 500):
+        cabecera = error.response.headers.get('retry-after')
+        try:
+            return min(float(cabecera), OPENAI_ESPERA_MAX_S)
+        except (TypeError, ValueError):
+            pass
+    else:
+        return None
+    # "Full jitter": reparte los reintentos de muchas llamadas a la vez
+    return random.uniform(0, min(OPENAI_ESPERA_MAX_S, OPENAI_ESPERA_BASE_S * 2 ** intento))
+
+def _pasar_respuesta(destino, futura):
+    """add_done_callback: si la petición respondió, su respuesta a `destino`"""
+    if futura.exception() is None:
+        destino(futura.result())
+
+class LlamadasOpenAI:
+    """
+    Capa de llamadas a chat.completions con plazo por intento (`plazo_s`),
+    plazo total (`plazo_total_s`) que acota también los reintentos, reintentos
+    con espera aleatoria para errores transitorios (red, 408/409/429, 5xx),
+    cortocircuito y, opcionalmente, petición de cobertura para la cola de latencia.
+    
+    Es síncrona y segura entre hilos: se llama desde los trabajos de
+    en_trabajador(). Con PROCESOS_TRABAJO > 0 cada proceso tiene su cortocircuito.
+    """
+    
+    def __init__(self, plazo_s: float, plazo_total_s: float, reintentos: int,
+                 cobertura_s: float, circuito: Cortocircuito):
+        self.plazo_s = plazo_s
+        self.plazo_total_s = plazo_total_s
+        self.reintentos = reintentos
+        self.cobertura_s = cobertura_s
+        self.circuito = circuito
+        self._hilos = None
+    
+    def _intento(self, plazo: float, parametros: dict):
+        return cliente_openai().chat.completions.create(timeout=plazo, **parametros)
+    
+    def _intento_cubierto(self, operacion: str, plazo: float, parametros: dict, descartada=None):
+        if not self.cobertura_s or self.cobertura_s >= plazo:
+            return self._intento(plazo, parametros)
+        
+        if self._hilos is None:
+            self._hilos = ThreadPoolExecutor(max_workers=8, thread_name_prefix='openai')
+        original = self._hilos.submit(self._intento, plazo, parametros)
+        hechas, _ = wait([original], timeout=self.cobertura_s)
+        if hechas:
+            return original.result()
+        
+        # El original sigue en marcha; ya no se puede cancelar, solo ignorar
+        cobertura = self._hilos.submit(self._intento, plazo - self.cobertura_s, parametros)
+        pendientes = {original, cobertura}
+        error = None
+        while pendientes:
+            hechas, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futura in hechas:
+                if futura.exception() is None:
+                    OPENAI_COBERTURAS.inc(operacion, 'original' if futura is original else 'cobertura')
+                    # La otra también se cobra si llega a responder: su respuesta, a `descartada`
+                    if descartada is not None:
+                        perdedora = cobertura if futura is original else original
+                        perdedora.add_done_callback(partial(_pasar_respuesta, descartada))
+                    return futura.result()
+                error = futura.exception()
+        raise error
+    
+    def llamar(self, operacion: str, descartada=None, **parametros):
+        """
+        Respuesta de chat.completions.create(**parametros). Con cobertura, la
+        respuesta que llega después de la buena se pasa a `descartada` (desde
+        otro hilo) para que su uso también se apunte.
+        """
+        if not self.circuito.permitir():
+            OPENAI_LLAMADAS.inc(operacion, 'circuito_abierto')
+            raise OpenAINoDisponible("OpenAI no responde; se volverá a probar en unos segundos")
+        
+        try:
+            return self._llamar(operacion, parametros, descartada)
+        finally:
+            # Si era la llamada de prueba y no acabó en exito() ni fallo(), que no
+            # deje el cortocircuito abierto para siempre
+            self.circuito.liberar()
+    
+    def _llamar(self, operacion: str, parametros: dict, descartada=None):
+        import openai
+        limite = time.monotonic() + self.plazo_total_s
+        intento = 0
+        while True:
+            plazo = min(self.plazo_s, limite - time.monotonic())
+            try:
+                with OPENAI_DURACION.medir(operacion):
+                    respuesta = self._intento_cubierto(operacion, plazo, parametros, descartada)
+            except Exception as e:
+                OPENAI_LLAMADAS.inc(operacion, type(e).__name__)
+                espera = _espera_reintento(e, intento)
+                if espera is None:
+                    # Error de la petición (400, 401...): OpenAI ha contestado, así que está vivo
+                    if isinstance(e, openai.APIStatusError):
+                        self.circuito.exito()
+                    raise
+                # Sin reintentos o sin al menos un segundo de plazo para otro intento
+                if intento >= self.reintentos or time.monotonic() + espera + 1 >= limite:
+                    self.circuito.fallo()
+                    raise
+                intento += 1
+                OPENAI_REINTENTOS_TOTAL.inc(operacion, type(e).__name__)
+                time.sleep(espera)
+                continue
+            
+            OPENAI_LLAMADAS.inc(operacion, 'ok')
+            self.circuito.exito()
+            return respuesta
+
+LLAMADAS_OPENAI = LlamadasOpenAI(
+    OPENAI_PLAZO_S, OPENAI_PLAZO_TOTAL_S, OPENAI_REINTENTOS, OPENAI_COBERTURA_S,
+    Cortocircuito(OPENAI_CORTE_FALLOS, OPENAI_CORTE_PAUSA_S)
+)
+
+def llamar_openai(operacion: str, chat_id: int = 0, comando: str = None, **parametros):
+    """
+    chat.completions.create(**parametros) con plazos, reintentos y cortocircuito.
+    Apunta los tokens de la respuesta a `chat_id` y `comando` (por defecto, la operación),
+    y también los de la petición de cobertura que pierde, que OpenAI cobra igual.
+    """
+    inicio = time.perf_counter()
+    comando = comando or operacion
+    modelo = parametros.get('model', '')
+    
+    def apuntar(respuesta):
+        registrar_uso(chat_id, comando, modelo, respuesta.usage, time.perf_counter() - inicio)
+    
+    respuesta = LLAMADAS_OPENAI.llamar(operacion, descartada=apuntar, **parametros)
+    apuntar(respuesta)
+    return respuesta
+
+# ============================
+# USO DE OPENAI (tokens, coste y presupuestos por chat)
+# ============================
+
+# USD por millón de tokens (entrada, salida), solo para el informe de /uso
+PRECIOS_MODELOS = {'gpt-4o-mini': (0.15, 0.60)}
+# Tokens (entrada + salida) al día por grupo; 0 = sin límite.
+# PRESUPUESTO_TOKENS_CHATS='-1001234567890=50000,-1009876543210=0' lo cambia por grupo
+PRESUPUESTO_TOKENS_DIARIO = int(os.environ.get('PRESUPUESTO_TOKENS_DIARIO', '0'))
+PRESUPUESTO_TOKENS_CHATS = {
+    int(chat): int(tokens) for chat, tokens in (
+        parte.split('=') for parte in os.environ.get('PRESUPUESTO_TOKENS_CHATS', '').split(',') if parte.strip()
+    )
+}
+# Gastada esta fracción del presupuesto, los resúmenes pasan a modo ahorro: menos
+# líneas en el prompt y respuesta más corta. Agotado, resumen rápido sin IA.
+PRESUPUESTO_AHORRO = float(os.environ.get('PRESUPUESTO_AHORRO', '0.7'))
+PRESUPUESTO_FACTOR_AHORRO = 0.3
+
+OPENAI_TOKENS = Contador(
+    'bot_openai_tokens_total',
+    'Tokens consumidos en OpenAI según la respuesta (entrada/salida)',
+    ('comando', 'tipo')
+)
+PRESUPUESTO_MODOS = Contador(
+    'bot_presupuesto_modo_total',
+    'Peticiones de IA por modo de presupuesto del chat: normal, ahorro, agotado',
+    ('modo',)
+)
+
+def registrar_uso(chat_id: int, comando: str, modelo: str, uso, segundos: float):
+    """Suma una llamada a la fila (chat, día, comando, modelo) de uso_tokens"""
+    entrada = getattr(uso, 'prompt_tokens', 0) or 0
+    salida = getattr(uso, 'completion_tokens', 0) or 0
+    OPENAI_TOKENS.inc(comando, 'entrada', cantidad=entrada)
+    OPENAI_TOKENS.inc(comando, 'salida', cantidad=salida)
+    try:
+        conn = conectar_global()
+        with DB_DURACION.medir('registrar_uso'):
+            conn.execute('''
+                INSERT INTO uso_tokens
+                (chat_id, dia, comando, modelo, llamadas, tokens_entrada, tokens_salida, segundos)
+                VALUES (?, ?, ?, ?, 1, ?, ?, ?)
+                ON CONFLICT (chat_id, dia, comando, modelo) DO UPDATE SET
+                    llamadas = llamadas + 1,
+                    tokens_entrada = tokens_entrada + excluded.tokens_entrada,
+                    tokens_salida = tokens_salida + excluded.tokens_salida,
+                    segundos = segundos + excluded.segundos
+            ''', (chat_id, datetime.now().date().isoformat(), comando, modelo, entrada, salida, segundos))
+            conn.commit()
+        conn.close()
+    except sqlite3.Error as e:
+        # Perder una fila de uso no debe tirar el resumen que ya se ha pagado
+        log_openai.warning("⚠️ No se pudo registrar el uso de OpenAI: %s", e)
+
+def presupuesto_chat(chat_id: int) -> int:
+    return PRESUPUESTO_TOKENS_CHATS.get(chat_id, PRESUPUESTO_TOKENS_DIARIO)
+
+def tokens_hoy(chat_id: int) -> int:
+    conn = conectar_global()
+    total = conn.execute(
+        'SELECT COALESCE(SUM(tokens_entrada + tokens_salida), 0) FROM uso_tokens WHERE chat_id = ? AND dia = ?',
+        (chat_id, datetime.now().date().isoformat())
+    ).fetchone()[0]
+    conn.close()
+    return total
+
+def modo_presupuesto(chat_id: int, previsto: int = 0) -> str:
+    """
+    'normal', 'ahorro' (cerca del límite diario, o la llamada de `previsto`
+    tokens no cabría entera en lo que queda) o 'agotado'
+    """
+    presupuesto = presupuesto_chat(chat_id)
+    if presupuesto <= 0:
+        return 'normal'
+    gastado = tokens_hoy(chat_id)
+    if gastado >= presupuesto:
+        return 'agotado'
+    if gastado >= presupuesto * PRESUPUESTO_AHORRO or gastado + previsto > presupuesto:
+        return 'ahorro'
+    return 'normal'
+
+def informe_uso(chat_id: int, dias: int) -> dict:
+    """Uso de los últimos `dias` días (hoy incluido) de un chat, por comando"""
+    desde = (datetime.now().date() - timedelta(days=dias - 1)).isoformat()
+    conn = conectar_global()
+    filas = conn.execute('''
+        SELECT comando, modelo, llamadas, tokens_entrada, tokens_salida, segundos
+        FROM uso_tokens
+        WHERE chat_id = ? AND dia >= ?
+    ''', (chat_id, desde)).fetchall()
+    conn.close()
+    
+    por_comando = {}
+    for comando, modelo, llamadas, entrada, salida, segundos in filas:
+        precio_entrada, precio_salida = PRECIOS_MODELOS.get(modelo, (0, 0))
+        fila = por_comando.setdefault(comando, {'llamadas': 0, 'entrada': 0, 'salida': 0, 'segundos': 0.0, 'coste': 0.0})
+        fila['llamadas'] += llamadas
+        fila['entrada'] += entrada
+        fila['salida'] += salida
+        fila['segundos'] += segundos
+        fila['coste'] += (entrada * precio_entrada + salida * precio_salida) / 1e6
+    return por_comando
+
+# ============================
+# PREPROCESADO DE MENSAJES (ahorro de tokens)
+# ============================
+
+# Pasos que se aplican antes de construir el prompt (vacío = enviar los mensajes tal cual)
+PREPROCESADO_PASOS = {
+    paso.strip() for paso in os.environ.get('PREPROCESADO_PASOS', 'urls,emojis,duplicados,truncar,unir').split(',')
+    if paso.strip()
+}
+PREPROCESADO_MAX_CARACTERES = int(os.environ.get('PREPROCESADO_MAX_CARACTERES', '400'))
+PREPROCESADO_UNIR_MINUTOS = float(os.environ.get('PREPROCESADO_UNIR_MINUTOS', '5'))
+# Textos más cortos ("jaja", "sí", "+1") solo se colapsan si van seguidos
+PREPROCESADO_MIN_DUPLICADO = 20
+
+PATRON_URL = re.compile(r'https?://(?:www\.)?([^/\s?#:]+)\S*')
+PATRON_CONTENIDO = re.compile(r'\w')
+
+TOKENS_RESUMEN = Contador(
+    'bot_resumen_tokens_estimados_total',
+    'Tokens estimados de la conversación enviada a OpenAI (original / preprocesado)',
+    ('etapa',)
+)
+
+def estimar_tokens(texto: str) -> int:
+    """Estimación barata: ~4 caracteres por token en los modelos de OpenAI"""
+    return (len(texto) + 3) // 4
+
+def formatear_conversacion(mensajes: list) -> str:
+    return "\n".join(
+        f"[{m['timestamp'].strftime('%H:%M')}] {m['usuario']}: {m['mensaje']}"
+        for m in mensajes
+    )
+
+def preprocesar_mensajes(mensajes: list, pasos: set = None) -> list:
+    """
+    Reduce la conversación antes de mandarla a OpenAI:
+    
+    - urls: los enlaces se quedan en su dominio ([youtube.com])
+    - emojis: fuera los mensajes sin letras ni números (solo emojis)
+    - duplicados: un texto que un usuario repite se manda una vez con (×N); el
+      mismo texto de otro usuario va en su línea, con su autor y su hora
+    - truncar: los mensajes de más de PREPROCESADO_MAX_CARACTERES se cortan
+    - unir: los mensajes seguidos de un usuario (con menos de PREPROCESADO_UNIR_MINUTOS
+      entre ellos) van en una sola línea separados por " / "
+    
+    Devuelve dicts como los de obtener_mensajes_db, más 'desde': índice del
+    primer mensaje original que cubre cada línea.
+    """
+    pasos = PREPROCESADO_PASOS if pasos is None else pasos
+    max_caracteres = PREPROCESADO_MAX_CARACTERES
+    hueco = timedelta(minutes=PREPROCESADO_UNIR_MINUTOS)
+    
+    lineas = []  # {'usuario', 'timestamp', 'ultimo', 'desde', 'partes': [[texto, repeticiones], ...]}
+    vistos = {}  # (usuario, texto normalizado) -> parte
+    ultima_parte = None
+    
+    for indice, m in enumerate(mensajes):
+        texto = m['mensaje']
+        if 'urls' in pasos and '://' in texto:
+            texto = PATRON_URL.sub(r'[\1]', texto)
+        if 'emojis' in pasos and not PATRON_CONTENIDO.search(texto):
+            continue
+        if 'truncar' in pasos and len(texto) > max_caracteres:
+            texto = texto[:max_caracteres].rstrip() + '…'
+        
+        if 'duplicados' in pasos:
+            clave = (m['usuario'], texto.casefold().strip())
+            parte = vistos.get(clave)
+            if parte is not None and (parte is ultima_parte or len(clave[1]) >= PREPROCESADO_MIN_DUPLICADO):
+                parte[1] += 1
+                continue
+        
+        parte = [texto, 1]
+        if 'duplicados' in pasos:
+            vistos[clave] = parte
+        ultima_parte = parte
+        
+        linea = lineas[-1] if lineas else None
+        if ('unir' in pasos and linea and linea['usuario'] == m['usuario']
+                and m['timestamp'] - linea['ultimo'] <= hueco):
+            linea['partes'].append(parte)
+            linea['ultimo'] = m['timestamp']
+        else:
+            lineas.append({
+                'usuario': m['usuario'],
+                'timestamp': m['timestamp'],
+                'ultimo': m['timestamp'],
+                'desde': indice,
+                'partes': [parte],
+            })
+    
+    return [
+        {
+            'usuario': linea['usuario'],
+            'mensaje': ' / '.join(
+                texto if repeticiones == 1 else f"{texto} (×{repeticiones})"
+                for texto, repeticiones in linea['partes']
+            ),
+            'timestamp': linea['timestamp'],
+            'desde': linea['desde'],
+        }
+        for linea in lineas
+    ]
+
+# ============================
+# RELEVANCIA DE MENSAJES (qué cabe en el prompt)
+# ============================
+
+# Presupuesto de la conversación dentro del prompt de /resumen
+RESUMEN_MAX_LINEAS = int(os.environ.get('RESUMEN_MAX_LINEAS', '200'))
+RESUMEN_MAX_TOKENS = int(os.environ.get('RESUMEN_MAX_TOKENS', '6000'))
+
+# Peso de cada señal en la puntuación (cada una normalizada a 0..1)
+RELEVANCIA_PESOS = {
+    'terminos': 1.0,       # TF-IDF: habla de los temas de la ventana
+    'respuestas': 0.8,     # Respuestas recibidas (abrió un hilo)
+    'reacciones': 0.5,     # Otros usuarios que escriben justo después
+    'participacion': 0.3,  # Quien escribe poco pesa más que quien escribe cientos
+    'recencia': 0.2,       # Ligera preferencia por lo último
+}
+RELEVANCIA_MINUTOS_REACCION = 5
+RELEVANCIA_MENSAJES_REACCION = 10
+# Con más mensajes, TF-IDF solo sobre los N mejores por las demás señales
+RELEVANCIA_MAX_TERMINOS = int(os.environ.get('RELEVANCIA_MAX_TERMINOS', '3000'))
+
+# Signos que se quitan de los extremos de cada palabra ("juego," -> "juego")
+SIGNOS_TERMINO = '.,;:!?¡¿()[]{}"\'«»“”‘’…-_*/\\|<>#'
+PALABRAS_VACIAS = frozenset(
+    "que los las del por con una uno unos unas para como pero más mas este esta estos "
+    "estas ese esa eso esto hay muy sin sus les nos ya son fue ser está estoy era "
+    "qué cómo donde dónde cuando cuándo también tambien porque todo toda todos algo "
+    "aquí ahí bien pues vale jaja jajaja jeje the and for you".split()
+)
+
+def _normalizar(valores: list) -> list:
+    maximo = max(valores, default=0)
+    if maximo <= 0:
+        return valores
+    return [v / maximo for v in valores]
+
+def pesos_terminos(mensajes: list) -> tuple:
+    """
+    TF-IDF sobre la ventana: los términos que salen en un solo mensaje no
+    cuentan, y los que salen en casi todos pesan poco.
+    
+    Devuelve (palabras de cada mensaje, peso de cada palabra tal cual aparece,
+    peso de cada término limpio). Se trocea con split() y la limpieza (signos,
+    palabras vacías, números, emojis) se hace una vez por palabra distinta, no
+    por aparición: es lo que cuesta con 10k mensajes.
+    """
+    palabras = [set(m['mensaje'].casefold().split()) for m in mensajes]
+    apariciones = Counter(chain.from_iterable(palabras))
+    limpio = {}
+    frecuencia = Counter()
+    for palabra, veces in apariciones.items():
+        termino = palabra.strip(SIGNOS_TERMINO)
+        if len(termino) >= 3 and termino.isalpha() and termino not in PALABRAS_VACIAS:
+            limpio[palabra] = termino
+            frecuencia[termino] += veces
+    log_n = math.log(max(len(mensajes), 1))
+    peso_termino = {
+        t: math.log1p(f) * (log_n - math.log(f)) if f > 1 else 0.0
+        for t, f in frecuencia.items()
+    }
+    peso_palabra = {palabra: peso_termino.get(limpio.get(palabra), 0.0) for palabra in apariciones}
+    return palabras, peso_palabra, peso_termino
+
+def puntuar_relevancia(mensajes: list, terminos: tuple = None) -> list:
+    """
+    Puntuación local (sin llamadas externas) de cada mensaje de la ventana,
+    combinando las señales de RELEVANCIA_PESOS. Los mensajes son dicts como
+    los de obtener_mensajes_db; 'message_id' y 'respuesta_a' son opcionales.
+    `terminos` es el resultado de pesos_terminos(mensajes) si ya se tiene.
+    
+    Trocear el texto es lo que cuesta: con más de RELEVANCIA_MAX_TERMINOS
+    mensajes (y sin `terminos`), el TF-IDF se calcula solo sobre los que más
+    puntúan por las demás señales y el resto queda con 0 en 'terminos'.
+    """
+    n = len(mensajes)
+    if not n:
         return []
+    
+    # Respuestas recibidas dentro de la ventana
+    indice = {m['message_id']: i for i, m in enumerate(mensajes) if m.get('message_id') is not None}
+    recibidas = [0] * n
+    for m in mensajes:
+        destino = indice.get(m.get('respuesta_a'))
+        if destino is not None:
+            recibidas[destino] += 1
+    puntos_respuestas = [math.log1p(r) for r in recibidas]
+    
+    # Reacciones: cambios de turno entre usuarios en los minutos (y mensajes)
+    # siguientes, con sumas acumuladas y un puntero que solo avanza
+    ventana = timedelta(minutes=RELEVANCIA_MINUTOS_REACCION)
+    usuarios = [m['usuario'] for m in mensajes]
+    marcas = [m['timestamp'] for m in mensajes]
+    turnos = [0] * (n + 1)
+    for j in range(1, n):
+        turnos[j + 1] = turnos[j] + (usuarios[j] != usuarios[j - 1])
+    puntos_reacciones = []
+    fin = 0
+    for i in range(n):
+        limite = marcas[i] + ventana
+        while fin < n and marcas[fin] <= limite:
+            fin += 1
+        tope = min(fin, i + 1 + RELEVANCIA_MENSAJES_REACCION)
+        puntos_reacciones.append(turnos[tope] - turnos[i + 1])
+    
+    factor = {u: 1 / math.sqrt(veces) for u, veces in Counter(usuarios).items()}
+    puntos_participacion = [factor[u] for u in usuarios]
+    puntos_recencia = [i / n for i in range(n)]
+    
+    senales = {
+        'respuestas': _normalizar(puntos_respuestas),
+        'reacciones': _normalizar(puntos_reacciones),
+        'participacion': _normalizar(puntos_participacion),
+        'recencia': puntos_recencia,
+    }
+    puntuaciones = [0.0] * n
+    for nombre, valores in senales.items():
+        peso = RELEVANCIA_PESOS.get(nombre, 0)
+        if peso:
+            puntuaciones = [p + peso * v for p, v in zip(puntuaciones, valores)]
+    
+    peso_terminos = RELEVANCIA_PESOS.get('terminos', 0)
+    if not peso_terminos:
+        return puntuaciones
+    if terminos is None and n > RELEVANCIA_MAX_TERMINOS:
+        candidatos = sorted(heapq.nlargest(RELEVANCIA_MAX_TERMINOS, range(n), key=puntuaciones.__getitem__))
+        terminos = pesos_terminos([mensajes[i] for i in candidatos])
+    else:
+        candidatos = range(n)
+        terminos = terminos or pesos_terminos(mensajes)
+    palabras, peso_palabra, _ = terminos
+    peso = peso_palabra.__getitem__
+    puntos_terminos = [
+        sum(map(peso, conjunto)) / math.sqrt(len(conjunto)) if conjunto else 0.0
+        for conjunto in palabras
+    ]
+    for i, v in zip(candidatos, _normalizar(puntos_terminos)):
+        puntuaciones[i] += peso_terminos * v
+    return puntuaciones
+
+def seleccionar_relevantes(mensajes: list, lineas: list = None,
+                           max_lineas: int = None, max_tokens: int = None) -> list:
+    """
+    Elige qué líneas entran en el prompt: si caben todas (RESUMEN_MAX_LINEAS,
+    RESUMEN_MAX_TOKENS) van todas; si no, las de mayor puntuación que quepan,
+    devueltas en orden cronológico.
+    
+    `lineas` es la salida de preprocesar_mensajes (cada línea puntúa como el
+    mejor de los mensajes que cubre desde su 'desde'); None = los mensajes tal cual.
+    """
+    lineas = mensajes if lineas is None else lineas
+    max_lineas = RESUMEN_MAX_LINEAS if max_lineas is None else max_lineas
+    max_tokens = RESUMEN_MAX_TOKENS if max_tokens is None else max_tokens
+    
+    # Igual que formatear_conversacion: "[HH:MM] usuario: mensaje"
+    costes = [estimar_tokens(l['usuario']) + estimar_tokens(l['mensaje']) + 3 for l in lineas]
+    if len(lineas) <= max_lineas and sum(costes) <= max_tokens:
+        return lineas
+    
+    puntuaciones = puntuar_relevancia(mensajes)
+    if lineas is not mensajes:
+        cortes = [l['desde'] for l in lineas] + [len(mensajes)]
+        puntuaciones = [max(puntuaciones[a:b], default=0.0) for a, b in zip(cortes, cortes[1:])]
+    
+    elegidas = []
+    usados = 0
+    for i in sorted(range(len(lineas)), key=puntuaciones.__getitem__, reverse=True):
+        if len(elegidas) >= max_lineas:
+            break
+        if usados + costes[i] <= max_tokens:
+            elegidas.append(i)
+            usados += costes[i]
+    elegidas.sort()
+    return [lineas[i] for i in elegidas]
+
+# ============================
+# RESUMEN RÁPIDO (sin IA)
+# ============================
 
-async def generar_resumen(mensajes: list, horas: float):
-    """Genera un resumen usando ChatGPT de OpenAI"""
+RAPIDO_TEMAS = 8
+RAPIDO_MENSAJES_CLAVE = 6
+RAPIDO_PARTICIPANTES = 5
+RAPIDO_MAX_CARACTERES = 200
+ARGUMENTOS_RAPIDO = {'rapido', 'rápido'}
+
+def escapar_markdown(texto: str) -> str:
+    """Escapa los caracteres especiales del Markdown de Telegram (parse_mode='Markdown')"""
+    for caracter in ('_', '*', '`', '['):
+        texto = texto.replace(caracter, '\\' + caracter)
+    return texto
+
+def resumen_extractivo(mensajes: list, horas: float) -> str:
+    """
+    Resumen local, sin llamar a OpenAI: temas (términos con más peso TF-IDF),
+    mensajes clave (los de más relevancia, en orden) y participantes activos.
+    Responde en milisegundos; sirve para /resumen rapido y como respaldo
+    cuando OpenAI falla.
+    """
+    if not mensajes:
+        return "😕 No hay mensajes en este periodo."
+    
+    terminos = pesos_terminos(mensajes)
+    peso_termino = terminos[2]
+    temas = [t for t, peso in heapq.nlargest(RAPIDO_TEMAS, peso_termino.items(), key=lambda x: x[1]) if peso > 0]
+    
+    puntuaciones = puntuar_relevancia(mensajes, terminos)
+    claves = sorted(heapq.nlargest(RAPIDO_MENSAJES_CLAVE, range(len(mensajes)), key=puntuaciones.__getitem__))
+    
+    participantes = Counter(m['usuario'] for m in mensajes).most_common(RAPIDO_PARTICIPANTES)
+    
+    partes = []
+    if temas:
+        partes.append("**Temas principales**: " + escapar_markdown(', '.join(temas)))
+    
+    lineas_clave = []
+    for i in claves:
+        m = mensajes[i]
+        texto = ' '.join(m['mensaje'].split())
+        if len(texto) > RAPIDO_MAX_CARACTERES:
+            texto = texto[:RAPIDO_MAX_CARACTERES].rstrip() + '…'
+        lineas_clave.append(
+            f"• [{m['timestamp'].strftime('%H:%M')}] {escapar_markdown(m['usuario'])}: {escapar_markdown(texto)}"
+        )
+    partes.append("**Mensajes clave**:\n" + "\n".join(lineas_clave))
+    
+    partes.append("**Participantes activos**: " + ', '.join(
+        f"{escapar_markdown(usuario)} ({veces})" for usuario, veces in participantes
+    ))
+    
+    partes.append(f"_⚡ Resumen rápido sin IA de {len(mensajes)} mensajes en {round(horas, 1):g} h_")
+    return "\n\n".join(partes)
+
+async def generar_resumen(mensajes: list, horas: float, chat_id: int = 0,
+                          comando: str = 'resumen', ahorro: bool = False):
+    """
+    Genera un resumen usando ChatGPT de OpenAI.
+    Con `ahorro` (presupuesto del chat casi gastado) manda menos líneas y pide una respuesta más corta.
+    """
+    
+    # 🧹 Unir, deduplicar y acortar antes de construir el prompt
+    if PREPROCESADO_PASOS:
+        lineas = preprocesar_mensajes(mensajes)
+    else:
+        lineas = mensajes
     
-    # Limitar a los últimos 200 mensajes para no exceder tokens
-    mensajes_recientes = mensajes[-200:] if len(mensajes) > 200 else mensajes
+    # 🎯 Si no cabe todo, las líneas más relevantes de la ventana (en orden)
+    factor = PRESUPUESTO_FACTOR_AHORRO if ahorro else 1
+    seleccion = seleccionar_relevantes(
+        mensajes, lineas if PREPROCESADO_PASOS else None,
+        max_lineas=max(1, int(RESUMEN_MAX_LINEAS * factor)),
+        max_tokens=max(1, int(RESUMEN_MAX_TOKENS * factor))
+    )
     
     # Formatear mensajes para ChatGPT
-    conversacion = "\n".join([
-        f"[{m['timestamp'].strftime('%H:%M')}] {m['usuario']}: {m['mensaje']}"
-        for m in mensajes_recientes
-    ])
+    conversacion = formatear_conversacion(seleccion)
+    
+    if seleccion is not lineas or PREPROCESADO_PASOS:
+        # Ahorro frente a mandar tal cual toda la ventana
+        tokens_originales = estimar_tokens(formatear_conversacion(mensajes))
+        tokens_enviados = estimar_tokens(conversacion)
+        TOKENS_RESUMEN.inc('original', cantidad=tokens_originales)
+        TOKENS_RESUMEN.inc('preprocesado', cantidad=tokens_enviados)
+        log_openai.info(
+            "🧹 Preprocesado: %d mensajes → %d líneas → %d elegidas, ~%d → ~%d tokens (-%.0f%%)",
+            len(mensajes), len(lineas), len(seleccion), tokens_originales, tokens_enviados,
+            (1 - tokens_enviados / max(1, tokens_originales)) * 100
+        )
     
     prompt = f"""Resume la siguiente conversación de un grupo de Telegram de las últimas {horas:.1f} horas ({len(mensajes)} mensajes totales).
 
@@ -846,20 +3555,30 @@ Por favor proporciona un resumen estructurado con:
 Mantén el resumen conciso pero informativo."""
 
     try:
-        response = openai_client.chat.completions.create(
+        response = llamar_openai(
+            'resumen',
+            chat_id,
+            comando,
             model="gpt-4o-mini",  # Modelo económico y rápido
             messages=[
                 {"role": "system", "content": "Eres un asistente que resume conversaciones de grupos de forma clara y estructurada."},
                 {"role": "user", "content": prompt}
             ],
-            max_tokens=1000,
+            max_tokens=int(1000 * factor),
             temperature=0.7
         )
         
-        return response.choices[0].message.content
+        texto = response.choices[0].message.content
+        if ahorro:
+            texto += "\n\n_💸 Modo ahorro: el presupuesto diario de IA del grupo está casi agotado._"
+        return texto
         
     except Exception as e:
-        return f"❌ No se pudo generar el resumen: {str(e)}"
+        log_openai.warning("⚠️ OpenAI falló (%s: %s); respondiendo con el resumen rápido", type(e).__name__, e)
+        return (
+            "⚠️ _No se pudo contactar con OpenAI; este es el resumen rápido sin IA._\n\n"
+            + resumen_extractivo(mensajes, horas)
+        )
 
 # ============================
 # INTEGRACIÓN BGG API
@@ -867,7 +3586,6 @@ Mantén el resumen conciso pero informativo."""
 
 def limpiar_html(texto_html: str) -> str:
     """Limpia tags HTML de un texto"""
-    import re
     # Eliminar tags HTML
     texto = re.sub(r'<[^>]+>', '', texto_html)
     # Decodificar entidades HTML comunes
@@ -875,7 +3593,7 @@ def limpiar_html(texto_html: str) -> str:
     texto = texto.replace('&#10;', '\n').replace('&rsquo;', "'").replace('&mdash;', '—')
     return texto.strip()
 
-async def resumir_descripcion_bgg(descripcion: str) -> str:
+async def resumir_descripcion_bgg(descripcion: str, chat_id: int = 0, comando: str = 'datos') -> str:
     """Resume la descripción de un juego usando OpenAI"""
     try:
         # Limpiar HTML
@@ -885,6 +3603,11 @@ async def resumir_descripcion_bgg(descripcion: str) -> str:
         if len(descripcion_limpia) < 200:
             return descripcion_limpia
         
+        # 💸 Sin presupuesto de IA en el chat: recortada, como cuando falla OpenAI
+        if modo_presupuesto(chat_id) == 'agotado':
+            PRESUPUESTO_MODOS.inc('agotado')
+            return descripcion_limpia[:200] + "..."
+        
         prompt = f"""Resume esta descripción de un juego de mesa en MÁXIMO 2-3 frases cortas (unos 150 caracteres). Debe ser conciso y captar la esencia del juego.
 
 Descripción original:
@@ -892,7 +3615,10 @@ Descripción original:
 
 Resume:"""
         
-        response = openai_client.chat.completions.create(
+        response = llamar_openai(
+            'descripcion_bgg',
+            chat_id,
+            comando,
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "Eres un experto en juegos de mesa que resume descripciones de forma clara y concisa."},
@@ -905,51 +3631,33 @@ Resume:"""
         return response.choices[0].message.content.strip()
         
     except Exception as e:
-        print(f"⚠️ Error resumiendo descripción: {e}")
+        log_openai.warning("⚠️ Error resumiendo descripción: %s", e)
         # Si falla, devolver los primeros 200 caracteres limpios
         return limpiar_html(descripcion)[:200] + "..."
 
-async def buscar_juego_bgg(nombre_juego: str) -> dict:
-    """Busca un juego en BoardGameGeek API"""
-    print(f"🔍 BGG: Buscando '{nombre_juego}'...")
+async def buscar_juego_bgg(nombre_juego: str, chat_id: int = 0, comando: str = 'datos') -> dict:
+    """Busca un juego en BoardGameGeek API (`chat_id`, `comando`: a qué se apunta el uso de OpenAI)"""
+    import xml.etree.ElementTree as ET  # Diferido: solo se paga con el primer /datos
+    
+    log_bgg.debug("🔍 BGG: Buscando '%s'...", nombre_juego)
     try:
         # Verificar caché primero
-        conn = sqlite3.connect(DB_NAME)
+        conn = conectar_global()
         cursor = conn.cursor()
         
-        # Crear tabla actualizada si no existe
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bgg_cache_v2 (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                game_name TEXT,
-                bgg_id INTEGER,
-                image_url TEXT,
-                min_players INTEGER,
-                max_players INTEGER,
-                best_players TEXT,
-                playtime INTEGER,
-                weight REAL,
-                year_published INTEGER,
-                rank INTEGER,
-                bgg_link TEXT,
-                description TEXT,
-                mechanics TEXT,
-                timestamp DATETIME,
-                UNIQUE(game_name)
-            )
-        ''')
-        
-        cursor.execute('''
-            SELECT * FROM bgg_cache_v2
-            WHERE LOWER(game_name) = LOWER(?)
-            AND timestamp > ?
-        ''', (nombre_juego, datetime.now() - timedelta(days=30)))
-        
-        cached = cursor.fetchone()
+        with DB_DURACION.medir('bgg_cache_buscar'):
+            cursor.execute('''
+                SELECT * FROM bgg_cache_v2
+                WHERE game_name = ? COLLATE NOCASE
+                AND timestamp > ?
+            ''', (nombre_juego, datetime.now() - BGG_CACHE_VIGENCIA))
+            
+            cached = cursor.fetchone()
         conn.close()
         
+        CACHE_CONSULTAS.inc('bgg', 'acierto' if cached else 'fallo')
         if cached:
-            print(f"✅ BGG: Encontrado en caché (ID: {cached[2]})")
+            log_bgg.debug("✅ BGG: Encontrado en caché (ID: %s)", cached[2])
             return {
                 'bgg_id': cached[2],
                 'image_url': cached[3],
@@ -972,101 +3680,76 @@ async def buscar_juego_bgg(nombre_juego: str) -> dict:
             "query": nombre_juego,
             "type": "boardgame",
         }
-        print(f"🌐 BGG: URL búsqueda: {search_url}?query={nombre_juego}")
+        log_bgg.debug("🌐 BGG: URL búsqueda: %s?query=%s", search_url, nombre_juego)
         
-        response = requests.get(
-            search_url,
-            params=params,
-            headers=bgg_headers(),
-            timeout=10,
-        )
+        response = bgg_get('search', search_url, params)
         
-        print(f"📡 BGG: Status Code búsqueda: {response.status_code}")
+        log_bgg.debug("📡 BGG: Status Code búsqueda: %s", response.status_code)
         
         # Manejo de código 401: token inválido o ausente
         if response.status_code == 401:
-            print("❌ BGG: 401 Unauthorized en búsqueda. Revisa el token BGG_API_TOKEN y el dominio (sin www).")
+            log_bgg.error("❌ BGG: 401 Unauthorized en búsqueda. Revisa el token BGG_API_TOKEN y el dominio (sin www).")
             return None
         
         # Manejo de código 202: BGG pone la respuesta en cola cuando está ocupado
         # Reintentamos unas pocas veces con backoff simple
         if response.status_code == 202:
-            print("⏳ BGG: Respuesta en cola (202), reintentando...")
+            log_bgg.info("⏳ BGG: Respuesta en cola (202), reintentando...")
             for intento in range(3):
-                import time
                 time.sleep(2)
-                response = requests.get(
-                    search_url,
-                    params=params,
-                    headers=bgg_headers(),
-                    timeout=10,
-                )
-                print(f"📡 BGG: Reintento búsqueda {intento+1}, status: {response.status_code}")
+                response = bgg_get('search', search_url, params)
+                log_bgg.info("📡 BGG: Reintento búsqueda %d, status: %s", intento + 1, response.status_code)
                 if response.status_code == 200:
                     break
             if response.status_code != 200:
-                print("❌ BGG: No se obtuvo respuesta 200 tras reintentos en búsqueda.")
+                log_bgg.warning("❌ BGG: No se obtuvo respuesta 200 tras reintentos en búsqueda.")
                 return None
         
         if response.status_code != 200:
-            print(f"❌ BGG: Error en búsqueda (status {response.status_code})")
+            log_bgg.warning("❌ BGG: Error en búsqueda (status %s)", response.status_code)
             return None
         
         root = ET.fromstring(response.content)
         items = root.findall('.//item')
         
-        print(f"📊 BGG: Encontrados {len(items)} resultados")
+        log_bgg.debug("📊 BGG: Encontrados %d resultados", len(items))
         if not items:
-            print(f"❌ BGG: No se encontraron juegos para '{nombre_juego}'")
+            log_bgg.info("❌ BGG: No se encontraron juegos para '%s'", nombre_juego)
             return None
         
         # Tomar el primer resultado
         bgg_id = items[0].get('id')
         game_name = items[0].find('name').get('value') if items[0].find('name') is not None else nombre_juego
-        print(f"✅ BGG: Primer resultado - ID: {bgg_id}, Nombre: {game_name}")
-        
-        # ⏳ RATE LIMITING: BGG requiere mínimo 5 segundos entre requests
-        print("⏳ BGG: Esperando 5s (rate limit)...")
-        time.sleep(5)
+        log_bgg.debug("✅ BGG: Primer resultado - ID: %s, Nombre: %s", bgg_id, game_name)
         
+        # ⏳ RATE LIMITING: bgg_get() espera BGG_PAUSA_S desde la búsqueda
         # Obtener detalles del juego
         details_url = f"{BGG_API_BASE}/thing"
         details_params = {
             "id": bgg_id,
             "stats": 1,
         }
-        details_response = requests.get(
-            details_url,
-            params=details_params,
-            headers=bgg_headers(),
-            timeout=10,
-        )
-        print(f"📡 BGG: Status Code detalles: {details_response.status_code}")
+        details_response = bgg_get('thing', details_url, details_params)
+        log_bgg.debug("📡 BGG: Status Code detalles: %s", details_response.status_code)
         
         if details_response.status_code == 401:
-            print("❌ BGG: 401 Unauthorized en detalles. Problema de token o dominio.")
+            log_bgg.error("❌ BGG: 401 Unauthorized en detalles. Problema de token o dominio.")
             return None
         
         if details_response.status_code == 202:
-            print("⏳ BGG: Respuesta en cola (202), reintentando detalles...")
+            log_bgg.info("⏳ BGG: Respuesta en cola (202), reintentando detalles...")
             for intento in range(3):
-                import time
                 time.sleep(2)
-                details_response = requests.get(
-                    details_url,
-                    params=details_params,
-                    headers=bgg_headers(),
-                    timeout=10,
-                )
-                print(f"📡 BGG: Reintento detalles {intento+1}, status: {details_response.status_code}")
+                details_response = bgg_get('thing', details_url, details_params)
+                log_bgg.info("📡 BGG: Reintento detalles %d, status: %s", intento + 1, details_response.status_code)
                 if details_response.status_code == 200:
                     break
             if details_response.status_code != 200:
-                print("❌ BGG: No se obtuvo respuesta 200 tras reintentos en detalles.")
+                log_bgg.warning("❌ BGG: No se obtuvo respuesta 200 tras reintentos en detalles.")
                 return None
         
         if details_response.status_code != 200:
-            print(f"❌ BGG: Error en detalles (status {details_response.status_code})")
+            log_bgg.warning("❌ BGG: Error en detalles (status %s)", details_response.status_code)
             return None
         
         details_root = ET.fromstring(details_response.content)
@@ -1086,7 +3769,7 @@ async def buscar_juego_bgg(nombre_juego: str) -> dict:
         # 🆕 Descripción
         description_elem = item.find('.//description')
         description_raw = description_elem.text if description_elem is not None else ""
-        description_summary = await resumir_descripcion_bgg(description_raw) if description_raw else "Sin descripción disponible"
+        description_summary = await resumir_descripcion_bgg(description_raw, chat_id, comando) if description_raw else "Sin descripción disponible"
         
         # 🆕 Mecánicas
         mechanics_list = []
@@ -1137,43 +3820,367 @@ async def buscar_juego_bgg(nombre_juego: str) -> dict:
         }
         
         # Guardar en caché
-        conn = sqlite3.connect(DB_NAME)
+        conn = conectar_global()
         cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO bgg_cache_v2 
-            (game_name, bgg_id, image_url, min_players, max_players, best_players, 
-             playtime, weight, year_published, rank, bgg_link, description, mechanics, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (nombre_juego, game_data['bgg_id'], game_data['image_url'], 
-              game_data['min_players'], game_data['max_players'], game_data['best_players'],
-              game_data['playtime'], game_data['weight'], game_data['year'], 
-              game_data['rank'], game_data['link'], game_data['description'], 
-              game_data['mechanics'], datetime.now()))
-        conn.commit()
+        with DB_DURACION.medir('bgg_cache_guardar'):
+            cursor.execute('''
+                INSERT OR REPLACE INTO bgg_cache_v2 
+                (game_name, bgg_id, image_url, min_players, max_players, best_players, 
+                 playtime, weight, year_published, rank, bgg_link, description, mechanics, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (nombre_juego, game_data['bgg_id'], game_data['image_url'], 
+                  game_data['min_players'], game_data['max_players'], game_data['best_players'],
+                  game_data['playtime'], game_data['weight'], game_data['year'], 
+                  game_data['rank'], game_data['link'], game_data['description'], 
+                  game_data['mechanics'], datetime.now()))
+            conn.commit()
         conn.close()
         
         return game_data
         
     except Exception as e:
-        print(f"❌ BGG ERROR COMPLETO: {type(e).__name__}: {str(e)}")
-        import traceback
-        print(f"📍 BGG Traceback: {traceback.format_exc()}")
+        log_bgg.exception("❌ BGG: %s: %s", type(e).__name__, e)
         return None
 
+# ============================
+# PRECARGA DE BGG (juegos mencionados en el chat)
+# ============================
+
+# Quien escribe "¿echamos un Ark Nova?" suele pedir /datos Ark Nova justo después.
+# Los nombres de juegos conocidos (los de bgg_cache_v2 y, opcionalmente, los de un
+# catálogo local) se buscan en los mensajes nuevos y los que no están en caché se
+# bajan en segundo plano, respetando el rate limit de BGG. Desactivada por defecto:
+# además de tráfico a BGG gasta tokens de OpenAI en juegos que quizá nadie pida.
+BGG_PRECARGA = os.environ.get('BGG_PRECARGA', '0') == '1'
+# Fichero de texto con un nombre de juego por línea (opcional)
+BGG_CATALOGO = os.environ.get('BGG_CATALOGO', '')
+# Segundos entre dos juegos precargados: /datos siempre va primero
+BGG_PRECARGA_PAUSA_S = float(os.environ.get('BGG_PRECARGA_PAUSA_S', '30'))
+BGG_PRECARGA_MIN_LETRAS = 4  # Nombres más cortos dan demasiados falsos positivos
+BGG_PRECARGA_PENDIENTES = 1000  # Textos en espera; si se llena se pierden los más antiguos
+BGG_PRECARGA_REINTENTO_S = 24 * 3600  # Un juego no se vuelve a intentar antes
+BGG_PRECARGA_RECARGA_S = 3600  # Cada cuánto se reconstruye el autómata con los nombres nuevos
+BGG_PRECARGA_ESPERA_DATOS_S = 60  # Lo más que espera /datos a una precarga del mismo juego
+
+BGG_PRECARGAS = Contador(
+    'bot_bgg_precarga_total',
+    'Juegos mencionados por resultado de la precarga: cargado, no_encontrado, en_cache, sin_presupuesto',
+    ('resultado',)
+)
+
+SIN_ACENTOS = str.maketrans('áàäâéèëêíìïîóòöôúùüûñç', 'aaaaeeeeiiiioooouuuunc')
+NO_ALFANUMERICOS = re.compile(r'[\W_]+')
+
+def normalizar_nombre(nombre: str) -> str:
+    """
+    Minúsculas, sin tildes y cada tramo de espacios o signos como un solo
+    espacio: "Catan:  Starfarers" y "catan starfarers" quedan iguales
+    """
+    return NO_ALFANUMERICOS.sub(' ', nombre.lower().translate(SIN_ACENTOS)).strip()
+
+class AutomataNombres:
+    """
+    Autómata de Aho-Corasick sobre nombres de juegos: encuentra en una sola
+    pasada por el texto todos los nombres que aparecen, sin importar cuántos
+    haya. Solo cuentan las apariciones como palabras completas.
+    """
+    
+    def __init__(self, nombres):
+        self.nombres = {}  # normalizado -> nombre original
+        self.hijos = [{}]
+        self.fallo = [0]
+        self.salida = [()]
+        
+        for nombre in nombres:
+            clave = normalizar_nombre(nombre)
+            if len(clave) < BGG_PRECARGA_MIN_LETRAS or clave in self.nombres:
+                continue
+            self.nombres[clave] = nombre.strip()
+            nodo = 0
+            for caracter in clave:
+                siguiente = self.hijos[nodo].get(caracter)
+                if siguiente is None:
+                    siguiente = len(self.hijos)
+                    self.hijos[nodo][caracter] = siguiente
+                    self.hijos.append({})
+                    self.fallo.append(0)
+                    self.salida.append(())
+                nodo = siguiente
+            self.salida[nodo] = (clave,)
+        
+        # Enlaces de fallo por anchura: el sufijo más largo que también es prefijo
+        cola = deque(self.hijos[0].values())
+        while cola:
+            nodo = cola.popleft()
+            for caracter, hijo in self.hijos[nodo].items():
+                cola.append(hijo)
+                fallo = self.fallo[nodo]
+                while fallo and caracter not in self.hijos[fallo]:
+                    fallo = self.fallo[fallo]
+                self.fallo[hijo] = self.hijos[fallo].get(caracter, 0)
+                self.salida[hijo] += self.salida[self.fallo[hijo]]
+    
+    def buscar(self, texto: str) -> set:
+        """Nombres (originales) que aparecen en `texto` (normalizado como los nombres)"""
+        texto = normalizar_nombre(texto)
+        encontrados = set()
+        hijos, fallo, salida = self.hijos, self.fallo, self.salida
+        nodo = 0
+        for i, caracter in enumerate(texto):
+            while nodo and caracter not in hijos[nodo]:
+                nodo = fallo[nodo]
+            nodo = hijos[nodo].get(caracter, 0)
+            for clave in salida[nodo]:
+                inicio = i - len(clave) + 1
+                if (inicio == 0 or not texto[inicio - 1].isalnum()) and \
+                        (i + 1 == len(texto) or not texto[i + 1].isalnum()):
+                    encontrados.add(self.nombres[clave])
+        return encontrados
+    
+    def menciones(self, textos: list) -> dict:
+        """nombre -> chat_id del primer mensaje que lo menciona, para una lista de (chat_id, texto)"""
+        resultado = {}
+        for chat_id, texto in textos:
+            for nombre in self.buscar(texto):
+                resultado.setdefault(nombre, chat_id)
+        return resultado
+
+def cargar_automata_juegos() -> AutomataNombres:
+    """Autómata con los nombres de bgg_cache_v2 y los del catálogo BGG_CATALOGO"""
+    conn = conectar_global()
+    nombres = [fila[0] for fila in conn.execute('SELECT game_name FROM bgg_cache_v2') if fila[0]]
+    conn.close()
+    if BGG_CATALOGO:
+        try:
+            with open(BGG_CATALOGO, encoding='utf-8') as f:
+                nombres += [linea.strip() for linea in f if linea.strip() and not linea.startswith('#')]
+        except OSError as e:
+            log_bgg.warning("⚠️ No se pudo leer el catálogo de juegos %s: %s", BGG_CATALOGO, e)
+    return AutomataNombres(nombres)
+
+def juego_en_cache_bgg(nombre_juego: str) -> bool:
+    conn = conectar_global()
+    fila = conn.execute('''
+        SELECT 1 FROM bgg_cache_v2
+        WHERE game_name = ? COLLATE NOCASE
+        AND timestamp > ?
+    ''', (nombre_juego, datetime.now() - BGG_CACHE_VIGENCIA)).fetchone()
+    conn.close()
+    return fila is not None
+
+class PrecargaBGG:
+    """
+    Precarga de baja prioridad. La ingesta solo apunta el texto (observar);
+    la tarea de fondo busca los nombres en lotes y baja los juegos de uno en
+    uno, con BGG_PRECARGA_PAUSA_S entre juegos y sin empezar ninguno mientras
+    haya un /datos en curso. Un /datos del juego que se está precargando
+    espera a que termine (esperar) y se sirve de la caché.
+    """
+    
+    def __init__(self, max_pendientes: int):
+        self.textos = deque(maxlen=max_pendientes)  # (chat_id, texto)
+        self.automata = None
+        self.cargado_en = 0.0
+        self.en_curso = {}  # nombre normalizado -> asyncio.Event
+        self.intentados = {}  # nombre normalizado -> time.monotonic() del último intento
+        self.datos_en_curso = 0
+    
+    def observar(self, chat_id: int, texto: str):
+        self.textos.append((chat_id, texto))
+    
+    async def esperar(self, nombre_juego: str):
+        evento = self.en_curso.get(normalizar_nombre(nombre_juego))
+        if evento is None:
+            return
+        try:
+            await asyncio.wait_for(evento.wait(), BGG_PRECARGA_ESPERA_DATOS_S)
+        except asyncio.TimeoutError:
+            pass
+    
+    async def ejecutar(self):
+        while True:
+            try:
+                await self.ronda()
+            except Exception as e:
+                log_bgg.exception("⚠️ Error en la precarga de BGG: %s", e)
+            await asyncio.sleep(1)
+    
+    async def ronda(self):
+        """Procesa los textos pendientes y precarga los juegos nuevos que mencionan"""
+        if self.automata is None or time.monotonic() - self.cargado_en > BGG_PRECARGA_RECARGA_S:
+            self.automata = await asyncio.to_thread(cargar_automata_juegos)
+            self.cargado_en = time.monotonic()
+        if not self.textos:
+            return
+        lote = [self.textos.popleft() for _ in range(len(self.textos))]
+        menciones = await asyncio.to_thread(self.automata.menciones, lote)
+        for nombre, chat_id in menciones.items():
+            await self.precargar(nombre, chat_id)
+    
+    async def precargar(self, nombre_juego: str, chat_id: int):
+        clave = normalizar_nombre(nombre_juego)
+        ahora = time.monotonic()
+        if clave in self.intentados and ahora - self.intentados[clave] < BGG_PRECARGA_REINTENTO_S:
+            return
+        self.intentados[clave] = ahora
+        ID_PETICION.set(f"precarga:{clave}")
+        
+        # /datos primero
+        while self.datos_en_curso:
+            await asyncio.sleep(1)
+        
+        if await asyncio.to_thread(juego_en_cache_bgg, nombre_juego):
+            BGG_PRECARGAS.inc('en_cache')
+            return
+        # Con el presupuesto de IA del chat justo no se gasta en lo que quizá nadie pida
+        if await asyncio.to_thread(modo_presupuesto, chat_id) != 'normal':
+            BGG_PRECARGAS.inc('sin_presupuesto')
+            return
+        
+        # En un hilo del proceso principal, no en el pool: no quita sitio a /resumen.
+        # El rate limit de bgg_get() se comparte con los /datos del pool (turno_bgg)
+        evento = self.en_curso[clave] = asyncio.Event()
+        try:
+            log_bgg.info("🔮 Precargando '%s' (mencionado en %s)", nombre_juego, chat_id, extra={'chat_id': chat_id})
+            juego = await asyncio.to_thread(trabajo_bgg, nombre_juego, chat_id, 'precarga_bgg')
+        finally:
+            evento.set()
+            del self.en_curso[clave]
+        BGG_PRECARGAS.inc('cargado' if juego else 'no_encontrado')
+        await asyncio.sleep(BGG_PRECARGA_PAUSA_S)
+
+PRECARGA_BGG = PrecargaBGG(BGG_PRECARGA_PENDIENTES)
+
+# ============================
+# PROCESOS DE TRABAJO
+# ============================
+
+# Nº de procesos para resúmenes y BGG ('auto' = un proceso por núcleo).
+# Con 0 los trabajos se ejecutan en hilos del propio proceso.
+PROCESOS_TRABAJO = os.environ.get('PROCESOS_TRABAJO', '0')
+POOL_TRABAJO = None
+
+TRABAJOS_PENDIENTES = Indicador(
+    'bot_trabajos_pendientes',
+    'Trabajos de resumen/BGG encolados o en ejecución',
+    ('trabajo',)
+)
+
+def iniciar_pool_trabajo():
+    """Crea el pool de procesos si PROCESOS_TRABAJO lo pide"""
+    global POOL_TRABAJO
+    if PROCESOS_TRABAJO == 'auto':
+        procesos = os.cpu_count() or 1
+    else:
+        procesos = int(PROCESOS_TRABAJO)
+    if procesos > 0 and POOL_TRABAJO is None:
+        # 'spawn': los hijos no heredan el event loop ni los hilos del proceso principal
+        POOL_TRABAJO = ProcessPoolExecutor(
+            max_workers=procesos,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_iniciar_trabajador,
+            initargs=(ritmo_bgg(),)
+        )
+        log.info("⚙️ Pool de trabajo con %d proceso(s)", procesos)
+
+def detener_pool_trabajo():
+    global POOL_TRABAJO
+    if POOL_TRABAJO is not None:
+        POOL_TRABAJO.shutdown(wait=False, cancel_futures=True)
+        POOL_TRABAJO = None
+
+def _iniciar_trabajador(ritmo):
+    """Al arrancar cada proceso del pool: comparte el rate limit de BGG del proceso principal"""
+    global _bgg_ritmo
+    _bgg_ritmo = ritmo
+
+def _exportar_metricas() -> dict:
+    """Saca (y reinicia) las series acumuladas en un proceso de trabajo"""
+    delta = {}
+    for metrica in METRICAS:
+        if isinstance(metrica, (Contador, Histograma)) and metrica.series:
+            delta[metrica.nombre] = metrica.series
+            metrica.series = {}
+    return delta
+
+def _fusionar_metricas(delta: dict):
+    """Suma en el proceso principal las métricas medidas por un trabajador"""
+    por_nombre = {metrica.nombre: metrica for metrica in METRICAS}
+    for nombre, series in delta.items():
+        metrica = por_nombre.get(nombre)
+        for valores, valor in series.items():
+            if isinstance(metrica, Contador):
+                metrica.inc(*valores, cantidad=valor)
+            elif isinstance(metrica, Histograma):
+                actual = metrica.series.setdefault(valores, [0] * len(valor))
+                for i, x in enumerate(valor):
+                    actual[i] += x
+
+def _ejecutar_en_trabajador(funcion, args: tuple, id_peticion: str = '-'):
+    """Punto de entrada en el proceso hijo: resultado + métricas medidas allí"""
+    configurar_logs(en_segundo_plano=False)
+    ID_PETICION.set(id_peticion)
+    return funcion(*args), _exportar_metricas()
+
+async def en_trabajador(funcion, *args):
+    """
+    Ejecuta un trabajo pesado (función síncrona de nivel de módulo) fuera del
+    event loop: en el pool de procesos si está activo, si no en un hilo.
+    La cola de trabajos es la del propio executor.
+    """
+    nombre = funcion.__name__
+    TRABAJOS_PENDIENTES.fijar(TRABAJOS_PENDIENTES.series.get((nombre,), 0) + 1, nombre)
+    try:
+        if POOL_TRABAJO is None:
+            return await asyncio.to_thread(funcion, *args)
+        
+        loop = asyncio.get_running_loop()
+        resultado, metricas = await loop.run_in_executor(
+            POOL_TRABAJO, _ejecutar_en_trabajador, funcion, args, ID_PETICION.get()
+        )
+        _fusionar_metricas(metricas)
+        return resultado
+    finally:
+        TRABAJOS_PENDIENTES.fijar(TRABAJOS_PENDIENTES.series[(nombre,)] - 1, nombre)
+
+def trabajo_resumen(chat_id: int, fecha_limite: datetime, horas: float, rapido: bool = False,
+                    comando: str = 'resumen', tema=TODOS_LOS_TEMAS) -> tuple:
+    """Trabajo: consulta los mensajes (del tema, o de todos) y genera el resumen. Devuelve (nº mensajes, texto)"""
+    mensajes = obtener_mensajes_db(chat_id, fecha_limite, tema)
+    if not mensajes:
+        return 0, None
+    if rapido:
+        return len(mensajes), resumen_extractivo(mensajes, horas)
+    
+    # 💸 Presupuesto diario del chat: cerca del límite, modo ahorro; agotado, sin IA
+    modo = modo_presupuesto(chat_id, previsto=RESUMEN_MAX_TOKENS + 1000)
+    PRESUPUESTO_MODOS.inc(modo)
+    if modo == 'agotado':
+        return len(mensajes), (
+            "⚠️ _El grupo ha gastado su presupuesto diario de IA; este es el resumen rápido sin IA._\n\n"
+            + resumen_extractivo(mensajes, horas)
+        )
+    return len(mensajes), asyncio.run(generar_resumen(mensajes, horas, chat_id, comando, modo == 'ahorro'))
+
+def trabajo_bgg(nombre_juego: str, chat_id: int = 0, comando: str = 'datos'):
+    """Trabajo: búsqueda completa en BGG (HTTP, rate limit, XML, caché)"""
+    return asyncio.run(buscar_juego_bgg(nombre_juego, chat_id, comando))
+
 async def datos_juego(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /datos - Busca información de un juego en BGG"""
     user = update.effective_user
     chat_id = update.effective_chat.id
-    print(f"🎮 /datos ejecutado por @{user.username or user.first_name} en chat {chat_id}")
+    log.info("🎮 /datos ejecutado por @%s en chat %s", user.username or user.first_name, chat_id,
+             extra={'chat_id': chat_id, 'user_id': user.id})
     
     # Verificar acceso del grupo
     if update.effective_chat.type in ['group', 'supergroup']:
         if not verificar_acceso(update.effective_chat.id):
-            print(f"🚫 /datos: Acceso denegado para chat {chat_id}")
+            log.info("🚫 /datos: Acceso denegado para chat %s", chat_id)
             return
     
     if not context.args:
-        print(f"⚠️ /datos: Sin argumentos")
+        log.debug("⚠️ /datos: Sin argumentos")
         await update.message.reply_text(
             "⚠️ <b>Uso:</b> /datos <i>nombre del juego</i>\n\n"
             "<b>Ejemplos:</b>\n"
@@ -1185,15 +4192,31 @@ async def datos_juego(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     nombre_juego = ' '.join(context.args)
-    print(f"🎲 /datos: Buscando '{nombre_juego}'")
+    log.debug("🎲 /datos: Buscando '%s'", nombre_juego)
     
-    await update.message.reply_text(
-        f"🔍 Buscando <b>{nombre_juego}</b> en BoardGameGeek...",
-        parse_mode='HTML'
-    )
+    # 🚦 Cuotas por usuario/chat y cola global de comandos caros
+    turno = await ADMISION.solicitar(update, 'datos')
+    if turno is None:
+        return
     
-    juego = await buscar_juego_bgg(nombre_juego)
-    print(f"📦 /datos: Resultado búsqueda = {juego is not None}")
+    try:
+        await update.message.reply_text(
+            f"🔍 Buscando <b>{nombre_juego}</b> en BoardGameGeek...",
+            parse_mode='HTML'
+        )
+        
+        # Peticiones HTTP, pausa de rate limit y parseo XML fuera del event loop
+        async with turno:
+            # 🔮 Si se está precargando este juego, se espera y sale de la caché
+            await PRECARGA_BGG.esperar(nombre_juego)
+            PRECARGA_BGG.datos_en_curso += 1
+            try:
+                juego = await en_trabajador(trabajo_bgg, nombre_juego, chat_id)
+            finally:
+                PRECARGA_BGG.datos_en_curso -= 1
+    finally:
+        turno.liberar()
+    log.debug("📦 /datos: Resultado búsqueda = %s", juego is not None)
     
     if not juego:
         await update.message.reply_text(
@@ -1247,38 +4270,637 @@ async def datos_juego(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Si falla la imagen, enviar solo texto
         await update.message.reply_text(mensaje, parse_mode='HTML', disable_web_page_preview=False)
 
-def main():
-    """Función principal"""
+# ============================
+# ENVÍOS A TELEGRAM (límites de flood)
+# ============================
+
+# Límites de la Bot API: ~30 mensajes/s en total, 20/min por grupo y ~1/s por chat
+ENVIO_GLOBAL_POR_S = float(os.environ.get('ENVIO_GLOBAL_POR_S', '30'))
+ENVIO_GRUPO_POR_MIN = float(os.environ.get('ENVIO_GRUPO_POR_MIN', '20'))
+ENVIO_INTERVALO_CHAT_S = float(os.environ.get('ENVIO_INTERVALO_CHAT_S', '1.0'))
+ENVIO_REINTENTOS = int(os.environ.get('ENVIO_REINTENTOS', '3'))
+
+MAX_LONGITUD_MENSAJE = 4096  # Caracteres UTF-16 por mensaje de texto
+
+# Llamadas que publican algo en un chat y cuentan para los límites
+PREFIJOS_ENVIO = ('send', 'edit', 'forward', 'copy')
+
+ENVIO_ESPERA = Histograma(
+    'bot_envio_espera_segundos',
+    'Tiempo que un envío pasa en la cola saliente antes de salir'
+)
+ENVIO_FLOOD = Contador(
+    'bot_envio_flood_total',
+    'Respuestas RetryAfter de Telegram (flood control)'
+)
+ENVIO_COLA = Indicador(
+    'bot_envio_cola',
+    'Envíos pendientes en la cola saliente'
+)
+ENVIO_SIN_FORMATO = Contador(
+    'bot_envio_sin_formato_total',
+    'Envíos repetidos sin parse_mode porque Telegram no pudo leer su formato'
+)
+
+def _longitud_telegram(texto: str) -> int:
+    """Telegram cuenta la longitud en unidades UTF-16 (un emoji puede valer 2)"""
+    return len(texto.encode('utf-16-le')) // 2
+
+# Lo que abre una entidad en Markdown (v1) fuera de otra: \ escapa el siguiente carácter
+_MARCA_MARKDOWN = re.compile(r'\\|```|[`*_\[]')
+
+def _markdown_abierto(texto: str) -> tuple:
+    """
+    Entidad de Markdown (v1) que queda abierta al final de `texto`:
+    (marca, posición) con marca '```', '`', '*', '_' o '[' (enlace), o ('', -1).
+    En este Markdown las entidades no se anidan.
+    """
+    i = 0
+    while True:
+        encontrada = _MARCA_MARKDOWN.search(texto, i)
+        if encontrada is None:
+            return '', -1
+        marca, inicio = encontrada.group(), encontrada.start()
+        if marca == '\\':
+            i = inicio + 2
+            continue
+        if marca == '[':
+            cierre = texto.find('](', inicio + 1)
+            fin = texto.find(')', cierre + 2) if cierre >= 0 else -1
+        else:
+            fin = texto.find(marca, inicio + len(marca))
+        if fin < 0:
+            return marca, inicio
+        i = fin + 1 if marca == '[' else fin + len(marca)
+
+def partir_mensaje(texto: str, limite: int = MAX_LONGITUD_MENSAJE, parse_mode: str = None) -> list:
+    """
+    Parte un texto largo en trozos de `limite`, cortando por párrafo, línea o espacio.
+    Con parse_mode='Markdown', la negrita, cursiva o código que quede abierta en
+    un corte se cierra al final del trozo y se vuelve a abrir en el siguiente, y
+    los enlaces no se parten: cada trozo tiene que poder leerse por separado.
+    """
+    markdown = parse_mode == 'Markdown'
+    reserva = 3 if markdown else 0  # Sitio para cerrar un ```
+    partes = []
+    while _longitud_telegram(texto) > limite:
+        n = limite - reserva
+        while _longitud_telegram(texto[:n]) > limite - reserva:
+            n -= _longitud_telegram(texto[:n]) - (limite - reserva)
+        
+        corte = n
+        for separador in ('\n\n', '\n', ' '):
+            posicion = texto.rfind(separador, 0, n)
+            if posicion > n // 2:
+                corte = posicion
+                break
+        
+        parte = texto[:corte].rstrip()
+        resto = texto[corte:].lstrip()
+        if markdown:
+            marca, inicio = _markdown_abierto(parte)
+            if marca and inicio > 0 and (marca == '[' or not parte[inicio + len(marca):].strip()):
+                # Un enlace, o una marca sin nada detrás: el corte pasa a antes de la marca
+                parte, resto = texto[:inicio].rstrip(), texto[inicio:]
+            elif marca and marca != '[':
+                # Tras ``` lo que sigue en la misma línea sería el lenguaje
+                parte, resto = parte + marca, marca + ('\n' if marca == '```' else '') + resto
+        partes.append(parte)
+        texto = resto
+    partes.append(texto)
+    return [parte for parte in partes if parte]
+
+class VentanaDeslizante:
+    """Como mucho `limite` eventos en cualquier intervalo de `ventana_s` (el límite exacto de Telegram)"""
     
-    if not TELEGRAM_TOKEN:
-        print("❌ Error: Define TELEGRAM_BOT_TOKEN en las variables de entorno")
-        return
+    __slots__ = ('limite', 'ventana_s', 'instantes')
     
-    if not OPENAI_API_KEY:
-        print("❌ Error: Define OPENAI_API_KEY en las variables de entorno")
-        return
+    def __init__(self, limite: int, ventana_s: float):
+        self.limite = max(1, limite)
+        self.ventana_s = ventana_s
+        self.instantes = deque()
     
-    # Inicializar base de datos
-    inicializar_db()
+    def espera(self, ahora: float) -> float:
+        """Segundos hasta que quepa otro evento (0 si ya cabe). No consume."""
+        instantes = self.instantes
+        while instantes and instantes[0] <= ahora - self.ventana_s:
+            instantes.popleft()
+        if len(instantes) < self.limite:
+            return 0.0
+        return instantes[0] + self.ventana_s - ahora
     
-    # Iniciar servidor web en background (para Render)
-    Thread(target=run_health_server, daemon=True).start()
+    def consumir(self, ahora: float):
+        self.instantes.append(ahora)
+    
+    def vacia(self, ahora: float) -> bool:
+        return not self.instantes or self.instantes[-1] <= ahora - self.ventana_s
+
+class Envio:
+    __slots__ = ('callback', 'args', 'kwargs', 'futuro', 'encolado', 'reintentos')
+    
+    def __init__(self, callback, args, kwargs):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.futuro = asyncio.get_running_loop().create_future()
+        self.encolado = time.monotonic()
+        self.reintentos = 0
+
+class LimitadorEnvios(BaseRateLimiter):
+    """
+    Cola central de envíos: todas las llamadas de la Bot API pasan por aquí
+    (reply_text, send_message, reply_photo... no hay que cambiar los handlers).
+    
+    - Cada chat tiene su cola FIFO y como mucho un envío en vuelo, separado del
+      anterior ENVIO_INTERVALO_CHAT_S; los grupos además tienen una ventana de
+      ENVIO_GRUPO_POR_MIN mensajes por minuto.
+    - Una ventana global reparte ENVIO_GLOBAL_POR_S entre todos los chats, que salen
+      en paralelo: el rendimiento llega al límite sin pasarse.
+    - Un RetryAfter solo pausa la cola de su chat y el envío se reintenta
+      después: ni el resto de chats ni el event loop esperan.
+    - Las llamadas que no publican en un chat (getChatMember, getMe...) no
+      tienen cola: un RetryAfter pausa ese método de la API para todos, y quien
+      lo llame mientras tanto espera en su propio handler (con asyncio.sleep,
+      sin bloquear el event loop) antes de hacer la llamada.
+    - Los sendMessage de más de 4096 caracteres se parten en varios mensajes
+      que salen seguidos y en orden.
+    """
+    
+    def __init__(self, global_por_s: float, grupo_por_min: float, intervalo_chat_s: float, reintentos: int):
+        self.global_por_s = global_por_s
+        self.grupo_por_min = grupo_por_min
+        self.intervalo_chat_s = intervalo_chat_s
+        self.reintentos = reintentos
+        self._colas = {}  # chat_id -> deque de Envio (existe mientras el chat tiene envíos)
+        self._listos = []  # heap (instante, secuencia, chat_id) de chats esperando turno
+        self._siguiente = {}  # chat_id -> instante mínimo del próximo envío
+        self._pausas = {}  # endpoint sin cola -> instante hasta el que Telegram pidió esperar
+        self._ventanas_grupo = {}
+        self._ventana_global = None
+        self._secuencia = count()
+        self._despertar = None
+        self._tarea = None
+    
+    def pendientes(self) -> int:
+        return sum(len(cola) for cola in self._colas.values())
+    
+    async def initialize(self):
+        self._despertar = asyncio.Event()
+        self._ventana_global = VentanaDeslizante(int(self.global_por_s), 1.0)
+        self._tarea = asyncio.create_task(self._despachar())
+    
+    async def shutdown(self):
+        if self._tarea:
+            self._tarea.cancel()
+            self._tarea = None
+        for cola in self._colas.values():
+            for envio in cola:
+                if not envio.futuro.done():
+                    envio.futuro.cancel()
+        self._colas.clear()
+        self._listos.clear()
+    
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if RESPUESTA_SIN_CITA.get() and ('reply_parameters' in data or 'reply_to_message_id' in data):
+            # Comando antiguo (ver PUESTA AL DÍA): se contesta sin citar su mensaje
+            data = {k: v for k, v in data.items() if k not in ('reply_parameters', 'reply_to_message_id')}
+            args = (endpoint, data)
+        
+        chat_id = data.get('chat_id')
+        if chat_id is None or not endpoint.startswith(PREFIJOS_ENVIO) or self._tarea is None:
+            return await self._directo(endpoint, callback, args, kwargs)
+        
+        texto = data.get('text')
+        if endpoint == 'sendMessage' and isinstance(texto, str) and _longitud_telegram(texto) > MAX_LONGITUD_MENSAJE:
+            # Se encolan todas las partes a la vez para que nada se cuele entre ellas;
+            # solo la primera responde al mensaje original y solo la última lleva botones
+            partes = partir_mensaje(texto, parse_mode=data.get('parse_mode'))
+            envios = []
+            for i, parte in enumerate(partes):
+                datos_parte = dict(data, text=parte)
+                if i > 0:
+                    datos_parte.pop('reply_parameters', None)
+                    datos_parte.pop('reply_to_message_id', None)
+                if i < len(partes) - 1:
+                    datos_parte.pop('reply_markup', None)
+                envios.append(self._encolar(chat_id, Envio(callback, (endpoint, datos_parte), kwargs)))
+            resultado = None
+            for envio in envios:
+                resultado = await envio.futuro
+            return resultado
+        
+        return await self._encolar(chat_id, Envio(callback, args, kwargs)).futuro
+    
+    async def _directo(self, endpoint, callback, args, kwargs):
+        """
+        Llamadas que no publican en un chat (getChatMember, getMe...): sin cola.
+        La pausa de un RetryAfter es por método y la respetan todas las llamadas a
+        ese método, no solo la que lo recibió; la espera es la del handler que llama.
+        """
+        for intento in range(self.reintentos + 1):
+            espera = self._pausas.get(endpoint, 0) - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                ENVIO_FLOOD.inc()
+                log_telegram.warning("🌊 Flood control en %s: pausado %ss", endpoint, e.retry_after)
+                self._pausas[endpoint] = max(self._pausas.get(endpoint, 0),
+                                             time.monotonic() + float(e.retry_after) + 0.1)
+                if intento == self.reintentos:
+                    raise
+    
+    def _encolar(self, chat_id, envio: Envio) -> Envio:
+        cola = self._colas.get(chat_id)
+        if cola is None:
+            # Chat sin envíos pendientes ni en vuelo: entra al heap
+            self._colas[chat_id] = deque([envio])
+            self._programar(chat_id)
+        else:
+            cola.append(envio)
+        return envio
+    
+    def _programar(self, chat_id):
+        ahora = time.monotonic()
+        if len(self._siguiente) > 10_000:
+            self._siguiente = {k: t for k, t in self._siguiente.items() if t > ahora}
+        instante = max(ahora, self._siguiente.pop(chat_id, ahora))
+        heapq.heappush(self._listos, (instante, next(self._secuencia), chat_id))
+        self._despertar.set()
+    
+    def _ventana_grupo(self, chat_id):
+        # Grupos y canales tienen id negativo (o @nombre); los privados solo el intervalo
+        if isinstance(chat_id, int) and chat_id > 0:
+            return None
+        ventana = self._ventanas_grupo.get(chat_id)
+        if ventana is None:
+            if len(self._ventanas_grupo) >= 10_000:
+                ahora = time.monotonic()
+                self._ventanas_grupo = {k: v for k, v in self._ventanas_grupo.items() if not v.vacia(ahora)}
+            ventana = self._ventanas_grupo[chat_id] = VentanaDeslizante(int(self.grupo_por_min), 60.0)
+        return ventana
+    
+    async def _despachar(self):
+        while True:
+            if not self._listos:
+                self._despertar.clear()
+                await self._despertar.wait()
+                continue
+            
+            instante, _, chat_id = self._listos[0]
+            ahora = time.monotonic()
+            espera = instante - ahora
+            if espera <= 0:
+                espera = self._ventana_global.espera(ahora)
+            if espera > 0:
+                # Se despierta antes si entra un chat nuevo (puede estar listo ya)
+                self._despertar.clear()
+                try:
+                    await asyncio.wait_for(self._despertar.wait(), espera)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            heapq.heappop(self._listos)
+            cola = self._colas[chat_id]
+            while cola and cola[0].futuro.done():
+                cola.popleft()  # El handler que lo pidió ya no espera (cancelado)
+            if not cola:
+                del self._colas[chat_id]
+                continue
+            
+            ventana = self._ventana_grupo(chat_id)
+            if ventana is not None:
+                espera = ventana.espera(ahora)
+                if espera:
+                    heapq.heappush(self._listos, (ahora + espera, next(self._secuencia), chat_id))
+                    continue
+                ventana.consumir(ahora)
+            self._ventana_global.consumir(ahora)
+            
+            envio = cola.popleft()
+            ENVIO_ESPERA.observar(ahora - envio.encolado)
+            asyncio.create_task(self._ejecutar(chat_id, envio))
+    
+    async def _ejecutar(self, chat_id, envio: Envio):
+        """Hace la llamada y, al terminar, devuelve el chat al heap si le quedan envíos"""
+        self._siguiente[chat_id] = time.monotonic() + self.intervalo_chat_s
+        try:
+            resultado = await envio.callback(*envio.args, **envio.kwargs)
+        except RetryAfter as e:
+            ENVIO_FLOOD.inc()
+            log_telegram.warning("🌊 Flood control en chat %s: reintento en %ss", chat_id, e.retry_after,
+                                 extra={'chat_id': chat_id})
+            self._siguiente[chat_id] = time.monotonic() + float(e.retry_after) + 0.1
+            if envio.reintentos < self.reintentos and not envio.futuro.done():
+                envio.reintentos += 1
+                self._colas[chat_id].appendleft(envio)
+            elif not envio.futuro.done():
+                envio.futuro.set_exception(e)
+        except BadRequest as e:
+            endpoint, datos = envio.args
+            if ("can't parse entities" in str(e).lower() and isinstance(datos, dict)
+                    and datos.get('parse_mode') and not envio.futuro.done()):
+                # Mejor el texto con los asteriscos a la vista que no enviarlo: de nuevo, en su sitio
+                ENVIO_SIN_FORMATO.inc()
+                log_telegram.warning("⚠️ Telegram no pudo leer el formato en chat %s (%s): se envía sin formato",
+                                     chat_id, e, extra={'chat_id': chat_id})
+                datos = {k: v for k, v in datos.items() if k not in ('parse_mode', 'entities')}
+                envio.args = (endpoint, datos)
+                self._colas[chat_id].appendleft(envio)
+            elif not envio.futuro.done():
+                envio.futuro.set_exception(e)
+        except Exception as e:
+            if not envio.futuro.done():
+                envio.futuro.set_exception(e)
+        else:
+            if not envio.futuro.done():
+                envio.futuro.set_result(resultado)
+        finally:
+            cola = self._colas.get(chat_id)
+            if cola:
+                self._programar(chat_id)
+            elif cola is not None:
+                del self._colas[chat_id]
+                if self._siguiente.get(chat_id, 0) <= time.monotonic():
+                    self._siguiente.pop(chat_id, None)
+
+def crear_limitador_envios() -> LimitadorEnvios:
+    limitador = LimitadorEnvios(ENVIO_GLOBAL_POR_S, ENVIO_GRUPO_POR_MIN, ENVIO_INTERVALO_CHAT_S, ENVIO_REINTENTOS)
+    ENVIO_COLA.funcion = lambda: {(): limitador.pendientes()}
+    return limitador
+
+# ============================
+# PUESTA AL DÍA (tras un reinicio o una siesta de Render)
+# ============================
+
+# Al arrancar se bajan de golpe los updates que Telegram guardó mientras el bot
+# no estaba: los mensajes de texto se guardan con una escritura por base y el
+# resto (comandos, cambios de miembros...) pasa a la cola de updates normal.
+# Con 0 el polling los procesa uno a uno como cualquier otro update.
+PUESTA_AL_DIA = os.environ.get('PUESTA_AL_DIA', '1') == '1'
+PUESTA_AL_DIA_LOTE = 100  # Updates por getUpdates (el máximo de Telegram)
+
+# Un comando enviado hace más de estos segundos es antiguo (0 = nunca): su
+# mensaje puede haberse borrado y citarlo fallaría con "Message to be replied not found".
+# COMANDOS_ANTIGUOS: 'sin_cita' (se contesta sin citar el mensaje) o 'descartar'
+COMANDO_ANTIGUEDAD_MAX_S = float(os.environ.get('COMANDO_ANTIGUEDAD_MAX_S', '300'))
+COMANDOS_ANTIGUOS = os.environ.get('COMANDOS_ANTIGUOS', 'sin_cita')
+
+# True mientras se atiende un comando antiguo (LimitadorEnvios quita la cita)
+RESPUESTA_SIN_CITA = contextvars.ContextVar('respuesta_sin_cita', default=False)
+
+PUESTA_AL_DIA_UPDATES = Contador(
+    'bot_puesta_al_dia_updates_total',
+    'Updates pendientes al arrancar por destino (lote / cola)',
+    ('destino',)
+)
+COMANDOS_ANTIGUOS_TOTAL = Contador(
+    'bot_comandos_antiguos_total',
+    'Comandos más antiguos que COMANDO_ANTIGUEDAD_MAX_S por acción (sin_cita / descartado)',
+    ('accion',)
+)
+
+def es_comando_antiguo(update: object) -> bool:
+    """Si el mensaje del update se envió hace más de COMANDO_ANTIGUEDAD_MAX_S"""
+    mensaje = update.effective_message if isinstance(update, Update) else None
+    if COMANDO_ANTIGUEDAD_MAX_S <= 0 or mensaje is None or mensaje.date is None:
+        return False
+    return (datetime.now(timezone.utc) - mensaje.date).total_seconds() > COMANDO_ANTIGUEDAD_MAX_S
+
+def guardar_mensajes_en_lote(updates: list) -> int:
+    """Guarda los mensajes con un executemany y un commit por base; devuelve cuántos se guardaron"""
+    por_base = {}  # chat_id del shard (o None con DB_MODO 'unico') -> (chat_id, filas)
+    for update in updates:
+        # La hora del mensaje, no la de ahora: pueden llevar horas esperando
+        fila = fila_mensaje(update, update.message.date.astimezone().replace(tzinfo=None))
+        if fila is None:
+            continue
+        clave = fila[0] if DB_MODO == 'por_chat' else None
+        por_base.setdefault(clave, (fila[0], []))[1].append(fila)
+        if BGG_PRECARGA:
+            PRECARGA_BGG.observar(fila[0], fila[5])
+    
+    guardados = 0
+    for chat_id, filas in por_base.values():
+        conn = conectar_chat(chat_id)
+        with DB_DURACION.medir('insertar_mensajes_lote'):
+            conn.executemany('''
+                INSERT OR IGNORE INTO mensajes 
+                (chat_id, message_id, user_id, username, first_name, texto, timestamp, respuesta_a, thread_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', filas)
+            conn.commit()
+        conn.close()
+        guardados += len(filas)
+    return guardados
+
+async def ponerse_al_dia(application: Application) -> dict:
+    """
+    Vacía los updates pendientes en Telegram antes de que empiece el polling.
+    
+    Los mensajes de texto van a guardar_mensajes_en_lote(); lo demás, en su
+    orden, a application.update_queue. Los mensajes de un chat posteriores a
+    un /borrar_* suyo también van a la cola, para que el borrado no se lleve
+    mensajes que llegaron después de él.
+    """
+    ID_PETICION.set('puesta_al_dia')
+    inicio = time.perf_counter()
+    confirmados = []
+    lote = []
+    try:
+        while True:
+            # Pedir desde el siguiente al último confirma a Telegram los ya recibidos
+            siguiente = await application.bot.get_updates(
+                offset=lote[-1].update_id + 1 if lote else None,
+                limit=PUESTA_AL_DIA_LOTE, timeout=0, allowed_updates=Update.ALL_TYPES
+            )
+            confirmados.extend(lote)
+            if not siguiente:
+                break
+            lote = siguiente
+    except TelegramError as e:
+        # El último lote no quedó confirmado: lo volverá a entregar el polling
+        log_telegram.warning("⚠️ Puesta al día interrumpida (%s): sigue el polling normal", e)
+    
+    en_lote = []
+    a_cola = []
+    chats_con_borrado = set()
+    for update in confirmados:
+        chat_id, comando = ProcesadorPorChat.clasificar(update)
+        if comando in COMANDOS_SERIALIZADOS:
+            chats_con_borrado.add(chat_id)
+        if not comando and chat_id not in chats_con_borrado and update.message and update.message.text:
+            en_lote.append(update)
+        else:
+            a_cola.append(update)
+    
+    guardados = 0
+    if en_lote:
+        try:
+            guardados = guardar_mensajes_en_lote(en_lote)
+        except Exception as e:
+            log_db.exception("❌ Error guardando mensajes pendientes en lote: %s", e)
+    for update in a_cola:
+        await application.update_queue.put(update)
+    
+    PUESTA_AL_DIA_UPDATES.inc('lote', cantidad=len(en_lote))
+    PUESTA_AL_DIA_UPDATES.inc('cola', cantidad=len(a_cola))
+    resultado = {
+        'updates': len(confirmados),
+        'mensajes_guardados': guardados,
+        'a_la_cola': len(a_cola),
+        'segundos': round(time.perf_counter() - inicio, 3),
+    }
+    if confirmados:
+        log.info("⏩ Puesta al día: %d updates pendientes, %d mensajes guardados en lote y %d a la cola en %.2fs",
+                 resultado['updates'], guardados, len(a_cola), resultado['segundos'])
+    return resultado
+
+# ============================
+# PROCESAMIENTO CONCURRENTE DE UPDATES
+# ============================
+
+# Updates procesándose a la vez (en total) y, de ellos, comandos "lentos"
+UPDATES_CONCURRENTES = int(os.environ.get('UPDATES_CONCURRENTES', '256'))
+COMANDOS_CONCURRENTES = int(os.environ.get('COMANDOS_CONCURRENTES', '8'))
+
+# Comandos que escriben en mensajes: se serializan con la ingesta de su chat
+COMANDOS_SERIALIZADOS = {'borrar_todo', 'borrar_rango'}
+
+class ProcesadorPorChat(BaseUpdateProcessor):
+    """
+    Procesa updates en paralelo manteniendo el orden dentro de cada chat.
+    
+    Los `max_updates` huecos se toman aquí y no en process_update() de PTB,
+    que los toma antes de llamar a do_process_update(): así un update que espera
+    su lock o su semáforo no ocupa un hueco, y ni una ráfaga de /stats ni la
+    cola de un chat muy activo dejan sin huecos a la ingesta de los demás.
+    
+    - Mensajes normales y comandos de borrado toman el lock FIFO de su chat
+      (y después un hueco): se guardan en el orden de llegada y un /borrar_todo
+      no se cruza con la ingesta.
+    - El resto de comandos (/stats, /help...) no toman el lock y se limitan
+      con su propio semáforo antes de pedir hueco, así nunca ocupan más de
+      `max_comandos` huecos.
+    - /resumen y /datos no toman ni ese semáforo ni hueco: su concurrencia y su
+      cola las acota el control de admisión, y mientras esperan turno no deben
+      frenar a /stats ni a la ingesta.
+    - Chats distintos avanzan en paralelo.
+    - Los comandos más antiguos que COMANDO_ANTIGUEDAD_MAX_S se descartan o se
+      contestan sin citar su mensaje, según COMANDOS_ANTIGUOS.
+    """
+    
+    # El semáforo de PTB no limita: lo que espera un lock no debe ocupar hueco
+    SIN_LIMITE = 1_000_000
+    
+    def __init__(self, max_updates: int, max_comandos: int):
+        super().__init__(self.SIN_LIMITE)
+        self._max_updates = max_updates
+        self._max_comandos = max_comandos
+        self._huecos = None
+        self._comandos = None
+        self._locks = {}  # chat_id -> [asyncio.Lock, nº de updates usándolo]
+    
+    async def initialize(self):
+        self._huecos = asyncio.Semaphore(self._max_updates)
+        self._comandos = asyncio.Semaphore(self._max_comandos)
+    
+    async def shutdown(self):
+        pass
+    
+    @staticmethod
+    def clasificar(update: object) -> tuple:
+        """Devuelve (chat_id o None, nombre del comando o '' si no es un comando)"""
+        if not isinstance(update, Update) or update.effective_chat is None:
+            return None, ''
+        
+        mensaje = update.effective_message
+        texto = (mensaje.text or '') if mensaje else ''
+        if texto.startswith('/'):
+            return update.effective_chat.id, texto.split()[0][1:].split('@')[0].lower()
+        return update.effective_chat.id, ''
+    
+    async def do_process_update(self, update: object, coroutine):
+        chat_id, comando = self.clasificar(update)
+        
+        testigo = None
+        if comando and es_comando_antiguo(update):
+            if COMANDOS_ANTIGUOS == 'descartar':
+                COMANDOS_ANTIGUOS_TOTAL.inc('descartado')
+                log.info("⏭️ /%s antiguo descartado", comando, extra={'chat_id': chat_id})
+                coroutine.close()
+                return
+            COMANDOS_ANTIGUOS_TOTAL.inc('sin_cita')
+            testigo = RESPUESTA_SIN_CITA.set(True)
+        try:
+            await self._procesar(chat_id, comando, coroutine)
+        finally:
+            if testigo is not None:
+                RESPUESTA_SIN_CITA.reset(testigo)
     
-    # Crear aplicación
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    async def _procesar(self, chat_id, comando: str, coroutine):
+        if comando in COMANDOS_CON_ADMISION:
+            await coroutine
+            return
+        
+        if comando and comando not in COMANDOS_SERIALIZADOS:
+            async with self._comandos, self._huecos:
+                await coroutine
+            return
+        
+        if chat_id is None:
+            async with self._huecos:
+                await coroutine
+            return
+        
+        entrada = self._locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        try:
+            async with entrada[0], self._huecos:
+                await coroutine
+        finally:
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                del self._locks[chat_id]
+
+def construir_aplicacion(builder) -> Application:
+    """
+    Crea la aplicación a partir de un builder y registra todos los handlers.
+    main() la usa con el token real; el arnés de carga (benchmarks.replay)
+    con un bot falso, para ejecutar exactamente los mismos handlers.
+    El limitador de envíos va en el bot (builder.rate_limiter o ExtBot(rate_limiter=...)).
+    """
+    application = (
+        builder
+        .concurrent_updates(ProcesadorPorChat(UPDATES_CONCURRENTES, COMANDOS_CONCURRENTES))
+        .post_init(tareas_inicio)
+        .build()
+    )
+    
+    # 📈 Profundidad de la cola de updates pendientes (para /metrics)
+    COLA_INGESTA.funcion = lambda: {(): application.update_queue.qsize()}
     
     # Registrar comandos
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("chatid", chatid))
-    application.add_handler(CommandHandler("datos", datos_juego))  # 🆕 Comando BGG
-    application.add_handler(CommandHandler("resumen", resumen))
-    application.add_handler(CommandHandler("resumen_desde", resumen_desde))
-    application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CommandHandler("start", instrumentar("start", start)))
+    application.add_handler(CommandHandler("help", instrumentar("help", help_command)))
+    application.add_handler(CommandHandler("chatid", instrumentar("chatid", chatid)))
+    application.add_handler(CommandHandler("datos", instrumentar("datos", datos_juego)))  # 🆕 Comando BGG
+    application.add_handler(CommandHandler("resumen", instrumentar("resumen", resumen)))
+    application.add_handler(CommandHandler("resumen_desde", instrumentar("resumen_desde", resumen_desde)))
+    application.add_handler(CommandHandler("stats", instrumentar("stats", stats)))
     
     # Comandos de admin
-    application.add_handler(CommandHandler("borrar_todo", borrar_todo))
-    application.add_handler(CommandHandler("borrar_rango", borrar_rango))
+    application.add_handler(CommandHandler("borrar_todo", instrumentar("borrar_todo", borrar_todo)))
+    application.add_handler(CommandHandler("borrar_rango", instrumentar("borrar_rango", borrar_rango)))
+    application.add_handler(CommandHandler("perfilado", instrumentar("perfilado", perfilado)))
+    application.add_handler(CommandHandler("uso", instrumentar("uso", uso)))
+    
+    # 👮 Cambios de administradores (caché de admins)
+    application.add_handler(
+        ChatMemberHandler(instrumentar("miembros", cambio_miembro_handler), ChatMemberHandler.ANY_CHAT_MEMBER)
+    )
     
     # 🆕 Error handler global
     application.add_error_handler(error_handler)
@@ -1287,28 +4909,49 @@ def main():
     application.add_handler(
         MessageHandler(
             filters.TEXT & ~filters.COMMAND,
-            guardar_mensaje_handler
+            instrumentar("mensaje", guardar_mensaje_handler)
         )
     )
     
-    # 🆕 PREGUNTAS AUTOMÁTICAS DESACTIVADAS TEMPORALMENTE
-    # (Conflicto con Python 3.13 en Render - se reactivará cuando se solucione)
-    # job_queue = application.job_queue
-    # for hora in [11, 15, 19]:
-    #     job_queue.run_daily(
-    #         enviar_pregunta_automatica,
-    #         time=time(hour=hora, minute=random.randint(0, 59)),
-    #         days=(0, 1, 2, 3, 4, 5, 6),
-    #         data=application,
-    #         name=f'pregunta_diaria_{hora}'
-    #     )
-    # print("⏰ Jobs de preguntas automáticas programados")
+    return application
+
+def main():
+    """Función principal"""
+    configurar_logs()
+    
+    if not TELEGRAM_TOKEN:
+        log.error("❌ Error: Define TELEGRAM_BOT_TOKEN en las variables de entorno")
+        return
+    
+    if not OPENAI_API_KEY:
+        log.error("❌ Error: Define OPENAI_API_KEY en las variables de entorno")
+        return
+    
+    # Iniciar servidor web en background (para Render), lo primero: el health
+    # check responde mientras se prepara la base de datos y arranca el polling
+    Thread(target=run_health_server, daemon=True).start()
+    
+    # Inicializar base de datos (sin DDL si el esquema ya está al día)
+    inicializar_db()
+    
+    # Crear aplicación (todos los envíos pasan por la cola con límites de flood)
+    application = construir_aplicacion(
+        Application.builder().token(TELEGRAM_TOKEN).rate_limiter(crear_limitador_envios())
+    )
+    
+    # ⏰ Las preguntas automáticas y los resúmenes diarios los programa tareas_inicio (PlanificadorDiario),
+    # sin JobQueue: su APScheduler daba conflicto con Python 3.13 en Render
     
     # Iniciar bot
-    print("🤖 Bot iniciado correctamente")
-    print("💾 Guardando todos los mensajes de los grupos...")
-    print("🎲 Integración BGG API activa")
-    application.run_polling()
+    log.info("🤖 Bot iniciado correctamente")
+    log.info("💾 Guardando todos los mensajes de los grupos...")
+    log.info("🎲 Integración BGG API activa")
+    try:
+        # chat_member no llega si no se pide explícitamente
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        PERFILADOR.volcar()
+        detener_pool_trabajo()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
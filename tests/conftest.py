@@ -0,0 +1,28 @@
+"""
+Fixtures comunes.
+
+El bot lee su configuración al importarse; aquí se importa una vez con una
+base de datos temporal por test, sin Telegram, OpenAI ni BGG reales.
+"""
+
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    """Módulo del bot apuntando a una base nueva en tmp_path"""
+    import telegram_summary_bot2 as bot
+
+    monkeypatch.setattr(bot, 'DB_NAME', str(tmp_path / 'bot.db'))
+    monkeypatch.setattr(bot, 'DB_SHARDS_DIR', str(tmp_path / 'shards'))
+    monkeypatch.setattr(bot, 'GRUPOS_PERMITIDOS', [])
+    bot._SHARDS_INICIALIZADOS.clear()
+    bot.inicializar_db()
+    return bot
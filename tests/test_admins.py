@@ -0,0 +1,122 @@
+"""Caché de administradores (RosterAdmins) y sus actualizaciones por chat_member"""
+
+import asyncio
+import time
+from itertools import count
+
+import pytest
+from telegram import Update
+from telegram.error import BadRequest
+
+from benchmarks.telegram_falso import BotFalso
+from tests.test_procesamiento import arrancar, esperar, parar
+
+CHAT = -1008000000001
+ADMIN, MIEMBRO = 1, 2
+
+_ids_update = count(900_000)
+
+
+class BotSinListaDeAdmins(BotFalso):
+    """Como un chat donde getChatAdministrators falla (p. ej. el bot ya no tiene permisos)"""
+
+    def _resultado(self, endpoint: str, data: dict):
+        if endpoint == 'getChatAdministrators':
+            raise BadRequest('Chat not found')
+        return super()._resultado(endpoint, data)
+
+
+@pytest.fixture
+def admins(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'ADMINS', bot.RosterAdmins(3600))
+    return bot
+
+
+def llamadas(tg, endpoint: str) -> int:
+    return sum(1 for _, e, _ in tg.llamadas if e == endpoint)
+
+
+def miembro(user_id: int, estado: str) -> dict:
+    if estado == 'administrator':
+        return BotFalso(admins={user_id})._miembro(user_id)
+    return {'status': estado, 'user': {'id': user_id, 'is_bot': False, 'first_name': f'Usuario {user_id}'}}
+
+
+def cambio(tg, campo: str, user_id: int, antes: str, despues: str) -> Update:
+    """Update chat_member (o my_chat_member) como los que envía Telegram"""
+    return Update.de_json({
+        'update_id': next(_ids_update),
+        campo: {
+            'chat': {'id': CHAT, 'type': 'supergroup', 'title': 'Grupo'},
+            'from': {'id': ADMIN, 'is_bot': False, 'first_name': 'Admin'},
+            'date': int(time.time()),
+            'old_chat_member': miembro(user_id, antes),
+            'new_chat_member': miembro(user_id, despues),
+        },
+    }, tg)
+
+
+def con_aplicacion(bot, tg, escenario):
+    async def ejecutar():
+        application = await arrancar(bot, tg)
+        try:
+            return await escenario(application)
+        finally:
+            await parar(application)
+
+    return asyncio.run(ejecutar())
+
+
+async def aplicar(application, update: Update):
+    await application.update_queue.put(update)
+    await esperar(lambda: application.update_queue.empty(), 2)
+    await asyncio.sleep(0.1)
+
+
+def test_ascensos_y_degradaciones_sin_volver_a_preguntar(admins):
+    bot, tg = admins, BotFalso(admins={ADMIN})
+
+    async def escenario(application):
+        antes = await bot.ADMINS.es_admin(tg, CHAT, ADMIN), await bot.ADMINS.es_admin(tg, CHAT, MIEMBRO)
+        await aplicar(application, cambio(tg, 'chat_member', MIEMBRO, 'member', 'administrator'))
+        await aplicar(application, cambio(tg, 'chat_member', ADMIN, 'administrator', 'member'))
+        return antes, (await bot.ADMINS.es_admin(tg, CHAT, ADMIN), await bot.ADMINS.es_admin(tg, CHAT, MIEMBRO))
+
+    antes, despues = con_aplicacion(bot, tg, escenario)
+
+    assert antes == (True, False)
+    assert despues == (False, True)
+    assert llamadas(tg, 'getChatAdministrators') == 1
+    assert llamadas(tg, 'getChatMember') == 0
+
+
+def test_cargas_simultaneas_se_comparten(admins):
+    bot, tg = admins, BotFalso(latencia_s=0.05, admins={ADMIN})
+
+    async def escenario():
+        return await asyncio.gather(*(bot.ADMINS.es_admin(tg, CHAT, user_id) for user_id in range(10)))
+
+    assert asyncio.run(escenario()) == [False, True] + [False] * 8
+    assert llamadas(tg, 'getChatAdministrators') == 1
+
+
+def test_cambio_de_permisos_del_bot_descarta_la_lista(admins):
+    bot, tg = admins, BotFalso(admins={ADMIN})
+
+    async def escenario(application):
+        await bot.ADMINS.es_admin(tg, CHAT, ADMIN)
+        await aplicar(application, cambio(tg, 'my_chat_member', 1, 'administrator', 'member'))
+        return await bot.ADMINS.es_admin(tg, CHAT, ADMIN)
+
+    assert con_aplicacion(bot, tg, escenario) is True
+    assert llamadas(tg, 'getChatAdministrators') == 2
+
+
+def test_sin_lista_de_admins_consulta_al_miembro(admins):
+    bot, tg = admins, BotSinListaDeAdmins(admins={ADMIN})
+
+    async def escenario():
+        return await bot.ADMINS.es_admin(tg, CHAT, ADMIN), await bot.ADMINS.es_admin(tg, CHAT, MIEMBRO)
+
+    assert asyncio.run(escenario()) == (True, False)
+    assert llamadas(tg, 'getChatMember') == 2
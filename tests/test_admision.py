@@ -0,0 +1,49 @@
+"""Control de admisión de los comandos caros"""
+
+import asyncio
+
+from benchmarks.telegram_falso import BotFalso, crear_update
+
+
+def test_cola_acotada_aunque_la_respuesta_previa_tarde(bot):
+    control = bot.ControlAdmision(max_concurrentes=1, max_cola=2)
+    tg = BotFalso()
+    admitidos = []
+
+    async def comando(i: int):
+        # Cada uno de un usuario y un chat distintos: solo puede frenarlos la cola
+        update = crear_update(tg, -1005000000000 - i, i + 1, '/resumen', 1)
+        turno = await control.solicitar(update, 'resumen')
+        if turno is None:
+            return
+        admitidos.append(i)
+        try:
+            await asyncio.sleep(0.05)  # "📊 Analizando..." atascado en la cola de envíos
+            async with turno:
+                await asyncio.sleep(0.05)
+        finally:
+            turno.liberar()
+
+    async def escenario():
+        await asyncio.gather(*(comando(i) for i in range(10)))
+
+    asyncio.run(escenario())
+    assert len(admitidos) == 3
+    assert control.reservados == control.en_curso == control.en_espera == 0
+
+
+def test_turno_no_usado_devuelve_su_sitio(bot):
+    control = bot.ControlAdmision(max_concurrentes=1, max_cola=0)
+    tg = BotFalso()
+
+    async def escenario():
+        primero = await control.solicitar(crear_update(tg, -1005100000001, 1, '/datos x', 1), 'datos')
+        assert primero is not None
+        # Mientras tiene su sitio reservado, no cabe nadie más
+        assert await control.solicitar(crear_update(tg, -1005100000002, 2, '/datos x', 1), 'datos') is None
+        primero.liberar()
+        primero.liberar()
+        assert control.reservados == 0
+        assert await control.solicitar(crear_update(tg, -1005100000003, 3, '/datos x', 1), 'datos') is not None
+
+    asyncio.run(escenario())
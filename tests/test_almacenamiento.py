@@ -0,0 +1,98 @@
+"""Almacenamiento por chat (DB_MODO=por_chat)"""
+
+import asyncio
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from benchmarks.generador import GeneradorChat, poblar_db
+from benchmarks.telegram_falso import BotFalso, crear_update
+from tests.test_procesamiento import arrancar, esperar, parar
+
+CHAT = -1004000000001
+ADMIN = 1
+
+
+def contar(ruta: str) -> int:
+    conn = sqlite3.connect(ruta)
+    total = conn.execute('SELECT COUNT(*) FROM mensajes WHERE chat_id = ?', (CHAT,)).fetchone()[0]
+    conn.close()
+    return total
+
+
+@pytest.fixture
+def migrado(bot, monkeypatch):
+    """Chat con mensajes en la base única, migrado a su shard sin purgar"""
+    # 10 horas de mensajes a caballo entre el 1 y el 2 de enero
+    poblar_db(bot.DB_NAME, CHAT, GeneradorChat(semilla=3, mensajes_por_hora=20), 200,
+              fin=datetime(2024, 1, 2, 5, 0))
+    monkeypatch.setattr(bot, 'DB_MODO', 'por_chat')
+    bot.migrar_a_shards(pausa_s=0)
+    assert contar(bot.DB_NAME) == contar(bot.ruta_shard(CHAT)) == 200
+    return bot
+
+
+def ejecutar_comando(bot, texto: str):
+    async def escenario():
+        tg = BotFalso(admins={ADMIN})
+        application = await arrancar(bot, tg)
+        await application.update_queue.put(crear_update(tg, CHAT, ADMIN, texto, 10_000))
+        await esperar(lambda: any(e == 'sendMessage' for _, e, _ in tg.llamadas), 5)
+        await parar(application)
+        return tg.enviados()
+
+    return asyncio.run(escenario())
+
+
+def test_borrar_todo_limpia_tambien_la_base_global(migrado):
+    bot = migrado
+    ejecutar_comando(bot, '/borrar_todo')
+
+    assert contar(bot.DB_NAME) == 0
+    # Relanzar la migración ya no devuelve nada al shard
+    bot.migrar_a_shards(pausa_s=0)
+    conn = bot.conectar_chat(CHAT)
+    assert conn.execute('SELECT COUNT(*) FROM mensajes').fetchone()[0] == 0
+    conn.close()
+
+
+def test_borrar_rango_limpia_tambien_la_base_global(migrado):
+    bot = migrado
+    conn = sqlite3.connect(bot.DB_NAME)
+    del_dia_2 = conn.execute(
+        "SELECT COUNT(*) FROM mensajes WHERE chat_id = ? AND timestamp >= '2024-01-02'", (CHAT,)
+    ).fetchone()[0]
+    conn.close()
+    assert 0 < del_dia_2 < 200
+
+    ejecutar_comando(bot, '/borrar_rango 2024-01-02 2024-01-02')
+
+    assert contar(bot.DB_NAME) == 200 - del_dia_2
+    assert contar(bot.ruta_shard(CHAT)) == 200 - del_dia_2
+
+
+def test_borrar_rango_sin_nada_en_el_rango_no_escribe_en_la_global(migrado):
+    bot = migrado
+    # Otro escritor tiene la base global: un DELETE, aunque no borre nada, esperaría su lock
+    bloqueo = sqlite3.connect(bot.DB_NAME)
+    bloqueo.execute('BEGIN IMMEDIATE')
+    try:
+        assert bot.borrar_de_base_global(CHAT, datetime(2023, 1, 1), datetime(2023, 1, 31)) == 0
+    finally:
+        bloqueo.rollback()
+        bloqueo.close()
+    assert contar(bot.DB_NAME) == 200
+
+
+def test_borrar_rango_limpia_la_global_aunque_el_shard_ya_no_tenga_nada(migrado):
+    bot = migrado
+    conn = bot.conectar_chat(CHAT)
+    conn.execute("DELETE FROM mensajes WHERE timestamp >= '2024-01-02'")
+    conn.commit()
+    conn.close()
+    en_shard = contar(bot.ruta_shard(CHAT))
+
+    ejecutar_comando(bot, '/borrar_rango 2024-01-02 2024-01-02')
+
+    assert contar(bot.DB_NAME) == en_shard
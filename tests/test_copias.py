@@ -0,0 +1,17 @@
+"""Copias de seguridad: rotación y espacio en disco"""
+
+import os
+
+
+def test_conservar_cero_deja_al_menos_la_copia_recien_hecha(bot, tmp_path, monkeypatch):
+    directorio = tmp_path / 'copias'
+    antigua = directorio / '20200101-000000'
+    antigua.mkdir(parents=True)
+    (antigua / 'bot.db').write_bytes(b'x' * 10)
+    monkeypatch.setattr(bot, 'BACKUP_DIR', str(directorio))
+    monkeypatch.setattr(bot, 'BACKUP_CONSERVAR', 0)
+
+    copia = bot.hacer_copia_seguridad()
+
+    assert bot.listar_copias() == [copia]
+    assert bot.COPIAS_BYTES.series[()] == os.path.getsize(os.path.join(copia, 'bot.db'))
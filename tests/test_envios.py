@@ -0,0 +1,92 @@
+"""Cola de envíos: mensajes largos y formato"""
+
+import asyncio
+import time
+
+import pytest
+from telegram.error import BadRequest, RetryAfter
+
+
+def test_partir_cierra_y_reabre_la_negrita(bot):
+    texto = '*' + 'palabra ' * 30 + 'fin*'
+    partes = bot.partir_mensaje(texto, limite=100, parse_mode='Markdown')
+
+    assert len(partes) > 1
+    assert all(len(parte) <= 100 for parte in partes)
+    assert all(parte.startswith('*') and parte.endswith('*') for parte in partes)
+    assert all(bot._markdown_abierto(parte) == ('', -1) for parte in partes)
+
+
+@pytest.mark.parametrize('texto', [
+    'uno ' * 20 + '`codigo ' + 'x ' * 40 + 'fin`',
+    'uno ' * 20 + '```\n' + 'linea\n' * 30 + '```',
+    'Lee ' + 'esto ' * 17 + '[el enlace largo](https://example.com/' + 'a' * 30 + ') y ' + 'más ' * 20,
+    '\\*no es negrita\\* ' * 10 + '_cursiva ' + 'y ' * 40 + 'fin_',
+])
+def test_partir_deja_cada_trozo_con_el_markdown_cerrado(bot, texto):
+    partes = bot.partir_mensaje(texto, limite=100, parse_mode='Markdown')
+
+    assert len(partes) > 1
+    assert all(len(parte) <= 100 for parte in partes)
+    assert all(bot._markdown_abierto(parte) == ('', -1) for parte in partes)
+
+
+def test_partir_sin_parse_mode_no_toca_el_texto(bot):
+    texto = '*' + 'palabra ' * 30 + 'fin*'
+    assert ' '.join(bot.partir_mensaje(texto, limite=100)) == texto
+
+
+def test_envio_con_formato_ilegible_se_repite_sin_parse_mode(bot):
+    enviados = []
+
+    async def send_message(endpoint, data):
+        enviados.append(dict(data))
+        if data.get('parse_mode'):
+            raise BadRequest("Can't parse entities: can't find end of the entity starting at byte offset 12")
+        return True
+
+    async def probar():
+        limitador = bot.LimitadorEnvios(30, 20, 0, 3)
+        await limitador.initialize()
+        try:
+            datos = {'chat_id': 1, 'text': 'a *b', 'parse_mode': 'Markdown'}
+            return await limitador.process_request(send_message, ('sendMessage', datos), {},
+                                                   'sendMessage', datos, None)
+        finally:
+            await limitador.shutdown()
+
+    assert asyncio.run(probar()) is True
+    assert enviados == [
+        {'chat_id': 1, 'text': 'a *b', 'parse_mode': 'Markdown'},
+        {'chat_id': 1, 'text': 'a *b'},
+    ]
+
+
+def test_retry_after_fuera_de_la_cola_pausa_el_metodo_para_todos(bot):
+    llamadas = []
+
+    async def get_chat_member(endpoint, data):
+        llamadas.append(time.monotonic())
+        if len(llamadas) == 1:
+            raise RetryAfter(0.3)
+        return data['user_id']
+
+    async def probar():
+        limitador = bot.LimitadorEnvios(30, 20, 0, 3)
+        await limitador.initialize()
+        try:
+            async def pedir(user_id):
+                datos = {'chat_id': -1, 'user_id': user_id}
+                return await limitador.process_request(get_chat_member, ('getChatMember', datos), {},
+                                                       'getChatMember', datos, None)
+
+            primera = asyncio.create_task(pedir(1))
+            await asyncio.sleep(0.05)
+            # Llega mientras Telegram pide esperar: no debe volver a llamar hasta que pase
+            return await asyncio.gather(primera, pedir(2))
+        finally:
+            await limitador.shutdown()
+
+    assert asyncio.run(probar()) == [1, 2]
+    assert len(llamadas) == 3
+    assert min(llamadas[1:]) - llamadas[0] >= 0.3
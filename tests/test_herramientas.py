@@ -0,0 +1,77 @@
+"""herramientas.py: importación del export de Telegram Desktop"""
+
+import argparse
+import json
+
+import pytest
+
+import herramientas
+
+CHAT = -1001234567890
+
+EXPORT = {
+    'name': 'Grupo de juegos',
+    'type': 'private_supergroup',
+    'id': 1234567890,
+    'messages': [
+        {'id': 1, 'type': 'service', 'date': '2024-03-01T10:00:00', 'action': 'invite_members'},
+        {'id': 2, 'type': 'message', 'date': '2024-03-01T10:01:00', 'from': 'Ana', 'from_id': 'user111',
+         'text': '¿Partida de Brass el sábado? 🎲 {llaves} y [corchetes]'},
+        {'id': 3, 'type': 'message', 'date': '2024-03-01T10:02:00', 'from': 'Luis', 'from_id': 'user222',
+         'reply_to_message_id': 2,
+         'text': ['Yo llevo ', {'type': 'bold', 'text': 'Ark Nova'}, ' y "comillas" \\ raras']},
+        {'id': 4, 'type': 'message', 'date': '2024-03-01T10:03:00', 'from': 'Ana', 'from_id': 'user111',
+         'text': '/resumen'},
+        {'id': 5, 'type': 'message', 'date': '2024-03-01T10:04:00', 'from': None, 'from_id': 'channel333',
+         'text': 'Publicado desde el canal'},
+        {'id': 6, 'type': 'message', 'date': '2024-03-01T10:05:00', 'from': 'Marta', 'from_id': 'user444',
+         'text': '', 'photo': 'photos/foto.jpg'},
+    ] + [
+        {'id': i, 'type': 'message', 'date': f'2024-03-02T{i % 24:02d}:00:00', 'from': 'Pedro',
+         'from_id': 'user555', 'text': f'mensaje {i} ' + 'ñ' * (i % 7)}
+        for i in range(7, 40)
+    ],
+}
+GUARDABLES = 3 + 33  # Sin el de servicio, el comando ni el de solo foto
+
+
+def importar(ruta, lote: int = 5):
+    herramientas.cmd_importar(argparse.Namespace(fichero=str(ruta), chat_id=None, lote=lote))
+
+
+def filas(bot):
+    conn = bot.conectar_chat(CHAT)
+    resultado = conn.execute(
+        'SELECT message_id, user_id, first_name, texto, timestamp, respuesta_a FROM mensajes '
+        'WHERE chat_id = ? ORDER BY message_id', (CHAT,)
+    ).fetchall()
+    conn.close()
+    return resultado
+
+
+@pytest.mark.parametrize('trozo', [1, 7, 64, 1 << 20])
+def test_importar_no_depende_del_tamano_del_trozo_y_reimportar_no_duplica(bot, tmp_path, monkeypatch, capsys, trozo):
+    ruta = tmp_path / 'result.json'
+    ruta.write_text(json.dumps(EXPORT, ensure_ascii=False, indent=1), encoding='utf-8')
+    monkeypatch.setattr(herramientas, 'TAMANO_TROZO', trozo)
+
+    importar(ruta)
+    primera = filas(bot)
+    capsys.readouterr()
+    importar(ruta)
+
+    assert f'{GUARDABLES} mensajes leídos, 0 nuevos' in capsys.readouterr().out
+    assert filas(bot) == primera
+    assert len(primera) == GUARDABLES
+    assert primera[:3] == [
+        (2, 111, 'Ana', '¿Partida de Brass el sábado? 🎲 {llaves} y [corchetes]', '2024-03-01 10:01:00', None),
+        (3, 222, 'Luis', 'Yo llevo Ark Nova y "comillas" \\ raras', '2024-03-01 10:02:00', 2),
+        (5, -100333, 'Usuario', 'Publicado desde el canal', '2024-03-01 10:04:00', None),
+    ]
+
+
+def test_fichero_que_no_es_un_export(tmp_path):
+    ruta = tmp_path / 'otro.json'
+    ruta.write_text('{"chats": []}', encoding='utf-8')
+    with pytest.raises(ValueError):
+        herramientas.leer_export_telegram(str(ruta))
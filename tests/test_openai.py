@@ -0,0 +1,104 @@
+"""Capa de llamadas a OpenAI: reintentos, cortocircuito y cobertura"""
+
+import time
+
+import httpx
+import openai
+import pytest
+
+PETICION = httpx.Request('POST', 'https://api.openai.com/v1/chat/completions')
+
+
+def error_conexion():
+    return openai.APIConnectionError(request=PETICION)
+
+
+def error_400():
+    respuesta = httpx.Response(400, request=PETICION, json={'error': {'message': 'context length exceeded'}})
+    return openai.BadRequestError('context length exceeded', response=respuesta, body=None)
+
+
+def llamadas(bot, resultados, fallos=2):
+    """LlamadasOpenAI sin reintentos cuyos intentos devuelven (o lanzan) `resultados` en orden"""
+    capa = bot.LlamadasOpenAI(5, 5, 0, 0, bot.Cortocircuito(fallos, 0))
+    pendientes = iter(resultados)
+
+    def intento(plazo, parametros):
+        resultado = next(pendientes)
+        if isinstance(resultado, Exception):
+            raise resultado
+        return resultado
+
+    capa._intento = intento
+    return capa
+
+
+def abrir(capa):
+    for _ in range(capa.circuito.fallos):
+        with pytest.raises(openai.APIConnectionError):
+            capa.llamar('prueba')
+    assert capa.circuito.seguidos == capa.circuito.fallos
+
+
+@pytest.mark.parametrize('error', [RuntimeError('fallo del propio bot'), KeyError('x')])
+def test_prueba_con_error_ajeno_a_openai_no_bloquea_el_circuito(bot, error):
+    capa = llamadas(bot, [error_conexion(), error_conexion(), error, 'ok', 'ok', 'ok'])
+    abrir(capa)
+
+    with pytest.raises(type(error)):
+        capa.llamar('prueba')
+
+    # La siguiente llamada vuelve a ser de prueba y, al salir bien, cierra el circuito
+    assert [capa.llamar('prueba') for _ in range(3)] == ['ok', 'ok', 'ok']
+    assert capa.circuito.seguidos == 0
+    assert not capa.circuito.probando
+
+
+def test_prueba_con_error_400_cierra_el_circuito(bot):
+    capa = llamadas(bot, [error_conexion(), error_conexion(), error_400(), 'ok'])
+    abrir(capa)
+
+    with pytest.raises(openai.BadRequestError):
+        capa.llamar('prueba')
+
+    # OpenAI contestó: está vivo aunque la petición fuera mala
+    assert capa.circuito.seguidos == 0
+    assert capa.llamar('prueba') == 'ok'
+
+
+def test_circuito_abierto_no_llama(bot):
+    capa = llamadas(bot, [error_conexion(), error_conexion()])
+    capa.circuito.pausa_s = 60
+    abrir(capa)
+
+    with pytest.raises(bot.OpenAINoDisponible):
+        capa.llamar('prueba')
+
+
+def test_cobertura_apunta_tambien_el_uso_de_la_peticion_que_pierde(bot, monkeypatch):
+    class Uso:
+        def __init__(self, entrada, salida):
+            self.prompt_tokens, self.completion_tokens = entrada, salida
+
+    class Respuesta:
+        def __init__(self, uso):
+            self.usage = uso
+
+    capa = bot.LlamadasOpenAI(5, 5, 0, 0.05, bot.Cortocircuito(2, 0))
+    intentos = iter([(0.3, Respuesta(Uso(100, 20))), (0, Respuesta(Uso(100, 30)))])
+
+    def intento(plazo, parametros):
+        espera, respuesta = next(intentos)
+        time.sleep(espera)
+        return respuesta
+
+    capa._intento = intento
+    monkeypatch.setattr(bot, 'LLAMADAS_OPENAI', capa)
+
+    respuesta = bot.llamar_openai('resumen', chat_id=-100, model='gpt-4o-mini', messages=[])
+    assert respuesta.usage.completion_tokens == 30
+    # La original llega después y se apunta desde su hilo
+    limite = time.monotonic() + 2
+    while bot.tokens_hoy(-100) < 250 and time.monotonic() < limite:
+        time.sleep(0.05)
+    assert bot.tokens_hoy(-100) == 250
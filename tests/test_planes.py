@@ -0,0 +1,49 @@
+"""
+Planes de consulta de todas las sentencias SQL del bot y de herramientas.py:
+ninguna recorre entera una tabla grande (SCAN) ni monta un B-tree temporal
+sin una excepción justificada en benchmarks.planes.EXCEPCIONES.
+
+Usa una base pequeña (20.000 mensajes); los tiempos con 1M de mensajes son
+del benchmark `python -m benchmarks.planes`.
+"""
+
+import re
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from benchmarks.planes import EXCEPCIONES, parametros_ejemplo, preparar_fixture, recoger_sentencias, revisar_plan
+
+FILAS = 20_000
+SENTENCIAS, DDL, SIN_VARIANTE = recoger_sentencias()
+
+
+@pytest.fixture(scope='module')
+def base(tmp_path_factory):
+    """(conexión, chat_id) de una base poblada como la del benchmark"""
+    import telegram_summary_bot2 as bot
+
+    with pytest.MonkeyPatch.context() as parche:
+        parche.setattr(bot, 'DB_NAME', bot.DB_NAME)  # preparar_fixture lo cambia
+        ruta, chat_id = preparar_fixture(bot, str(tmp_path_factory.mktemp('planes')), FILAS, DDL)
+        conn = sqlite3.connect(ruta, isolation_level=None)
+        yield conn, chat_id
+        conn.close()
+
+
+def test_todo_el_sql_dinamico_tiene_variante():
+    assert SIN_VARIANTE == []
+
+
+def test_cada_excepcion_corresponde_a_una_sentencia():
+    for patron, _ in EXCEPCIONES:
+        assert any(re.search(patron, s['sql']) for s in SENTENCIAS), f"excepción sin sentencia: {patron}"
+
+
+@pytest.mark.parametrize('sentencia', SENTENCIAS, ids=[s['origen'][0] for s in SENTENCIAS])
+def test_plan_sin_scan_ni_btree_temporal(base, sentencia):
+    conn, chat_id = base
+    parametros = parametros_ejemplo(sentencia['sql'], chat_id, datetime.now())
+    resultado = revisar_plan(conn, sentencia['sql'], parametros)
+    assert resultado['problemas'] == [], f"{sentencia['sql']}\n" + '\n'.join(resultado['plan'])
@@ -0,0 +1,95 @@
+"""Preguntas automáticas: programación persistente y cooldowns"""
+
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.telegram_falso import BotFalso
+from tests.test_procesamiento import esperar
+
+CHAT = -1006000000001
+GRACIA = timedelta(minutes=60)
+
+
+@pytest.fixture
+def preguntas(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'GRUPOS_PERMITIDOS', [CHAT])
+    return bot
+
+
+def programar(bot, clave: str, proxima: datetime):
+    conn = bot.conectar_global()
+    conn.execute('INSERT OR REPLACE INTO preguntas_programacion (clave, proxima) VALUES (?, ?)',
+                 (clave, proxima.isoformat()))
+    conn.commit()
+    conn.close()
+
+
+def proxima_guardada(bot, clave: str) -> datetime:
+    conn = bot.conectar_global()
+    proxima = conn.execute('SELECT proxima FROM preguntas_programacion WHERE clave = ?', (clave,)).fetchone()[0]
+    conn.close()
+    return datetime.fromisoformat(proxima)
+
+
+async def correr(bot, tg, segundos: float, condicion=lambda: False):
+    """Un PlanificadorDiario nuevo (como tras un reinicio) durante `segundos` o hasta `condicion`"""
+    planificador = bot.PlanificadorDiario([12], GRACIA)
+    tarea = asyncio.create_task(planificador.ejecutar(SimpleNamespace(bot=tg)))
+    await esperar(condicion, segundos)
+    tarea.cancel()
+    await asyncio.gather(tarea, return_exceptions=True)
+
+
+def preguntas_enviadas(tg) -> list:
+    return [d['text'] for _, e, d in tg.enviados() if d['chat_id'] == CHAT]
+
+
+def test_perdida_dentro_de_la_gracia_se_lanza_una_sola_vez_aunque_se_reinicie(preguntas):
+    bot, tg = preguntas, BotFalso()
+    programar(bot, 'pregunta_12', datetime.now() - timedelta(minutes=10))
+
+    async def escenario():
+        await correr(bot, tg, 2, lambda: preguntas_enviadas(tg))
+        # Reinicio: el planificador nuevo lee la programación ya avanzada
+        await correr(bot, tg, 0.5)
+
+    asyncio.run(escenario())
+
+    assert len(preguntas_enviadas(tg)) == 1
+    assert proxima_guardada(bot, 'pregunta_12') > datetime.now()
+
+
+def test_perdida_fuera_de_la_gracia_se_reprograma_sin_lanzarla(preguntas):
+    bot, tg = preguntas, BotFalso()
+    programar(bot, 'pregunta_12', datetime.now() - GRACIA - timedelta(minutes=5))
+
+    asyncio.run(correr(bot, tg, 0.5))
+
+    assert preguntas_enviadas(tg) == []
+    assert proxima_guardada(bot, 'pregunta_12') > datetime.now()
+
+
+def test_reiniciar_no_cambia_el_minuto_elegido(preguntas):
+    bot = preguntas
+    primera = bot.PlanificadorDiario([9, 21], GRACIA).cargar()
+    assert bot.PlanificadorDiario([9, 21], GRACIA).cargar() == primera
+
+
+def test_cooldowns_de_todos_los_chats_en_una_consulta(bot):
+    ahora = datetime(2024, 5, 8, 12, 0)
+    conn = bot.conectar_global()
+    conn.executemany(
+        'INSERT INTO preguntas_historial (chat_id, pregunta_id, timestamp) VALUES (?, ?, ?)',
+        [(CHAT, 1, ahora - timedelta(days=1)), (CHAT, 2, ahora - timedelta(days=6)),
+         (CHAT, 3, ahora - timedelta(days=8)), (-2, 1, ahora - timedelta(hours=1))]
+    )
+    conn.commit()
+    conn.close()
+
+    cooldowns = bot.cargar_cooldowns(ahora - bot.PREGUNTAS_COOLDOWN)
+
+    assert cooldowns == {CHAT: {1, 2}, -2: {1}}
+    assert bot.elegir_pregunta({i for i in range(len(bot.PREGUNTAS_JUEGOS))}, 0) is None
@@ -0,0 +1,17 @@
+"""Autómata de nombres de juegos de la precarga de BGG"""
+
+import pytest
+
+NOMBRES = ['Catan: Starfarers', 'Ark Nova', "Tzolk'in", 'Azul']
+
+
+@pytest.mark.parametrize('texto, esperados', [
+    ('¿Catan  Starfarers el sábado?', {'Catan: Starfarers'}),
+    ('traigo el catan:\nstarfarers', {'Catan: Starfarers'}),
+    ('Catan:Starfarers!', {'Catan: Starfarers'}),
+    ('Ark Nova y después Azul.', {'Ark Nova', 'Azul'}),
+    ("¿un tzolk'in?", {"Tzolk'in"}),
+    ('azulejos y arknova', set()),
+])
+def test_nombres_con_espacios_y_signos_distintos(bot, texto, esperados):
+    assert bot.AutomataNombres(NOMBRES).buscar(texto) == esperados
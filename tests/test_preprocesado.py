@@ -0,0 +1,47 @@
+"""Preprocesado de la conversación antes del prompt"""
+
+from datetime import datetime, timedelta
+
+INICIO = datetime(2024, 5, 1, 18, 0)
+
+
+def mensajes(*filas):
+    """(minuto, usuario, texto) -> dicts como los de obtener_mensajes_db"""
+    return [
+        {'usuario': usuario, 'mensaje': texto, 'timestamp': INICIO + timedelta(minutes=minuto)}
+        for minuto, usuario, texto in filas
+    ]
+
+
+def test_duplicado_corto_de_otro_usuario_conserva_su_autor(bot):
+    lineas = bot.preprocesar_mensajes(mensajes(
+        (0, 'ana', '¿Quedamos el sábado?'),
+        (1, 'ana', '+1'),
+        (2, 'luis', '+1'),
+    ))
+    assert [(l['usuario'], l['mensaje']) for l in lineas] == [
+        ('ana', '¿Quedamos el sábado? / +1'),
+        ('luis', '+1'),
+    ]
+
+
+def test_duplicado_corto_del_mismo_usuario_se_colapsa(bot):
+    lineas = bot.preprocesar_mensajes(mensajes((0, 'ana', 'jaja'), (0, 'ana', 'jaja'), (1, 'ana', 'JAJA')))
+    assert [l['mensaje'] for l in lineas] == ['jaja (×3)']
+
+
+def test_repeticion_larga_de_otro_usuario_horas_despues_no_se_atribuye_al_primero(bot):
+    texto = 'Traigo el Brass Birmingham y el Ark Nova'
+    lineas = bot.preprocesar_mensajes(mensajes(
+        (0, 'ana', texto),
+        (5, 'luis', 'Vale'),
+        (240, 'marta', texto),
+    ))
+    assert [(l['usuario'], l['timestamp'].hour) for l in lineas] == [('ana', 18), ('luis', 18), ('marta', 22)]
+    assert '×' not in ''.join(l['mensaje'] for l in lineas)
+
+
+def test_repeticion_larga_del_mismo_usuario_se_colapsa(bot):
+    texto = 'Recordad apuntaros en la hoja del torneo'
+    lineas = bot.preprocesar_mensajes(mensajes((0, 'ana', texto), (30, 'luis', 'Hecho'), (60, 'ana', texto)))
+    assert [l['mensaje'] for l in lineas] == [f'{texto} (×2)', 'Hecho']
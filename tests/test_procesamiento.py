@@ -0,0 +1,95 @@
+"""Procesamiento concurrente de updates con la Application real y el bot falso"""
+
+import asyncio
+import random
+import time
+
+import pytest
+from telegram.ext import Application
+
+from benchmarks.replay import verificar_orden
+from benchmarks.telegram_falso import BotFalso, crear_update
+
+
+async def arrancar(bot, tg):
+    application = bot.construir_aplicacion(Application.builder().bot(tg).updater(None))
+    await application.initialize()
+    await application.start()
+    return application
+
+
+async def parar(application):
+    await application.stop()
+    await application.shutdown()
+
+
+async def esperar(condicion, plazo_s: float) -> bool:
+    limite = time.monotonic() + plazo_s
+    while time.monotonic() < limite:
+        if condicion():
+            return True
+        await asyncio.sleep(0.01)
+    return condicion()
+
+
+def mensajes_guardados(bot, chat_id: int) -> int:
+    conn = bot.conectar_chat(chat_id)
+    total = conn.execute('SELECT COUNT(*) FROM mensajes WHERE chat_id = ?', (chat_id,)).fetchone()[0]
+    conn.close()
+    return total
+
+
+@pytest.mark.parametrize('modo', ['unico', 'por_chat'])
+def test_orden_por_chat_bajo_concurrencia(bot, monkeypatch, modo):
+    monkeypatch.setattr(bot, 'DB_MODO', modo)
+    chats = [-1009000000000 - i for i in range(8)]
+    por_chat = 150
+
+    async def escenario():
+        tg = BotFalso()
+        application = await arrancar(bot, tg)
+        rng = random.Random(7)
+        siguiente = {chat_id: 1 for chat_id in chats}
+        # Chats intercalados al azar, con comandos entre medias
+        for _ in range(len(chats) * por_chat):
+            chat_id = rng.choice([c for c in chats if siguiente[c] <= por_chat])
+            texto = '/help' if rng.random() < 0.05 else f'mensaje {siguiente[chat_id]}'
+            await application.update_queue.put(crear_update(tg, chat_id, 1, texto, siguiente[chat_id]))
+            siguiente[chat_id] += 1
+        await esperar(lambda: application.update_queue.empty(), 10)
+        await asyncio.sleep(0.5)
+        await parar(application)
+
+    asyncio.run(escenario())
+    orden = verificar_orden(bot, chats)
+    assert orden['violaciones'] == 0
+    assert orden['mensajes'] > len(chats) * por_chat * 0.9
+
+
+def test_rafaga_de_comandos_no_frena_la_ingesta(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'UPDATES_CONCURRENTES', 4)
+    monkeypatch.setattr(bot, 'COMANDOS_CONCURRENTES', 2)
+    chat_comandos, chat_activo, chat_tranquilo = -1001, -1002, -1003
+
+    async def escenario():
+        # Cada respuesta tarda 0,3 s: 60 /help son ~9 s con 2 a la vez
+        tg = BotFalso(latencia_s=0.3)
+        application = await arrancar(bot, tg)
+        for i in range(60):
+            await application.update_queue.put(crear_update(tg, chat_comandos, 1, '/help', i + 1))
+        # Ráfaga de un chat (como la que reencola la puesta al día), bloqueada tras un /borrar_todo
+        await application.update_queue.put(crear_update(tg, chat_activo, 1, '/borrar_todo', 1))
+        for i in range(50):
+            await application.update_queue.put(crear_update(tg, chat_activo, 1, f'activo {i}', i + 2))
+        await asyncio.sleep(0.1)
+
+        await application.update_queue.put(crear_update(tg, chat_tranquilo, 2, 'hola', 1))
+        inicio = time.monotonic()
+        guardado = await esperar(lambda: mensajes_guardados(bot, chat_tranquilo) == 1, 2)
+        segundos = time.monotonic() - inicio
+        await parar(application)
+        return guardado, segundos
+
+    guardado, segundos = asyncio.run(escenario())
+    assert guardado, 'la ingesta de otro chat se quedó sin huecos'
+    assert segundos < 1
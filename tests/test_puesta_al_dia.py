@@ -0,0 +1,73 @@
+"""Puesta al día tras un reinicio y arranque de las tareas de fondo"""
+
+import asyncio
+import warnings
+
+from telegram.ext import Application
+
+from benchmarks.telegram_falso import BotFalso, crear_update
+from tests.test_procesamiento import arrancar, esperar, parar
+
+CHAT = -1005000000001
+ADMIN = 1
+
+
+def test_borrado_entre_pendientes_no_se_lleva_lo_posterior(bot):
+    tg = BotFalso(admins={ADMIN})
+    textos = [f'antes {i}' for i in range(1, 6)] + ['/borrar_todo'] + [f'después {i}' for i in range(7, 12)]
+    tg.pendientes.extend(crear_update(tg, CHAT, ADMIN, texto, i) for i, texto in enumerate(textos, 1))
+
+    async def escenario():
+        application = bot.construir_aplicacion(Application.builder().bot(tg).updater(None))
+        await application.initialize()
+        # Como en run_polling: post_init (y la puesta al día) antes de start()
+        resultado = await bot.ponerse_al_dia(application)
+        await application.start()
+        await esperar(lambda: application.update_queue.empty(), 5)
+        await asyncio.sleep(0.3)
+        await parar(application)
+        return resultado
+
+    resultado = asyncio.run(escenario())
+
+    assert resultado == dict(resultado, updates=11, mensajes_guardados=5, a_la_cola=6)
+    # Telegram los dio todos por confirmados: el polling no los volverá a entregar
+    assert not tg.pendientes
+    conn = bot.conectar_chat(CHAT)
+    filas = conn.execute('SELECT message_id, texto FROM mensajes WHERE chat_id = ? ORDER BY id', (CHAT,)).fetchall()
+    conn.close()
+    assert filas == [(i, f'después {i}') for i in range(7, 12)]
+    # El /borrar_todo se atendió una sola vez
+    assert len([d for _, _, d in tg.enviados() if d['chat_id'] == CHAT]) == 1
+
+
+def test_tareas_de_fondo_arrancan_con_la_aplicacion_en_marcha_y_paran_con_ella(bot, monkeypatch):
+    vistas = []
+    tg = BotFalso()
+    application = bot.construir_aplicacion(Application.builder().bot(tg).updater(None))
+
+    async def bucle_falso():
+        vistas.append(application.running)
+        while True:
+            await asyncio.sleep(3600)
+
+    for nombre, valor in [('PRECARGA_DIFERIDA', False), ('PUESTA_AL_DIA', False),
+                          ('BACKUP_INTERVALO_H', 1.0), ('bucle_copias', bucle_falso)]:
+        monkeypatch.setattr(bot, nombre, valor)
+
+    async def escenario():
+        await application.initialize()
+        await bot.tareas_inicio(application)
+        await asyncio.sleep(0.1)
+        assert vistas == []
+        await application.start()
+        await esperar(lambda: vistas, 2)
+        # stop() espera a las tareas de create_task: el bucle sin fin no debe colgarlo
+        await asyncio.wait_for(parar(application), 3)
+
+    with warnings.catch_warnings(record=True) as avisos:
+        warnings.simplefilter('always')
+        asyncio.run(escenario())
+
+    assert vistas == [True]
+    assert not [a for a in avisos if 'create_task' in str(a.message)]
@@ -0,0 +1,45 @@
+"""Puntuación de relevancia de los mensajes de la ventana"""
+
+from datetime import datetime, timedelta
+
+INICIO = datetime(2024, 5, 1, 18, 0)
+
+
+def mensajes(*filas):
+    """(minuto, usuario, texto, respuesta_a) -> dicts como los de obtener_mensajes_db"""
+    return [
+        {'usuario': usuario, 'mensaje': texto, 'timestamp': INICIO + timedelta(minutes=minuto),
+         'message_id': i, 'respuesta_a': respuesta_a}
+        for i, (minuto, usuario, texto, respuesta_a) in enumerate(filas)
+    ]
+
+
+# Los cuatro primeros tienen términos compartidos; los 'ok' no
+VENTANA = mensajes(
+    (0, 'ana', 'Mañana partida de Brass Birmingham en casa', None),
+    (1, 'luis', 'Me apunto a la partida de Brass', 0),
+    (2, 'marta', 'Yo llevo el Ark Nova por si acaso', 0),
+    (30, 'ana', 'Brass Birmingham o Ark Nova, votad', None),
+    (60, 'pedro', 'ok', None),
+    (90, 'pedro', 'ok', None),
+)
+
+
+def test_sin_tope_todos_los_mensajes_puntuan_terminos(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'RELEVANCIA_PESOS', {'terminos': 1.0})
+    puntuaciones = bot.puntuar_relevancia(VENTANA)
+    assert puntuaciones == bot.puntuar_relevancia(VENTANA, bot.pesos_terminos(VENTANA))
+    assert puntuaciones[3] > 0 and puntuaciones[4] == 0
+
+
+def test_con_tope_terminos_solo_en_los_mejores_por_las_demas_senales(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'RELEVANCIA_MAX_TERMINOS', 3)
+    con_tope = bot.puntuar_relevancia(VENTANA)
+    monkeypatch.setattr(bot, 'RELEVANCIA_PESOS', dict(bot.RELEVANCIA_PESOS, terminos=0))
+    base = bot.puntuar_relevancia(VENTANA)
+
+    # El anuncio pasa el corte; la votación (sin respuestas ni reacciones) no
+    candidatos = set(sorted(range(len(VENTANA)), key=base.__getitem__, reverse=True)[:3])
+    assert 0 in candidatos and 3 not in candidatos
+    assert con_tope[0] > base[0]
+    assert [i for i in range(len(VENTANA)) if con_tope[i] != base[i]] == [i for i in sorted(candidatos) if i < 4]
@@ -0,0 +1,31 @@
+"""Resúmenes diarios precalculados"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+CHAT = -1001
+HASTA = datetime(2024, 5, 2, 5, 3)
+
+
+@pytest.fixture
+def diario(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'RESUMEN_DIARIO_HORA', '5')
+    conn = bot.conectar_global()
+    conn.execute(
+        'INSERT INTO resumenes_diarios (chat_id, desde, hasta, mensajes, texto) VALUES (?, ?, ?, ?, ?)',
+        (CHAT, (HASTA - timedelta(hours=24)).isoformat(), HASTA.isoformat(), 120, 'Se habló de Ark Nova')
+    )
+    conn.commit()
+    conn.close()
+    return bot
+
+
+@pytest.mark.parametrize('minutos, servido', [(10, True), (59, True), (61, False), (6 * 60 - 4, False)])
+def test_solo_se_sirve_mientras_su_ventana_es_la_pedida(diario, minutos, servido):
+    encontrado = diario.buscar_resumen_diario(CHAT, 24, HASTA + timedelta(minutes=minutos))
+    assert (encontrado is not None) == servido
+
+
+def test_no_se_sirve_a_otra_duracion(diario):
+    assert diario.buscar_resumen_diario(CHAT, 12, HASTA + timedelta(minutes=10)) is None
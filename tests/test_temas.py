@@ -0,0 +1,47 @@
+"""Temas de foro: cada mensaje guarda su tema y /resumen se limita al tema donde se pide"""
+
+import asyncio
+
+from benchmarks.telegram_falso import BotFalso, crear_update
+from tests.test_procesamiento import arrancar, esperar, parar
+
+CHAT = -1007000000001
+TEMAS = (10, 20)
+
+
+def test_resumen_en_un_tema_solo_resume_ese_tema_y_contesta_en_el(bot, monkeypatch):
+    async def generar_resumen(mensajes, horas, chat_id, comando, ahorro=False):
+        return ' | '.join(m['mensaje'] for m in mensajes)
+
+    monkeypatch.setattr(bot, 'generar_resumen', generar_resumen)
+    tg = BotFalso()
+
+    async def escenario():
+        application = await arrancar(bot, tg)
+        message_id = 100
+        for i in range(3):
+            for tema in TEMAS:
+                message_id += 1
+                await application.update_queue.put(
+                    crear_update(tg, CHAT, i + 1, f'tema {tema} mensaje {i}', message_id, thread_id=tema)
+                )
+        await esperar(lambda: application.update_queue.empty(), 5)
+        await asyncio.sleep(0.2)
+        await application.update_queue.put(crear_update(tg, CHAT, 1, '/resumen', 200, thread_id=TEMAS[0]))
+        await esperar(lambda: any('Resumen de las últimas' in d['text'] for _, _, d in tg.enviados()), 5)
+        await parar(application)
+
+    asyncio.run(escenario())
+
+    conn = bot.conectar_chat(CHAT)
+    por_tema = dict(conn.execute(
+        'SELECT thread_id, COUNT(*) FROM mensajes WHERE chat_id = ? GROUP BY thread_id', (CHAT,)
+    ).fetchall())
+    conn.close()
+    assert por_tema == {10: 3, 20: 3}
+
+    respuestas = [d for _, _, d in tg.enviados() if d['chat_id'] == CHAT]
+    assert respuestas and all(d.get('message_thread_id') == TEMAS[0] for d in respuestas)
+    resumen = respuestas[-1]['text']
+    assert '(3 mensajes analizados)' in resumen
+    assert 'tema 10 mensaje 2' in resumen and 'tema 20' not in resumen
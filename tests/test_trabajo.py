@@ -0,0 +1,26 @@
+"""Procesos de trabajo: el rate limit de BGG es uno solo para todos los procesos"""
+
+import asyncio
+
+
+def test_pausa_de_bgg_compartida_entre_el_pool_y_el_proceso_principal(bot, monkeypatch):
+    # Los trabajadores ('spawn') importan el bot de nuevo y leen la pausa del entorno
+    monkeypatch.setenv('BGG_PAUSA_S', '0.2')
+    monkeypatch.setattr(bot, 'BGG_PAUSA_S', 0.2)
+    monkeypatch.setattr(bot, 'PROCESOS_TRABAJO', '2')
+    bot.iniciar_pool_trabajo()
+
+    async def probar():
+        # /datos en el pool y la precarga en un hilo del proceso principal, a la vez
+        en_pool = [bot.en_trabajador(bot.turno_bgg) for _ in range(4)]
+        en_hilo = [asyncio.to_thread(bot.turno_bgg) for _ in range(2)]
+        return await asyncio.gather(*en_pool, *en_hilo)
+
+    try:
+        instantes = sorted(asyncio.run(probar()))
+    finally:
+        bot.detener_pool_trabajo()
+
+    separaciones = [b - a for a, b in zip(instantes, instantes[1:])]
+    assert len(instantes) == 6
+    assert min(separaciones) >= 0.2 - 1e-6